@@ -12,13 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import base64
+import datetime
+import email.parser
+import json
 import os
 import posixpath
+import socket
 import sys
 import tempfile
+import threading
+import urllib.parse
 import uuid
 
+import google_crc32c
 import pytest
+import tornado.httpserver
+import tornado.web
 
 from google.cloud import storage
 from gcs_contents_manager import CombinedContentsManager
@@ -90,6 +101,7 @@ def jp_server_config(
     yield {
         "ServerApp": {
             "contents_manager_class": CombinedContentsManager,
+            "jpserver_extensions": {"gcs_contents_manager": True},
         },
         "CombinedContentsManager": {
             "allow_hidden": allow_hidden,
@@ -115,3 +127,402 @@ def jp_server_config(
             del os.environ[k]
     for k in original_cloudsdk_env:
         os.environ[k] = original_cloudsdk_env[k]
+
+
+class FakeGCSBucket:
+    """In-memory state of a bucket served by the fake GCS JSON API."""
+
+    def __init__(self, name):
+        self.name = name
+        self.time_created = self._now()
+        self.objects = {}
+        self.content_encodings = {}
+        self.custom_metadata = {}
+        self.upload_sessions = {}
+        self.versioning = False
+        self.noncurrent = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _now():
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return now.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+    @staticmethod
+    def crc32c(data):
+        crc32c = google_crc32c.Checksum(data).digest()
+        return base64.b64encode(crc32c).decode("ascii")
+
+    def version(self, name, generation=None):
+        """Return a generation of an object, with its encoding and metadata.
+
+        The live generation is returned if `generation` is None, and None
+        if there is no such generation.
+        """
+        live = self.objects.get(name, None)
+        if live and (generation is None or int(generation) == live[2]):
+            return live, self.content_encodings[name], self.custom_metadata[name]
+        if generation is None:
+            return None
+        return self.noncurrent.get((name, int(generation)), None)
+
+    def resource(self, name, generation=None):
+        stored, content_encoding, metadata = self.version(name, generation)
+        data, content_type, generation, created, updated = stored
+        return {
+            "kind": "storage#object",
+            "bucket": self.name,
+            "name": name,
+            "generation": str(generation),
+            "size": str(len(data)),
+            "contentType": content_type,
+            "crc32c": self.crc32c(data),
+            "contentEncoding": content_encoding,
+            "metadata": metadata,
+            "timeCreated": created,
+            "updated": updated,
+        }
+
+    def write(
+        self,
+        name,
+        data,
+        content_type,
+        if_generation_match=None,
+        content_encoding=None,
+        metadata=None,
+    ):
+        with self.lock:
+            existing = self.objects.get(name, None)
+            current_generation = existing[2] if existing else 0
+            if (
+                if_generation_match is not None
+                and int(if_generation_match) != current_generation
+            ):
+                return None
+            if existing and self.versioning:
+                self.noncurrent[(name, current_generation)] = self.version(name)
+            self.generation += 1
+            now = self._now()
+            created = existing[3] if existing else now
+            self.objects[name] = (data, content_type, self.generation, created, now)
+            self.content_encodings[name] = content_encoding
+            self.custom_metadata[name] = metadata
+            return self.resource(name)
+
+    def delete(self, name, if_generation_match=None, generation=None):
+        """Delete an object, and return the status code of the deletion."""
+        with self.lock:
+            live = self.objects.get(name, None)
+            if generation is not None and not (live and int(generation) == live[2]):
+                if self.noncurrent.pop((name, int(generation)), None) is None:
+                    return 404
+                return 204
+            if live is None:
+                return 404
+            if if_generation_match is not None and int(if_generation_match) != live[2]:
+                return 412
+            # Deleting a specific generation deletes it for good.
+            if self.versioning and generation is None:
+                self.noncurrent[(name, live[2])] = self.version(name)
+            del self.objects[name]
+            return 204
+
+
+class FakeGCSHandler(tornado.web.RequestHandler):
+    def initialize(self, buckets):
+        self.buckets = buckets
+
+    def bucket(self, bucket_name):
+        if bucket_name not in self.buckets:
+            self.buckets[bucket_name] = FakeGCSBucket(bucket_name)
+        return self.buckets[bucket_name]
+
+    def write_resource(self, resource):
+        if resource is None:
+            self.set_status(412)
+        else:
+            self.write(json.dumps(resource))
+
+    def get(self, bucket_name, object_name=None, *unused):
+        bucket = self.bucket(bucket_name)
+        if object_name is None:
+            return self.write(
+                {
+                    "name": bucket.name,
+                    "timeCreated": bucket.time_created,
+                    "versioning": {"enabled": bucket.versioning},
+                }
+            )
+        version = bucket.version(object_name, self.get_argument("generation", None))
+        if version is None:
+            return self.send_error(404)
+        if self.get_argument("alt", "json") == "media":
+            (data, content_type, generation, _, _), content_encoding, _ = version
+            if_generation_match = self.get_argument("ifGenerationMatch", None)
+            if if_generation_match and int(if_generation_match) != generation:
+                return self.send_error(412)
+            if_generation_not_match = self.get_argument("ifGenerationNotMatch", None)
+            if if_generation_not_match and int(if_generation_not_match) == generation:
+                self.set_status(304)
+                return
+            self.set_header("X-Goog-Hash", f"crc32c={bucket.crc32c(data)}")
+            byte_range = self.request.headers.get("Range")
+            if byte_range:
+                start, end = byte_range[len("bytes=") :].split("-")
+                self.set_status(206)
+                data = data[int(start) : int(end) + 1]
+            if content_encoding:
+                self.set_header("Content-Encoding", content_encoding)
+            self.set_header("Content-Type", content_type or "application/octet-stream")
+            self.set_header("X-Goog-Generation", str(generation))
+            return self.write(data)
+        return self.write_resource(
+            bucket.resource(object_name, self.get_argument("generation", None))
+        )
+
+    def patch(self, bucket_name):
+        bucket = self.bucket(bucket_name)
+        request = json.loads(self.request.body)
+        bucket.versioning = request.get("versioning", {}).get("enabled", False)
+        self.get(bucket_name)
+
+    def delete(self, bucket_name, object_name):
+        status = self.bucket(bucket_name).delete(
+            object_name,
+            self.get_argument("ifGenerationMatch", None),
+            self.get_argument("generation", None),
+        )
+        if status >= 300:
+            return self.send_error(status)
+        self.set_status(status)
+
+
+class FakeGCSListHandler(FakeGCSHandler):
+    def get(self, bucket_name):
+        bucket = self.bucket(bucket_name)
+        prefix = self.get_argument("prefix", "")
+        delimiter = self.get_argument("delimiter", None)
+        max_results = int(self.get_argument("maxResults", "1000"))
+        start = int(self.get_argument("pageToken", "0"))
+        entries = []
+        for name in sorted(bucket.objects):
+            if not name.startswith(prefix):
+                continue
+            if delimiter and delimiter in name[len(prefix) :]:
+                rest = name[len(prefix) :]
+                subdir = prefix + rest[: rest.index(delimiter) + len(delimiter)]
+                if subdir not in entries:
+                    entries.append(subdir)
+                continue
+            entries.append(bucket.resource(name))
+        if self.get_argument("versions", "false").lower() == "true":
+            entries.extend(
+                bucket.resource(name, generation)
+                for name, generation in sorted(bucket.noncurrent)
+                if name.startswith(prefix)
+            )
+        page = entries[start : start + max_results]
+        response = {
+            "items": [e for e in page if isinstance(e, dict)],
+            "prefixes": [e for e in page if isinstance(e, str)],
+        }
+        if start + max_results < len(entries):
+            response["nextPageToken"] = str(start + max_results)
+        self.write(response)
+
+
+class FakeGCSUploadHandler(FakeGCSHandler):
+    def write_object(self, bucket, resource, data, params):
+        self.write_resource(
+            bucket.write(
+                resource["name"],
+                data,
+                resource.get("contentType", None),
+                params.get("ifGenerationMatch", None),
+                resource.get("contentEncoding", None),
+                resource.get("metadata", None),
+            )
+        )
+
+    def post(self, bucket_name):
+        bucket = self.bucket(bucket_name)
+        params = {k: self.get_argument(k) for k in self.request.arguments}
+        upload_type = params.get("uploadType", "media")
+        if upload_type == "media":
+            resource = {
+                "name": params["name"],
+                "contentType": self.request.headers.get("Content-Type", None),
+                "contentEncoding": params.get("contentEncoding", None),
+            }
+            return self.write_object(bucket, resource, self.request.body, params)
+        if upload_type == "multipart":
+            # The body is a multipart/related message of the object's
+            # resource as JSON, followed by its contents.
+            content_type = self.request.headers["Content-Type"]
+            boundary = content_type.split("boundary=")[1].strip('"')
+            parts = self.request.body.split(b"--" + boundary.encode("ascii"))[1:-1]
+            resource_part, data_part = [
+                part[2:-2].split(b"\r\n\r\n", 1) for part in parts
+            ]
+            resource = json.loads(resource_part[1])
+            data_headers = dict(
+                line.split(": ", 1) for line in data_part[0].decode().split("\r\n")
+            )
+            data_headers = {k.lower(): v for k, v in data_headers.items()}
+            resource.setdefault("contentType", data_headers["content-type"])
+            return self.write_object(bucket, resource, data_part[1], params)
+        # Resumable uploads are started by sending the object's resource,
+        # and their contents are then sent to the returned session URL.
+        session_id = uuid.uuid4().hex
+        resource = json.loads(self.request.body or b"{}")
+        resource.setdefault("name", params.get("name", None))
+        resource.setdefault(
+            "contentType", self.request.headers.get("X-Upload-Content-Type", None)
+        )
+        bucket.upload_sessions[session_id] = (resource, params, bytearray())
+        self.set_header(
+            "Location",
+            f"{self.request.protocol}://{self.request.host}{self.request.path}"
+            f"?uploadType=resumable&upload_id={session_id}",
+        )
+
+    def put(self, bucket_name):
+        bucket = self.bucket(bucket_name)
+        session = bucket.upload_sessions.get(self.get_argument("upload_id"), None)
+        if session is None:
+            return self.send_error(404)
+        resource, params, data = session
+        data.extend(self.request.body)
+        content_range = self.request.headers.get("Content-Range", "bytes */*")
+        total = content_range.rsplit("/", 1)[1]
+        if total == "*" or int(total) > len(data):
+            self.set_status(308)
+            if data:
+                self.set_header("Range", f"bytes=0-{len(data) - 1}")
+            return
+        del bucket.upload_sessions[self.get_argument("upload_id")]
+        self.write_object(bucket, resource, bytes(data), params)
+
+    def delete(self, bucket_name):
+        bucket = self.bucket(bucket_name)
+        bucket.upload_sessions.pop(self.get_argument("upload_id"), None)
+        self.set_status(499)
+
+
+class FakeGCSBatchHandler(FakeGCSHandler):
+    """Handles batches of object deletions."""
+
+    def post(self):
+        content_type = self.request.headers["Content-Type"]
+        message = email.parser.Parser().parsestr(
+            f"Content-Type: {content_type}\n\n{self.request.body.decode()}"
+        )
+        boundary = uuid.uuid4().hex
+        for part in message.get_payload():
+            request_line = part.get_payload().splitlines()[0]
+            method, url, _ = request_line.split(" ")
+            url = urllib.parse.urlsplit(url)
+            _, bucket_name, _, object_name = url.path.split("/")[3:7]
+            params = dict(urllib.parse.parse_qsl(url.query))
+            status = 405
+            if method == "DELETE":
+                status = self.bucket(bucket_name).delete(
+                    urllib.parse.unquote(object_name),
+                    params.get("ifGenerationMatch", None),
+                    params.get("generation", None),
+                )
+            self.write(
+                f"--{boundary}\r\nContent-Type: application/http\r\n\r\n"
+                f"HTTP/1.1 {status} Status\r\n\r\n\r\n"
+            )
+        self.write(f"--{boundary}--\r\n")
+        self.set_header("Content-Type", f"multipart/mixed; boundary={boundary}")
+
+
+class FakeGCSComposeHandler(FakeGCSHandler):
+    def post(self, bucket_name, object_name):
+        bucket = self.bucket(bucket_name)
+        request = json.loads(self.request.body)
+        sources = [source["name"] for source in request["sourceObjects"]]
+        if len(sources) > 32:
+            return self.send_error(400)
+        data = b"".join(bucket.objects[source][0] for source in sources)
+        resource = bucket.write(
+            object_name,
+            data,
+            request.get("destination", {}).get("contentType", None),
+            self.get_argument("ifGenerationMatch", None),
+        )
+        self.write_resource(resource)
+
+
+class FakeGCSRewriteHandler(FakeGCSHandler):
+    def post(self, bucket_name, object_name, dest_bucket_name, dest_object_name):
+        version = self.bucket(bucket_name).version(
+            object_name, self.get_argument("sourceGeneration", None)
+        )
+        if version is None:
+            return self.send_error(404)
+        source, content_encoding, metadata = version
+        resource = self.bucket(dest_bucket_name).write(
+            dest_object_name,
+            source[0],
+            source[1],
+            content_encoding=content_encoding,
+            metadata=metadata,
+        )
+        self.write(
+            {
+                "done": True,
+                "resource": resource,
+                "totalBytesRewritten": str(len(source[0])),
+                "objectSize": str(len(source[0])),
+            }
+        )
+
+
+@pytest.fixture
+def fake_gcs_endpoint():
+    """Serve an in-memory stand-in for the GCS JSON API on a local port."""
+    buckets = {}
+    args = {"buckets": buckets}
+    app = tornado.web.Application(
+        [
+            (r"/storage/v1/b/([^/]+)", FakeGCSHandler, args),
+            (r"/storage/v1/b/([^/]+)/o", FakeGCSListHandler, args),
+            (r"/storage/v1/b/([^/]+)/o/([^/]+)", FakeGCSHandler, args),
+            (r"/storage/v1/b/([^/]+)/o/([^/]+)/compose", FakeGCSComposeHandler, args),
+            (
+                r"/storage/v1/b/([^/]+)/o/([^/]+)/rewriteTo/b/([^/]+)/o/([^/]+)",
+                FakeGCSRewriteHandler,
+                args,
+            ),
+            (r"/download/storage/v1/b/([^/]+)/o/([^/]+)", FakeGCSHandler, args),
+            (r"/upload/storage/v1/b/([^/]+)/o", FakeGCSUploadHandler, args),
+            (r"/batch/storage/v1", FakeGCSBatchHandler, args),
+        ]
+    )
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        server = tornado.httpserver.HTTPServer(app)
+        server.listen(port, address="127.0.0.1")
+        loop.call_soon(started.set)
+        loop.run_forever()
+        server.stop()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait()
+    yield f"http://127.0.0.1:{port}"
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
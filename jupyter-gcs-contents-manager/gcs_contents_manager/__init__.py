@@ -0,0 +1,89 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Setup:
+#   First, install the GCS Python client library using the
+#   command: `pip install google-cloud-storage`
+#
+#   Then, install this package by running `pip install .` from the
+#   directory containing its setup.py.
+#
+#   Finally, make sure you have application default credentials
+#   set up by running: `gcloud auth application-default login`
+#
+# Usage: Add the following lines to your Jupyter config file
+# (e.g. jupyter_server_config.py):
+#
+#   from gcs_contents_manager import CombinedContentsManager
+#   c.ServerApp.contents_manager_class = CombinedContentsManager
+#   c.GCSContentsManager.bucket_name = '${NOTEBOOK_BUCKET}'
+#   c.GCSContentsManager.bucket_notebooks_path = '${NOTEBOOK_PATH}'
+#   c.GCSContentsManager.project = '${NOTEBOOK_BUCKET_PROJECT}'
+#   c.FileContentsManager.root_dir = '${LOCAL_DISK_NOTEBOOK_DIR}'
+#
+# For '${NOTEBOOK_BUCKET}' specify the name of the GCS bucket where
+# you want to store your notebooks, and for '${NOTEBOOK_PATH}',
+# specify the name of the directory within that bucket that will be
+# treated as your root directory by Jupyter. For
+# '${NOTEBOOK_BUCKET_PROJECT}', specify the ID of the GCP project
+# that owns the GCS bucket.
+#
+# If you run JupyterLab with widgets that assume the current file
+# browser path is a location on your local disk (e.g. the
+# jupyterlab-git extension), then you will also need to set up a
+# link somewhere on your local disk for those widgets to use.
+#
+# For example, you could run the following:
+#
+#   mkdir -p ~/.jupyter/symlinks_for_jupyterlab_widgets
+#   ln -s ${LOCAL_DISK_NOTEBOOK_DIR} ~/.jupyter/symlinks_for_jupyterlab_widgets/Local\ Disk
+#
+# And then add the following snippet to your Jupyter config:
+#
+#   c.CombinedContentsManager.root_dir = '~/.jupyter/symlinks_for_jupyterlab_widgets'
+
+
+from jupyter_server.base.handlers import path_regex
+from jupyter_server.utils import url_path_join
+
+from gcs_contents_manager.async_client import AsyncGCSBasedFileManager, AsyncGCSClient
+from gcs_contents_manager.caches import ContentCache, MetadataCache
+from gcs_contents_manager.checkpoints import (
+    CombinedCheckpointsManager,
+    GCSCheckpointManager,
+)
+from gcs_contents_manager.contents import CombinedContentsManager, GCSContentsManager
+from gcs_contents_manager.executors import InstrumentedExecutor
+from gcs_contents_manager.files import (
+    GCSBasedFileManager,
+    GCSFileManagerBase,
+    ListingEntry,
+)
+from gcs_contents_manager.handlers import GCSListingHandler
+from gcs_contents_manager.index import MetadataIndex
+from gcs_contents_manager.stager import WriteBackStager
+from gcs_contents_manager.utils import GCSObject, normalize_path, utf8_encoding
+
+
+def _jupyter_server_extension_points():
+    return [{"module": "gcs_contents_manager"}]
+
+
+def _load_jupyter_server_extension(server_app):
+    host_pattern = ".*$"
+    base_url = server_app.web_app.settings["base_url"]
+    listing_url = url_path_join(base_url, "api", "gcs", "listing")
+    server_app.web_app.add_handlers(
+        host_pattern, [(listing_url + path_regex, GCSListingHandler)]
+    )
@@ -0,0 +1,839 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import functools
+import json
+import random
+import urllib.parse
+
+from jupyter_server.utils import url_path_join
+
+from tornado.web import HTTPError
+
+import google.auth
+import google.auth.credentials
+import google.auth.transport.requests
+
+try:
+    import aiohttp
+except ImportError:
+    # The asyncio storage backend is optional.
+    aiohttp = None
+
+from gcs_contents_manager.caches import MetadataCache
+from gcs_contents_manager.files import GCSFileManagerBase
+from gcs_contents_manager.utils import (
+    GCSObject,
+    _CLASSIFY_MAX_RESULTS,
+    _ContentEncoder,
+    _ContentTooLarge,
+    _GCS_API_ENDPOINT,
+    _GCS_SCOPES,
+    _MAX_COMPOSE_SOURCES,
+    _READ_CHUNK_SIZE,
+    _parse_timestamp,
+    _read_notebook,
+    _slice_chunks,
+    _storage_api_endpoint,
+    _write_notebook,
+    normalize_path,
+    utf8_encoding,
+)
+
+# The statuses of GCS responses worth retrying, as the google-cloud-storage
+# library does, and how many times (and how long) to retry them.
+_RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+_MAX_RETRIES = 5
+_INITIAL_RETRY_DELAY = 1.0
+_MAX_RETRY_DELAY = 32.0
+
+
+class _RetryableResponse(Exception):
+    def __init__(self, status, body):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+
+
+class AsyncGCSClient:
+    """A minimal asyncio client for the GCS JSON API, scoped to a single bucket."""
+
+    def __init__(
+        self,
+        bucket_name: str,
+        project: str = None,
+        api_endpoint: str = None,
+        max_connections: int = 100,
+    ):
+        if aiohttp is None:
+            raise ImportError(
+                "The asyncio GCS backend requires the `aiohttp` package; "
+                "install it using `pip install aiohttp`"
+            )
+        self.bucket_name = bucket_name
+        self.project = project
+        self.api_endpoint = _storage_api_endpoint(api_endpoint)
+        self.max_connections = max_connections
+        self._session = None
+        self._credentials = None
+        self._credentials_lock = asyncio.Lock()
+
+    @property
+    def _authenticated(self):
+        return self.api_endpoint == _GCS_API_ENDPOINT
+
+    def _bucket_url(self, upload=False):
+        bucket = urllib.parse.quote(self.bucket_name, safe="")
+        upload_prefix = "upload/" if upload else ""
+        return f"{self.api_endpoint}/{upload_prefix}storage/v1/b/{bucket}"
+
+    def _object_url(self, name, *suffix):
+        object_name = urllib.parse.quote(name, safe="")
+        return "/".join([self._bucket_url(), "o", object_name, *suffix])
+
+    async def _auth_headers(self):
+        if not self._authenticated:
+            return {}
+        async with self._credentials_lock:
+            loop = asyncio.get_running_loop()
+            if self._credentials is None:
+                self._credentials, _ = await loop.run_in_executor(
+                    None, functools.partial(google.auth.default, scopes=_GCS_SCOPES)
+                )
+            if not self._credentials.valid:
+                await loop.run_in_executor(
+                    None,
+                    self._credentials.refresh,
+                    google.auth.transport.requests.Request(),
+                )
+        return {"Authorization": f"Bearer {self._credentials.token}"}
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections)
+            )
+        return self._session
+
+    async def _request(
+        self,
+        method,
+        url,
+        allow_missing=False,
+        max_size=0,
+        response_headers=None,
+        body_factory=None,
+        **kwargs,
+    ):
+        """Send a request to GCS and return the body of the response.
+
+        Throttled requests, server errors and connection failures are retried
+        with exponential backoff, but only if repeating the request is safe:
+        reads, and writes or deletes with a generation precondition.
+        `body_factory`, if given, builds a fresh request body for each attempt.
+        """
+        params = kwargs.pop("params", {})
+        params = {k: str(v) for k, v in params.items() if v is not None}
+        idempotent = method == "GET" or "ifGenerationMatch" in params
+        delay = _INITIAL_RETRY_DELAY
+        for retries_left in range(_MAX_RETRIES, -1, -1):
+            if body_factory is not None:
+                kwargs["data"] = body_factory()
+            try:
+                return await self._send(
+                    method,
+                    url,
+                    allow_missing,
+                    max_size,
+                    response_headers,
+                    params=params,
+                    **kwargs,
+                )
+            except (_RetryableResponse, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not (idempotent and retries_left):
+                    if isinstance(e, _RetryableResponse):
+                        raise HTTPError(
+                            500,
+                            f"GCS request failed with status {e.status}: "
+                            + e.body.decode(utf8_encoding, errors="replace"),
+                        )
+                    raise
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, _MAX_RETRY_DELAY)
+
+    async def _send(
+        self, method, url, allow_missing, max_size, response_headers, **kwargs
+    ):
+        headers = dict(kwargs.pop("headers", {}))
+        headers.update(await self._auth_headers())
+        async with self._get_session().request(
+            method, url, headers=headers, **kwargs
+        ) as response:
+            if response_headers is not None:
+                response_headers.update(
+                    (name.lower(), value) for name, value in response.headers.items()
+                )
+            if response.status < 300 and max_size:
+                body = bytearray()
+                async for chunk in response.content.iter_chunked(_READ_CHUNK_SIZE):
+                    body += chunk
+                    if len(body) > max_size:
+                        raise _ContentTooLarge()
+                return bytes(body)
+            body = await response.read()
+            if response.status == 404 and allow_missing:
+                return None
+            if response.status in _RETRYABLE_STATUSES:
+                raise _RetryableResponse(response.status, body)
+            if response.status >= 300:
+                status = response.status
+                if status not in (304, 403, 404, 412):
+                    status = 500
+                raise HTTPError(
+                    status,
+                    f"GCS request failed with status {response.status}: "
+                    + body.decode(utf8_encoding, errors="replace"),
+                )
+            return body
+
+    async def _json_request(self, method, url, allow_missing=False, **kwargs):
+        body = await self._request(method, url, allow_missing=allow_missing, **kwargs)
+        if body is None:
+            return None
+        return json.loads(body) if body else {}
+
+    async def get_bucket(self):
+        return await self._json_request("GET", self._bucket_url())
+
+    async def get_object(self, name):
+        resource = await self._json_request(
+            "GET", self._object_url(name), allow_missing=True
+        )
+        return GCSObject(resource) if resource else None
+
+    async def download(
+        self,
+        name,
+        start=None,
+        end=None,
+        if_generation_match=None,
+        if_generation_not_match=None,
+        max_size=0,
+    ):
+        """Return the generation read and the bytes [start, end) of an object."""
+        headers = {}
+        if start is not None:
+            last = "" if end is None else end - 1
+            headers["Range"] = f"bytes={start}-{last}"
+        response_headers = {}
+        contents = await self._request(
+            "GET",
+            self._object_url(name),
+            allow_missing=True,
+            max_size=max_size,
+            response_headers=response_headers,
+            headers=headers,
+            params={
+                "alt": "media",
+                "ifGenerationMatch": if_generation_match,
+                "ifGenerationNotMatch": if_generation_not_match,
+            },
+        )
+        if contents is None:
+            return None, None
+        return int(response_headers["x-goog-generation"]), contents
+
+    async def list_objects(
+        self, prefix, delimiter=None, max_results=None, page_token=None
+    ):
+        """Return the objects, prefixes and next page token of one listing page."""
+        resource = await self._json_request(
+            "GET",
+            f"{self._bucket_url()}/o",
+            params={
+                "prefix": prefix,
+                "delimiter": delimiter,
+                "maxResults": max_results,
+                "pageToken": page_token,
+            },
+        )
+        objects = [GCSObject(item) for item in resource.get("items", [])]
+        return objects, resource.get("prefixes", []), resource.get("nextPageToken")
+
+    async def list_all_objects(self, prefix, delimiter=None):
+        """List every object (and prefix) under the given prefix, page by page."""
+        objects, prefixes, page_token = await self.list_objects(prefix, delimiter)
+        while page_token:
+            more_objects, more_prefixes, page_token = await self.list_objects(
+                prefix, delimiter, page_token=page_token
+            )
+            objects.extend(more_objects)
+            prefixes.extend(more_prefixes)
+        return objects, prefixes
+
+    async def upload(
+        self,
+        name,
+        data,
+        content_type,
+        content_encoding=None,
+        if_generation_match=None,
+        metadata=None,
+    ):
+        content_type = content_type or "application/octet-stream"
+        resource = {"name": name, "contentType": content_type}
+        if content_encoding:
+            resource["contentEncoding"] = content_encoding
+        if metadata:
+            resource["metadata"] = metadata
+
+        def multipart_body():
+            with aiohttp.MultipartWriter("related") as body:
+                body.append_json(resource)
+                body.append(data, {"Content-Type": content_type})
+            return body
+
+        resource = await self._json_request(
+            "POST",
+            f"{self._bucket_url(upload=True)}/o",
+            params={
+                "uploadType": "multipart",
+                "ifGenerationMatch": if_generation_match,
+            },
+            body_factory=multipart_body,
+        )
+        return GCSObject(resource)
+
+    async def compose(self, name, source_names, content_type, if_generation_match=None):
+        resource = await self._json_request(
+            "POST",
+            self._object_url(name, "compose"),
+            params={"ifGenerationMatch": if_generation_match},
+            json={
+                "sourceObjects": [{"name": source} for source in source_names],
+                "destination": {"contentType": content_type},
+            },
+        )
+        return GCSObject(resource)
+
+    async def copy(self, source_name, destination_name):
+        """Copy an object server-side, continuing the rewrite until it is done."""
+        url = self._object_url(
+            source_name,
+            "rewriteTo",
+            "b",
+            urllib.parse.quote(self.bucket_name, safe=""),
+            "o",
+            urllib.parse.quote(destination_name, safe=""),
+        )
+        rewrite_token = None
+        while True:
+            resource = await self._json_request(
+                "POST", url, params={"rewriteToken": rewrite_token}
+            )
+            if resource.get("done", False):
+                return GCSObject(resource["resource"])
+            rewrite_token = resource["rewriteToken"]
+
+    async def delete(self, name, if_generation_match=None):
+        """Delete an object, returning False if it did not exist."""
+        body = await self._request(
+            "DELETE",
+            self._object_url(name),
+            allow_missing=True,
+            params={"ifGenerationMatch": if_generation_match},
+        )
+        return body is not None
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class AsyncGCSBasedFileManager(GCSFileManagerBase):
+    """An asyncio implementation of the `GCSBasedFileManager` interface."""
+
+    def __init__(
+        self,
+        project: str,
+        bucket_name: str,
+        bucket_path_prefix: str,
+        metadata_cache_size: int = 1024,
+        metadata_cache_ttl: float = 5.0,
+        max_inline_content_size: int = 0,
+        max_listing_entries: int = 0,
+        content_cache_size: int = 64 * 1024 * 1024,
+        gzip_uploads: bool = False,
+        fast_notebook_io: bool = False,
+        api_endpoint: str = None,
+        max_connections: int = 100,
+        log=None,
+    ):
+        super().__init__(
+            project,
+            bucket_name,
+            bucket_path_prefix,
+            metadata_cache_size=metadata_cache_size,
+            metadata_cache_ttl=metadata_cache_ttl,
+            max_inline_content_size=max_inline_content_size,
+            max_listing_entries=max_listing_entries,
+            content_cache_size=content_cache_size,
+            gzip_uploads=gzip_uploads,
+            fast_notebook_io=fast_notebook_io,
+            log=log,
+        )
+        self.client = AsyncGCSClient(
+            bucket_name,
+            project=project,
+            api_endpoint=api_endpoint,
+            max_connections=max_connections,
+        )
+        self._bucket_time_created = None
+        # Limits the number of requests issued concurrently by a single operation,
+        # so that one large operation does not take over the whole connection pool.
+        self._fanout_semaphore = asyncio.Semaphore(max(1, max_connections // 2))
+        self._background_tasks = set()
+
+    @property
+    def _dir_timestamp(self):
+        return self._bucket_time_created
+
+    async def _load_bucket_metadata(self):
+        if self._bucket_time_created is None:
+            bucket = await self.client.get_bucket()
+            self._bucket_time_created = _parse_timestamp(bucket.get("timeCreated"))
+
+    async def _fanout(self, coroutines, return_exceptions=False):
+        async def bounded(coroutine):
+            async with self._fanout_semaphore:
+                return await coroutine
+
+        return await asyncio.gather(
+            *[bounded(c) for c in coroutines], return_exceptions=return_exceptions
+        )
+
+    def _run_in_background(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        task.add_done_callback(self._log_background_failure)
+
+    async def close(self):
+        """Wait for any background operations and then close the GCS client."""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        await self.client.close()
+
+    def _log_background_failure(self, task):
+        if not task.cancelled() and task.exception():
+            self.log.warning("Background GCS operation failed: %s", task.exception())
+
+    async def _object(self, path):
+        blob_name = self._gcs_path(path)
+        obj = self._metadata_cache.get(("blob", blob_name))
+        if obj is MetadataCache.MISSING:
+            obj = await self.client.get_object(blob_name)
+            self._metadata_cache.put(("blob", blob_name), obj)
+        return obj
+
+    async def _classify(self, path):
+        path = normalize_path(path)
+        blob_name = self._gcs_path(path)
+        if not path:
+            await self._load_bucket_metadata()
+            return "directory", None
+
+        obj = self._metadata_cache.get(("blob", blob_name))
+        is_dir = self._metadata_cache.get(("dir", blob_name))
+        if obj is not MetadataCache.MISSING:
+            if obj:
+                return "file", obj
+            if is_dir is not MetadataCache.MISSING:
+                return ("directory" if is_dir else None), None
+
+        candidates, _, _ = await self.client.list_objects(
+            blob_name, max_results=_CLASSIFY_MAX_RESULTS
+        )
+        obj, is_dir, unknown = self._classify_candidates(
+            blob_name, candidates, _CLASSIFY_MAX_RESULTS
+        )
+        if unknown:
+            contents, _, _ = await self.client.list_objects(
+                blob_name + "/", max_results=1
+            )
+            is_dir = bool(contents)
+        self._metadata_cache.put(("blob", blob_name), obj)
+        self._metadata_cache.put(("dir", blob_name), is_dir)
+        if obj:
+            return "file", obj
+        return ("directory" if is_dir else None), None
+
+    async def file_exists(self, path):
+        path = normalize_path(path)
+        if not path:
+            return False
+        path_type, _ = await self._classify(path)
+        return path_type == "file"
+
+    async def dir_exists(self, path):
+        path_type, _ = await self._classify(path)
+        return path_type == "directory"
+
+    async def _combine_chunks(self, path, content_type):
+        chunk_objects, _ = await self.client.list_all_objects(self._chunks_path(path))
+        # The last chunk is -1, which lexicographically comes first; move it to the end.
+        source_names = [obj.name for obj in chunk_objects[1:] + chunk_objects[0:1]]
+        intermediate_prefix = url_path_join(self._chunks_dir(path), "compose#")
+        intermediate_names = []
+        level = 0
+        while len(source_names) > _MAX_COMPOSE_SOURCES:
+            groups = [
+                source_names[i : i + _MAX_COMPOSE_SOURCES]
+                for i in range(0, len(source_names), _MAX_COMPOSE_SOURCES)
+            ]
+            source_names = [
+                f"{intermediate_prefix}{level:03d}-{i:09d}" for i in range(len(groups))
+            ]
+            await self._fanout(
+                [
+                    self.client.compose(target, group, content_type)
+                    for target, group in zip(source_names, groups)
+                ]
+            )
+            intermediate_names.extend(source_names)
+            level += 1
+        obj = await self.client.compose(
+            self._gcs_path(path), source_names, content_type, if_generation_match=0
+        )
+        self._run_in_background(
+            self._fanout(
+                [self.client.delete(c.name, c.generation) for c in chunk_objects]
+                + [self.client.delete(name) for name in intermediate_names]
+            )
+        )
+        return obj
+
+    async def create_file(self, content, content_type, path, chunk):
+        if isinstance(content, str):
+            content = content.encode(utf8_encoding)
+        blob_name = self._gcs_path(path)
+        if not chunk:
+            content_encoding = self._content_encoding(content_type)
+            data = content
+            if content_encoding:
+                loop = asyncio.get_running_loop()
+                data = await loop.run_in_executor(
+                    None, self._encode_for_upload, content, content_encoding
+                )
+            obj = await self._object(path)
+            if self._is_unchanged(blob_name, obj, data, content_type, content_encoding):
+                # The cached metadata may be stale, so check with GCS first.
+                obj = await self.client.get_object(blob_name)
+                if self._is_unchanged(
+                    blob_name, obj, data, content_type, content_encoding
+                ):
+                    return self._skip_upload(path, obj, data)
+        try:
+            if chunk:
+                obj = await self.client.upload(
+                    f"{self._chunks_path(path)}{chunk:09d}", content, content_type
+                )
+                if chunk == -1:
+                    obj = await self._combine_chunks(path, content_type)
+            else:
+                obj = await self.client.upload(
+                    blob_name,
+                    data,
+                    content_type,
+                    content_encoding=content_encoding,
+                    if_generation_match=self._expected_generation(blob_name, obj),
+                    metadata=self._upload_metadata(obj, content, content_encoding),
+                )
+        except HTTPError as e:
+            if e.status_code != 412:
+                raise
+            raise self._conflict(path)
+        finally:
+            self._invalidate_metadata(blob_name)
+        if not chunk or chunk == -1:
+            self._metadata_cache.put(("blob", blob_name), obj)
+            self._remember_generation(obj)
+        if not chunk:
+            self._content_cache.put(blob_name, obj.generation, content)
+        return self._file_metadata(path, obj)
+
+    async def create_notebook(self, nb, path):
+        loop = asyncio.get_running_loop()
+        content = await loop.run_in_executor(
+            None, _write_notebook, nb, self.fast_notebook_io
+        )
+        return await self.create_file(content, "text/plain", path, None)
+
+    async def _download(self, obj, max_size=0):
+        """Return the generation and contents of an object, cached if current."""
+        cached = self._content_cache.get(obj.name)
+        if cached is not None and cached[0] == obj.generation:
+            return cached[0], cached[1]
+        # The metadata of `obj` may be stale, so read whatever is live.
+        try:
+            generation, contents = await self.client.download(
+                obj.name,
+                if_generation_not_match=cached[0] if cached else None,
+                max_size=max_size,
+            )
+        except HTTPError as e:
+            if e.status_code != 304:
+                raise
+            return cached[0], cached[1]
+        if contents is None:
+            self._invalidate_metadata(obj.name)
+            raise HTTPError(404, "No such file; it was deleted while being read")
+        if generation != obj.generation:
+            self._metadata_cache.invalidate(("blob", obj.name))
+        self._content_cache.put(obj.name, generation, contents)
+        return generation, contents
+
+    async def file_contents(self, path: str, blob=None):
+        obj = blob or await self._object(path)
+        if not obj:
+            return None, None
+        _, contents = await self._download(obj)
+        return contents, obj.content_type
+
+    async def notebook_contents(self, path: str, blob=None, max_size=0):
+        obj = blob or await self._object(path)
+        if not obj:
+            return None
+        _, notebook = await self._notebook_contents(obj, max_size)
+        return notebook
+
+    async def _notebook_contents(self, obj, max_size=0):
+        """Return the generation that was read of a notebook, and its contents."""
+        # Cached notebooks are pickled, which is too slow for the event loop.
+        loop = asyncio.get_running_loop()
+        notebook = await loop.run_in_executor(
+            None, self._content_cache.get_notebook, obj.name, obj.generation
+        )
+        if notebook is not None:
+            return obj.generation, notebook
+        generation, content_bytes = await self._download(obj, max_size)
+        notebook = await loop.run_in_executor(
+            None, _read_notebook, content_bytes, self.fast_notebook_io
+        )
+        await loop.run_in_executor(
+            None, self._content_cache.put_notebook, obj.name, generation, notebook
+        )
+        return generation, notebook
+
+    async def iter_file_contents(self, path: str, start=0, end=None, blob=None):
+        """Download the bytes [start, end) of a file, one range at a time."""
+        # Every range is read from the generation of `blob`, so unless the
+        # caller just fetched it, look up the current one.
+        obj = blob or await self.client.get_object(self._gcs_path(path))
+        if not obj:
+            raise HTTPError(404, f'No such file: "{path}"')
+        if obj.content_encoding == "gzip":
+            # Compressed offsets don't map to file offsets, so read it in one go.
+            _, contents = await self._download(obj)
+            for chunk in _slice_chunks([contents], start, end):
+                yield chunk
+            return
+        for range_start, range_end in self._byte_ranges(obj.size, start, end):
+            try:
+                _, contents = await self.client.download(
+                    obj.name,
+                    start=range_start,
+                    end=range_end,
+                    if_generation_match=obj.generation,
+                )
+            except HTTPError as e:
+                if e.status_code != 412:
+                    raise
+                contents = None
+            if contents is None:
+                raise HTTPError(409, f'"{path}" was modified while being read')
+            yield contents
+
+    async def read_range(self, path: str, start: int, end=None):
+        """Read the bytes [start, end) of a file."""
+        return b"".join([c async for c in self.iter_file_contents(path, start, end)])
+
+    async def delete_file(self, path):
+        blob_name = self._gcs_path(path)
+        try:
+            obj = await self._object(path)
+            if obj:
+                # The path corresponds to a regular file; delete it.
+                await self.client.delete(blob_name)
+
+            # The path (possibly) corresponds to a directory. Delete
+            # every file underneath it.
+            contents, _ = await self.client.list_all_objects(self._dir_prefix(path))
+            await self._delete_objects([c.name for c in contents])
+        finally:
+            self._invalidate_metadata(blob_name, recursive=True)
+        return None
+
+    async def _delete_objects(self, names):
+        results = await self._fanout(
+            [self.client.delete(name) for name in names], return_exceptions=True
+        )
+        failed = [
+            name
+            for name, result in zip(names, results)
+            if isinstance(result, Exception)
+        ]
+        if failed:
+            raise HTTPError(
+                500,
+                f"Failed to delete {len(failed)} of {len(names)} objects; "
+                f"for example: {', '.join(failed[:5])}",
+            )
+
+    async def rename_file(self, old_path, new_path):
+        old_name = self._gcs_path(old_path)
+        new_name = self._gcs_path(new_path)
+        try:
+            obj = await self._object(old_path)
+            if obj:
+                await self.client.copy(old_name, new_name)
+                await self.client.delete(old_name)
+                return None
+
+            # The path (possibly) corresponds to a directory. Copy every
+            # file underneath it, and then delete the originals.
+            old_prefix = self._dir_prefix(old_path)
+            new_prefix = self._dir_prefix(new_path)
+            contents, _ = await self.client.list_all_objects(old_prefix)
+            results = await self._fanout(
+                [
+                    self.client.copy(c.name, new_prefix + c.name[len(old_prefix) :])
+                    for c in contents
+                ],
+                return_exceptions=True,
+            )
+            failed = [
+                c.name
+                for c, result in zip(contents, results)
+                if isinstance(result, Exception)
+            ]
+            if failed:
+                raise HTTPError(
+                    500,
+                    f"Failed to copy {len(failed)} of {len(contents)} objects; "
+                    f"for example: {', '.join(failed[:5])}",
+                )
+            await self._delete_objects([c.name for c in contents])
+        finally:
+            self._invalidate_metadata(old_name, recursive=True)
+            self._invalidate_metadata(new_name, recursive=True)
+        return None
+
+    async def mkdir(self, path):
+        await self._load_bucket_metadata()
+        try:
+            await self.client.upload(self._gcs_path(path) + "/", b"", "text/plain")
+        finally:
+            self._invalidate_metadata(self._gcs_path(path))
+        return self._dir_metadata(path)
+
+    async def list_dir(self, path, include_content, compact=False):
+        await self._load_bucket_metadata()
+        dir_obj = self._dir_metadata(path)
+        if not include_content:
+            return dir_obj
+
+        dir_obj["format"] = "json"
+        blob_name_prefix = self._dir_prefix(path)
+        files = {}
+        subdirs = {}
+        page_token = None
+        while True:
+            objects, prefixes, page_token = await self.client.list_objects(
+                blob_name_prefix, delimiter="/", page_token=page_token
+            )
+            subdir_names = [prefix[len(blob_name_prefix) : -1] for prefix in prefixes]
+            has_room = self._add_listing_page(
+                files, subdirs, blob_name_prefix, objects, subdir_names
+            )
+            if not page_token or not has_room:
+                break
+        truncated = page_token is not None
+        return self._finish_listing(dir_obj, files, subdirs, truncated, compact)
+
+    async def list_page(self, path, page_token=None, page_size=None):
+        """See `GCSBasedFileManager.list_page`."""
+        await self._load_bucket_metadata()
+        blob_name_prefix = self._dir_prefix(path)
+        objects, prefixes, page_token = await self.client.list_objects(
+            blob_name_prefix,
+            delimiter="/",
+            max_results=page_size,
+            page_token=page_token,
+        )
+        subdir_names = [prefix[len(blob_name_prefix) : -1] for prefix in prefixes]
+        entries = self._page_entries(blob_name_prefix, objects, subdir_names)
+        return entries, page_token
+
+    async def get_file(self, path, type, include_content, require_hash, compact=False):
+        obj = None
+        if not type:
+            type, obj = await self._classify(path)
+            if not type:
+                return None
+        if type == "directory":
+            return await self.list_dir(path, include_content, compact)
+
+        obj = obj or await self._object(path)
+        if not obj:
+            return None
+
+        file_model = self._file_metadata(path, obj)
+        if require_hash:
+            file_model["hash"] = self._content_hash(obj)
+            file_model["hash_algorithm"] = "crc32c"
+        if not include_content:
+            return file_model
+
+        max_size = self._check_inline_size(path, obj)
+        try:
+            if file_model["type"] == "notebook":
+                file_model["format"] = "json"
+                generation, file_model["content"] = await self._notebook_contents(
+                    obj, max_size
+                )
+            else:
+                file_model["mimetype"], file_model["format"] = self._content_format(obj)
+                encoder = _ContentEncoder(file_model["format"])
+                # Files that fit in a single read are served from the cache,
+                # as are compressed files, which are always read in one go.
+                if obj.content_encoding == "gzip" or obj.size <= _READ_CHUNK_SIZE:
+                    generation, contents = await self._download(obj, max_size)
+                    encoder.update(contents)
+                else:
+                    obj = await self.client.get_object(obj.name)
+                    if not obj:
+                        self._invalidate_metadata(self._gcs_path(path))
+                        return None
+                    generation = obj.generation
+                    async for chunk in self.iter_file_contents(path, blob=obj):
+                        encoder.update(chunk)
+                file_model["content"] = encoder.result()
+        except _ContentTooLarge:
+            raise self._too_large(path)
+        # Later saves replace the generation that was read, which the cached
+        # metadata the model was built from may be older than.
+        self._generations.put(("generation", obj.name), generation)
+        return file_model
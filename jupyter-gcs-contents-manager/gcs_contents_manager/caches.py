@@ -0,0 +1,136 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import pickle
+import threading
+import time
+
+
+class MetadataCache:
+    """A bounded, thread-safe LRU cache whose entries expire after a TTL."""
+
+    # Returned on a cache miss, as `None` is a valid (negative) cached value.
+    MISSING = object()
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return self.MISSING
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return self.MISSING
+            expiry, value = entry
+            if expiry < time.monotonic():
+                del self._entries[key]
+                return self.MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_prefix(self, prefix):
+        """Invalidate every (kind, name) entry whose name has the given prefix."""
+        with self._lock:
+            stale_keys = [key for key in self._entries if key[1].startswith(prefix)]
+            for key in stale_keys:
+                del self._entries[key]
+
+
+class ContentCache:
+    """A bounded, thread-safe LRU cache of file contents of a given generation."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Return the (generation, contents, notebook) entry for a blob, or None."""
+        with self._lock:
+            entry = self._entries.get(name, None)
+            if entry is not None:
+                self._entries.move_to_end(name)
+            return entry
+
+    def get_notebook(self, name, generation):
+        with self._lock:
+            entry = self._entries.get(name, None)
+            if entry is None or entry[0] != generation or entry[2] is None:
+                return None
+            self._entries.move_to_end(name)
+            pickled_notebook = entry[2]
+        return pickle.loads(pickled_notebook)
+
+    @staticmethod
+    def _entry_size(entry):
+        return len(entry[1]) + len(entry[2] or b"")
+
+    def _add(self, name, entry):
+        self._remove(name)
+        self._entries[name] = entry
+        self._size += self._entry_size(entry)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= self._entry_size(evicted)
+
+    def put(self, name, generation, contents):
+        if not self.max_bytes or len(contents) > self.max_bytes or generation is None:
+            return
+        with self._lock:
+            self._add(name, (generation, contents, None))
+
+    def put_notebook(self, name, generation, notebook):
+        """Attach a parsed notebook to the cached contents of the same generation."""
+        pickled_notebook = pickle.dumps(notebook, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            entry = self._entries.get(name, None)
+            if entry is not None and entry[0] == generation:
+                self._add(name, (generation, entry[1], pickled_notebook))
+
+    def _remove(self, name):
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            self._size -= self._entry_size(entry)
+
+    def invalidate(self, name):
+        with self._lock:
+            self._remove(name)
+
+    def invalidate_prefix(self, prefix):
+        with self._lock:
+            for name in [name for name in self._entries if name.startswith(prefix)]:
+                self._remove(name)
@@ -0,0 +1,523 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import datetime
+import json
+
+from jupyter_server.services.contents.checkpoints import (
+    AsyncCheckpoints,
+    AsyncGenericCheckpointsMixin,
+)
+from jupyter_server.utils import url_path_join
+
+from tornado.web import HTTPError
+
+from google.api_core import exceptions as api_exceptions
+
+from gcs_contents_manager.executors import InstrumentedExecutor
+from gcs_contents_manager.files import GCSBasedFileManager, GCSFileManagerBase
+from gcs_contents_manager.utils import normalize_path, utf8_encoding
+
+# The number of times an update of a checkpoint manifest is retried when it
+# races with a concurrent update of the same manifest.
+_MANIFEST_UPDATE_ATTEMPTS = 5
+
+
+class GCSCheckpointManager(AsyncGenericCheckpointsMixin, AsyncCheckpoints):
+    """Checkpoints stored in the same bucket as the checkpointed files."""
+
+    checkpoints_dir = ".ipynb_checkpoints"
+    manifest_name = "manifest.json"
+
+    def __init__(self, *args, **kwargs):
+        self._parent = kwargs["parent"]
+        self._file_manager = GCSBasedFileManager(
+            self._parent.project,
+            self._parent.bucket_name,
+            "",
+            metadata_cache_size=self._parent.metadata_cache_size,
+            metadata_cache_ttl=self._parent.metadata_cache_ttl,
+            # Checkpoints are rarely read back, so their contents are not cached.
+            content_cache_size=0,
+            fanout_threads=self._parent.fanout_io_threads,
+            http_pool_size=self._parent._http_pool_size,
+            api_endpoint=self._parent.storage_api_endpoint,
+            log=self._parent.log,
+        )
+        self._executor = InstrumentedExecutor(
+            "checkpoint",
+            self._parent.checkpoint_io_threads,
+            f"{self._parent.bucket_name}/",
+        )
+        self._versioning_enabled = None
+
+    def checkpoint_path(self, checkpoint_id, path):
+        path = normalize_path(path)
+        return url_path_join(self.checkpoints_dir, path, checkpoint_id)
+
+    def _source_file_manager(self, contents_mgr):
+        """Return the file manager of `contents_mgr` if it uses our bucket."""
+        file_manager = getattr(contents_mgr, "_file_manager", None)
+        if not isinstance(file_manager, GCSFileManagerBase):
+            return None
+        if file_manager.bucket_name != self._file_manager.bucket_name:
+            return None
+        return file_manager
+
+    def _use_versions(self):
+        if self._parent.checkpoint_mode != "versions":
+            return False
+        if self._versioning_enabled is None:
+            bucket = self._file_manager._bucket_metadata()
+            self._versioning_enabled = bool(bucket.versioning_enabled)
+            if not self._versioning_enabled:
+                self._parent.log.warning(
+                    "Object versioning is not enabled for the bucket %s, "
+                    'so the "copy" checkpoint mode is used instead',
+                    bucket.name,
+                )
+        return self._versioning_enabled
+
+    def _manifest_blob_name(self, path):
+        return url_path_join(
+            self.checkpoints_dir, normalize_path(path), self.manifest_name
+        )
+
+    def _read_manifest(self, path):
+        """Return a file's checkpoints, oldest first, and the manifest generation."""
+        bucket = self._file_manager.bucket
+        blob = bucket.get_blob(self._manifest_blob_name(path))
+        if not blob:
+            return [], 0
+        try:
+            contents = blob.download_as_bytes(if_generation_match=blob.generation)
+        except api_exceptions.NotFound:
+            return [], 0
+        return json.loads(contents.decode(utf8_encoding)), blob.generation
+
+    def _update_manifest(self, path, update):
+        """Atomically replace the checkpoints of a file with `update(checkpoints)`."""
+        blob = self._file_manager.bucket.blob(self._manifest_blob_name(path))
+        for _ in range(_MANIFEST_UPDATE_ATTEMPTS):
+            checkpoints, generation = self._read_manifest(path)
+            new_checkpoints, result = update(list(checkpoints))
+            try:
+                if new_checkpoints:
+                    blob.upload_from_string(
+                        json.dumps(new_checkpoints),
+                        content_type="application/json",
+                        if_generation_match=generation,
+                    )
+                elif generation:
+                    blob.delete(if_generation_match=generation)
+                return result
+            except (api_exceptions.PreconditionFailed, api_exceptions.NotFound):
+                continue
+        raise HTTPError(
+            409, f'Too many concurrent updates to the checkpoints of "{path}"'
+        )
+
+    def _read_checkpoints(self, path):
+        checkpoints, _ = self._read_manifest(path)
+        return [c for c in checkpoints if not c.get("pruned", False)]
+
+    def _delete_versions(self, checkpoints):
+        """Delete the noncurrent generations of checkpoints; returns the deleted ids."""
+        bucket = self._file_manager.bucket
+        live_generations = {}
+        versions = []
+        deleted = set()
+        for checkpoint in checkpoints:
+            name = checkpoint["name"]
+            if name not in live_generations:
+                live_blob = bucket.get_blob(name)
+                live_generations[name] = live_blob.generation if live_blob else None
+            if checkpoint["generation"] != live_generations[name]:
+                versions.append(bucket.blob(name, generation=checkpoint["generation"]))
+                deleted.add(checkpoint["id"])
+        try:
+            self._file_manager._delete_blobs(versions)
+        except HTTPError as ex:
+            self._parent.log.warning("Failed to delete pruned checkpoints: %s", ex)
+            return set()
+        return deleted
+
+    def _update_checkpoints(self, path, update, discard=True):
+        """Like `_update_manifest`, but ignoring and deleting pruned checkpoints."""
+
+        def update_manifest(entries):
+            checkpoints = [c for c in entries if not c.get("pruned", False)]
+            new_checkpoints, result = update(list(checkpoints))
+            kept = {c["id"] for c in new_checkpoints}
+            pruned = [c for c in entries if c.get("pruned", False)]
+            if discard:
+                pruned += [dict(c, pruned=True) for c in checkpoints]
+            pruned = [c for c in pruned if c["id"] not in kept]
+            return new_checkpoints + pruned, (pruned, result)
+
+        # Live generations can't be deleted yet, so they stay marked as pruned.
+        pruned, result = self._update_manifest(path, update_manifest)
+        deleted = self._delete_versions(pruned)
+        if deleted:
+
+            def remove_deleted(entries):
+                return [
+                    c
+                    for c in entries
+                    if not (c.get("pruned", False) and c["id"] in deleted)
+                ], None
+
+            self._update_manifest(path, remove_deleted)
+        return result
+
+    def _create_version_checkpoint(self, blob_name, path):
+        blob = self._file_manager.bucket.get_blob(blob_name)
+        if not blob:
+            raise HTTPError(404, "Not found: {}".format(path))
+        checkpoint = {
+            "id": str(blob.generation),
+            "name": blob_name,
+            "generation": blob.generation,
+            "last_modified": blob.updated.isoformat(),
+        }
+        retention = self._parent.checkpoint_retention
+
+        def add_checkpoint(checkpoints):
+            checkpoints = [c for c in checkpoints if c["id"] != checkpoint["id"]]
+            checkpoints.append(checkpoint)
+            if retention:
+                checkpoints = checkpoints[-retention:]
+            return checkpoints, None
+
+        self._update_checkpoints(path, add_checkpoint)
+        return {"id": checkpoint["id"], "last_modified": blob.updated}
+
+    def _find_version_checkpoint(self, checkpoint_id, path):
+        for checkpoint in self._read_checkpoints(path):
+            if checkpoint["id"] == checkpoint_id:
+                return checkpoint
+        raise HTTPError(
+            404, 'No such checkpoint for "{}": {}'.format(path, checkpoint_id)
+        )
+
+    def _restore_version_checkpoint(self, checkpoint_id, blob_name, path):
+        checkpoint = self._find_version_checkpoint(checkpoint_id, path)
+        bucket = self._file_manager.bucket
+        version = bucket.blob(checkpoint["name"], generation=checkpoint["generation"])
+        try:
+            self._file_manager._copy_blob(version, blob_name)
+        except api_exceptions.NotFound:
+            raise HTTPError(
+                404,
+                'The checkpoint "{}" of "{}" no longer exists'.format(
+                    checkpoint_id, path
+                ),
+            )
+
+    def _remove_version_checkpoint(self, checkpoint_id, path, discard):
+        def remove_checkpoint(checkpoints):
+            removed = [c for c in checkpoints if c["id"] == checkpoint_id]
+            return [c for c in checkpoints if c["id"] != checkpoint_id], removed
+
+        return self._update_checkpoints(path, remove_checkpoint, discard)
+
+    def _delete_version_checkpoint(self, checkpoint_id, path):
+        removed = self._remove_version_checkpoint(checkpoint_id, path, True)
+        if not removed:
+            raise HTTPError(
+                404, 'No such checkpoint for "{}": {}'.format(path, checkpoint_id)
+            )
+
+    def _rename_version_checkpoint(self, checkpoint_id, old_path, new_path):
+        # The checkpoint keeps referring to a generation of the old object, so
+        # only the manifest entry needs to move.
+        removed = self._remove_version_checkpoint(checkpoint_id, old_path, False)
+
+        def add_checkpoints(checkpoints):
+            ids = {c["id"] for c in removed}
+            checkpoints = [c for c in checkpoints if c["id"] not in ids] + removed
+            return checkpoints, None
+
+        self._update_checkpoints(new_path, add_checkpoints, False)
+
+    def _list_version_checkpoints(self, path):
+        checkpoints = self._read_checkpoints(path)
+        return [
+            {
+                "id": checkpoint["id"],
+                "last_modified": datetime.datetime.fromisoformat(
+                    checkpoint["last_modified"]
+                ),
+            }
+            for checkpoint in checkpoints
+        ]
+
+    async def _run_if_versioned(self, fn, *args):
+        """Return whether `fn` ran (in the "versions" mode) and what it returned."""
+        loop = asyncio.get_running_loop()
+        use_versions = await loop.run_in_executor(self._executor, self._use_versions)
+        if not use_versions:
+            return False, None
+        return True, await loop.run_in_executor(self._executor, fn, *args)
+
+    async def create_checkpoint(self, contents_mgr, path):
+        """Create a checkpoint of a file without transferring its contents."""
+        source_file_manager = self._source_file_manager(contents_mgr)
+        if not source_file_manager:
+            return await super().create_checkpoint(contents_mgr, path)
+        # The checkpoint is taken of the file in GCS, which must not be
+        # behind a save that is still staged locally.
+        await contents_mgr._flush_write_back(path)
+        blob_name = source_file_manager._gcs_path(path)
+        versioned, checkpoint = await self._run_if_versioned(
+            self._create_version_checkpoint, blob_name, path
+        )
+        if versioned:
+            return checkpoint
+        checkpoint_id = "checkpoint"
+        checkpoint_path = self.checkpoint_path(checkpoint_id, path)
+        loop = asyncio.get_running_loop()
+        checkpoint_model = await loop.run_in_executor(
+            self._executor, self._file_manager.copy_file, blob_name, checkpoint_path
+        )
+        if not checkpoint_model:
+            raise HTTPError(404, "Not found: {}".format(path))
+        return {
+            "id": checkpoint_id,
+            "last_modified": checkpoint_model["last_modified"],
+        }
+
+    async def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        """Restore a checkpoint of a file by copying it back within GCS."""
+        source_file_manager = self._source_file_manager(contents_mgr)
+        if not source_file_manager:
+            return await super().restore_checkpoint(contents_mgr, checkpoint_id, path)
+        checkpoint_path = self.checkpoint_path(checkpoint_id, path)
+        blob_name = source_file_manager._gcs_path(path)
+        await contents_mgr._discard_write_back(path)
+        loop = asyncio.get_running_loop()
+        try:
+            versioned, _ = await self._run_if_versioned(
+                self._restore_version_checkpoint, checkpoint_id, blob_name, path
+            )
+            if versioned:
+                return
+            restored_model = await loop.run_in_executor(
+                self._executor,
+                self._file_manager.copy_file,
+                checkpoint_path,
+                blob_name,
+            )
+        finally:
+            # The file was written behind the back of the contents manager's
+            # own file manager, so its caches have to be told about it.
+            source_file_manager._invalidate_metadata(blob_name)
+        if not restored_model:
+            raise HTTPError(
+                404, 'No such checkpoint for "{}": {}'.format(path, checkpoint_id)
+            )
+
+    async def create_file_checkpoint(self, content, format, path):
+        checkpoint_id = "checkpoint"
+        checkpoint_path = self.checkpoint_path(checkpoint_id, path)
+        content_type = "text/plain" if format == "text" else "application/octet-stream"
+        loop = asyncio.get_running_loop()
+        file_model = await loop.run_in_executor(
+            self._executor,
+            self._file_manager.create_file,
+            content,
+            content_type,
+            checkpoint_path,
+            None,
+        )
+        if file_model:
+            file_model["id"] = checkpoint_id
+        return file_model
+
+    async def create_notebook_checkpoint(self, nb, path):
+        checkpoint_id = "checkpoint"
+        checkpoint_path = self.checkpoint_path(checkpoint_id, path)
+        loop = asyncio.get_running_loop()
+        nb_model = await loop.run_in_executor(
+            self._executor, self._file_manager.create_notebook, nb, checkpoint_path
+        )
+        if nb_model:
+            nb_model["id"] = checkpoint_id
+        return nb_model
+
+    async def get_file_checkpoint(self, checkpoint_id, path):
+        checkpoint_path = self.checkpoint_path(checkpoint_id, path)
+        loop = asyncio.get_running_loop()
+        contents, content_type = await loop.run_in_executor(
+            self._executor, self._file_manager.file_contents, checkpoint_path
+        )
+        if not contents:
+            raise HTTPError(
+                404, 'No such checkpoint for "{}": {}'.format(path, checkpoint_id)
+            )
+        checkpoint_obj = {
+            "type": "file",
+            "content": contents.decode(utf8_encoding),
+            "format": "text" if content_type == "text/plain" else "base64",
+        }
+        return checkpoint_obj
+
+    async def get_notebook_checkpoint(self, checkpoint_id, path):
+        checkpoint_path = self.checkpoint_path(checkpoint_id, path)
+        loop = asyncio.get_running_loop()
+        contents = await loop.run_in_executor(
+            self._executor, self._file_manager.notebook_contents, checkpoint_path
+        )
+        if not contents:
+            raise HTTPError(
+                404, 'No such checkpoint for "{}": {}'.format(path, checkpoint_id)
+            )
+        return {
+            "type": "notebook",
+            "content": contents,
+        }
+
+    async def delete_checkpoint(self, checkpoint_id, path):
+        versioned, _ = await self._run_if_versioned(
+            self._delete_version_checkpoint, checkpoint_id, path
+        )
+        if versioned:
+            return None
+        old_checkpoint_path = self.checkpoint_path(checkpoint_id, path)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._file_manager.delete_file, old_checkpoint_path
+        )
+
+    async def list_checkpoints(self, path):
+        versioned, checkpoints = await self._run_if_versioned(
+            self._list_version_checkpoints, path
+        )
+        if versioned:
+            return checkpoints
+        loop = asyncio.get_running_loop()
+        dir_model = await loop.run_in_executor(
+            self._executor,
+            self._file_manager.list_dir,
+            url_path_join(self.checkpoints_dir, normalize_path(path)),
+            True,
+        )
+        checkpoints = []
+        for child in dir_model["content"]:
+            if (
+                child.get("type", None) != "directory"
+                and child["name"] != self.manifest_name
+            ):
+                checkpoint = {
+                    "id": child["name"],
+                    "last_modified": child["last_modified"],
+                }
+                checkpoints.append(checkpoint)
+        return checkpoints
+
+    async def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        versioned, _ = await self._run_if_versioned(
+            self._rename_version_checkpoint, checkpoint_id, old_path, new_path
+        )
+        if versioned:
+            return None
+        old_checkpoint_path = self.checkpoint_path(checkpoint_id, old_path)
+        new_checkpoint_path = self.checkpoint_path(checkpoint_id, new_path)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            self._file_manager.rename_file,
+            old_checkpoint_path,
+            new_checkpoint_path,
+        )
+
+
+class CombinedCheckpointsManager(AsyncGenericCheckpointsMixin, AsyncCheckpoints):
+
+    def __init__(self, content_managers):
+        self._content_managers = content_managers
+
+    def _content_manager_for_path(self, path):
+        path = normalize_path(path)
+        mount_name = path.partition("/")[0]
+        if mount_name in self._content_managers:
+            relative_path = path[len(mount_name) :]
+            return self._content_managers[mount_name], relative_path
+        raise HTTPError(400, "Unsupported checkpoint path: {}".format(path))
+
+    def _checkpoint_manager_for_path(self, path):
+        content_manager, relative_path = self._content_manager_for_path(path)
+        return content_manager.checkpoints, relative_path
+
+    async def create_checkpoint(self, contents_mgr, path):
+        # Pass the mounted contents manager, so it can copy natively (e.g. in GCS).
+        content_manager, relative_path = self._content_manager_for_path(path)
+        return await content_manager.checkpoints.create_checkpoint(
+            content_manager, relative_path
+        )
+
+    async def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        content_manager, relative_path = self._content_manager_for_path(path)
+        return await content_manager.checkpoints.restore_checkpoint(
+            content_manager, checkpoint_id, relative_path
+        )
+
+    async def create_file_checkpoint(self, content, format, path):
+        checkpoint_manager, relative_path = self._checkpoint_manager_for_path(path)
+        return await checkpoint_manager.create_file_checkpoint(
+            content, format, relative_path
+        )
+
+    async def create_notebook_checkpoint(self, nb, path):
+        checkpoint_manager, relative_path = self._checkpoint_manager_for_path(path)
+        return await checkpoint_manager.create_notebook_checkpoint(nb, relative_path)
+
+    async def get_file_checkpoint(self, checkpoint_id, path):
+        checkpoint_manager, relative_path = self._checkpoint_manager_for_path(path)
+        return await checkpoint_manager.get_file_checkpoint(
+            checkpoint_id, relative_path
+        )
+
+    async def get_notebook_checkpoint(self, checkpoint_id, path):
+        checkpoint_manager, relative_path = self._checkpoint_manager_for_path(path)
+        return await checkpoint_manager.get_notebook_checkpoint(
+            checkpoint_id, relative_path
+        )
+
+    async def delete_checkpoint(self, checkpoint_id, path):
+        checkpoint_manager, relative_path = self._checkpoint_manager_for_path(path)
+        return await checkpoint_manager.delete_checkpoint(checkpoint_id, relative_path)
+
+    async def list_checkpoints(self, path):
+        checkpoint_manager, relative_path = self._checkpoint_manager_for_path(path)
+        return await checkpoint_manager.list_checkpoints(relative_path)
+
+    async def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        checkpoint_manager, old_relative_path = self._checkpoint_manager_for_path(
+            old_path
+        )
+        new_checkpoint_manager, new_relative_path = self._checkpoint_manager_for_path(
+            new_path
+        )
+        if new_checkpoint_manager != checkpoint_manager:
+            raise HTTPError(
+                400,
+                "Unsupported rename across file systems: {}->{}".format(
+                    old_path, new_path
+                ),
+            )
+        return await checkpoint_manager.rename_checkpoint(
+            checkpoint_id, old_relative_path, new_relative_path
+        )
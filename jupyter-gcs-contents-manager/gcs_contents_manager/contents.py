@@ -0,0 +1,1133 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import base64
+import datetime
+import hashlib
+import inspect
+import mimetypes
+import os
+import posixpath
+import time
+
+from jupyter_server.services.contents.filecheckpoints import AsyncGenericFileCheckpoints
+from jupyter_server.services.contents.largefilemanager import AsyncLargeFileManager
+from jupyter_server.services.contents.manager import AsyncContentsManager
+
+from tornado.web import HTTPError
+from traitlets import Bool, Dict, Enum, Float, Int, TraitError, Unicode
+from traitlets import default, validate
+
+from gcs_contents_manager.async_client import AsyncGCSBasedFileManager
+from gcs_contents_manager.checkpoints import (
+    CombinedCheckpointsManager,
+    GCSCheckpointManager,
+)
+from gcs_contents_manager.executors import InstrumentedExecutor
+from gcs_contents_manager.files import GCSBasedFileManager
+from gcs_contents_manager.stager import WriteBackStager
+from gcs_contents_manager.utils import (
+    _mount_path,
+    _read_notebook,
+    _write_notebook,
+    normalize_path,
+    utf8_encoding,
+)
+
+
+class GCSContentsManager(AsyncContentsManager):
+
+    bucket_name = Unicode(config=True)
+
+    bucket_notebooks_path = Unicode(config=True)
+
+    project = Unicode(config=True)
+
+    metadata_cache_size = Int(
+        1024,
+        config=True,
+        help="""
+        Maximum number of GCS metadata lookups to cache in memory.
+
+        Set to 0 to disable the metadata cache.""",
+    )
+
+    metadata_cache_ttl = Float(
+        5.0,
+        config=True,
+        help="""
+        Number of seconds that cached GCS metadata lookups remain valid.
+
+        Changes made to the bucket by anything other than this server may
+        take up to this long to become visible. Set to 0 to disable the
+        metadata cache.""",
+    )
+
+    chunked_upload_mode = Enum(
+        ["compose", "resumable"],
+        default_value="compose",
+        config=True,
+        help="""
+        How chunked uploads of large files are written to GCS.
+
+        With "compose", each chunk is written to its own temporary blob and
+        the blobs are composed into the final object once the last chunk
+        arrives. This works even if the chunks are handled by different
+        server processes.
+
+        With "resumable", the chunks are streamed directly into the final
+        object using a GCS resumable upload session that is tracked in
+        memory. This avoids writing every byte twice, but requires every
+        chunk of an upload to be handled by the same server process.""",
+    )
+
+    upload_session_timeout = Float(
+        3600.0,
+        config=True,
+        help="""
+        Number of seconds after which an inactive resumable upload session
+        is abandoned.
+
+        Only used when `chunked_upload_mode` is "resumable".""",
+    )
+
+    interactive_io_threads = Int(
+        16,
+        config=True,
+        help="""
+        Number of threads used for interactive GCS operations, such as
+        reading and saving files.""",
+    )
+
+    bulk_io_threads = Int(
+        8,
+        config=True,
+        help="""
+        Number of threads used for bulk GCS operations, such as deleting
+        or renaming directories and listing directory contents.""",
+    )
+
+    checkpoint_io_threads = Int(
+        4,
+        config=True,
+        help="Number of threads used for reading and writing checkpoints in GCS.",
+    )
+
+    gzip_uploads = Bool(
+        False,
+        config=True,
+        help="""
+        Store new text files and notebooks gzip-compressed, with a
+        Content-Encoding of gzip. Files stored either way can always be read.
+
+        The decoded size and CRC32C are recorded in the custom metadata of
+        compressed files, so that size limits and file hashes apply to the
+        decoded contents.""",
+    )
+
+    fast_notebook_io = Bool(
+        False,
+        config=True,
+        help="""
+        Serialize and parse notebooks with a fast path that skips nbformat
+        validation, parsing them with orjson when it is installed.
+
+        Notebooks saved this way keep multi-line strings unsplit, which is
+        still a valid notebook file. Notebooks in formats other than v4
+        always go through nbformat.""",
+    )
+
+    checkpoint_mode = Enum(
+        ["copy", "versions"],
+        default_value="copy",
+        config=True,
+        help="""
+        How checkpoints are stored.
+
+        "copy" keeps a single checkpoint per file, as a copy of the file.
+
+        "versions" keeps up to `checkpoint_retention` checkpoints per file,
+        as earlier generations of the file itself, so creating a checkpoint
+        copies no data at all. This requires object versioning to be enabled
+        on the bucket; without it, the "copy" mode is used.""",
+    )
+
+    checkpoint_retention = Int(
+        10,
+        config=True,
+        help="""
+        Maximum number of checkpoints kept per file in the "versions"
+        checkpoint mode. The oldest checkpoints beyond this are deleted.
+        Set to 0 to keep every checkpoint.""",
+    )
+
+    fanout_io_threads = Int(
+        16,
+        config=True,
+        help="""
+        Number of threads used to issue the individual GCS requests of a
+        single operation concurrently, e.g. when composing or deleting many
+        blobs.
+
+        The copies made when renaming a directory do not use these
+        threads; see `rename_concurrency`.""",
+    )
+
+    storage_backend = Enum(
+        ["google-cloud-storage", "asyncio"],
+        default_value="google-cloud-storage",
+        config=True,
+        help="""
+        The library used to talk to GCS.
+
+        With "google-cloud-storage", every GCS call is a blocking library
+        call made on an executor thread.
+
+        With "asyncio", GCS calls are made directly against the GCS JSON
+        API from the event loop using a pooled `aiohttp` client. This
+        requires the `aiohttp` package, and always uses the "compose"
+        mode for chunked uploads. Checkpoints are still written using
+        the `google-cloud-storage` library.""",
+    )
+
+    storage_api_endpoint = Unicode(
+        "",
+        config=True,
+        help="""
+        Endpoint of the GCS JSON API.
+
+        Set this to the address of a local stand-in for GCS to run against
+        it instead of the real service. Defaults to the value of the
+        `STORAGE_EMULATOR_HOST` environment variable if that is set, and to
+        the public GCS endpoint otherwise.""",
+    )
+
+    async_max_connections = Int(
+        100,
+        config=True,
+        help="""
+        Maximum number of concurrent connections to GCS used by the
+        "asyncio" storage backend.""",
+    )
+
+    content_cache_size = Int(
+        64 * 1024 * 1024,
+        config=True,
+        help="""
+        Maximum total size, in bytes, of the file contents cached in memory.
+
+        Cached contents (and the notebooks parsed from them) are reused for
+        as long as the underlying GCS object is unchanged. Set this to 0 to
+        disable the cache.""",
+    )
+
+    max_inline_content_size = Int(
+        0,
+        config=True,
+        help="""
+        Maximum size, in bytes, of a file whose contents can be opened.
+        For compressed files, this is the size once decompressed.
+
+        Larger files are rejected with a 413 error rather than being read
+        into memory. Set this to 0 (the default) to remove the limit.""",
+    )
+
+    max_listing_entries = Int(
+        0,
+        config=True,
+        help="""
+        Maximum number of entries returned when listing a directory.
+
+        Listings of larger directories stop early, and are marked with
+        `"truncated": true`. Set this to 0 to remove the limit.""",
+    )
+
+    rename_concurrency = Int(
+        32,
+        config=True,
+        help="""
+        Maximum number of objects copied concurrently when renaming a
+        directory.
+
+        Copies run on a pool of this many threads of their own, so they do
+        not compete with the `fanout_io_threads` that delete the renamed
+        objects and compose chunked uploads.""",
+    )
+
+    metadata_index_path = Unicode(
+        "",
+        config=True,
+        help="""
+        Path of an SQLite database in which to keep an index of the metadata
+        of every file in the bucket under `bucket_notebooks_path`.
+
+        The index is refreshed in the background by listing everything under
+        `bucket_notebooks_path`, and updated on every write made by this
+        server. It is used to list directories and check for the existence
+        of files without asking GCS, and persists across restarts. Only supported by the "google-cloud-storage" storage
+        backend. Leave empty to always ask GCS.""",
+    )
+
+    metadata_index_max_staleness = Float(
+        600.0,
+        config=True,
+        help="""
+        Maximum age, in seconds, of the metadata index for it to be used.
+
+        Changes made to the bucket by anything other than this server may
+        take up to this long to show up. Should be longer than
+        `metadata_index_refresh_interval`.""",
+    )
+
+    metadata_index_refresh_interval = Float(
+        300.0,
+        config=True,
+        help="""
+        Number of seconds between refreshes of the metadata index.
+
+        Each refresh lists every object under `bucket_notebooks_path`, so
+        this should not be too short for large buckets. Refreshes are put off
+        for twice as long as the last one took if that is longer.""",
+    )
+
+    write_back_dir = Unicode(
+        "",
+        config=True,
+        help="""
+        Local directory in which saves are staged before they are uploaded.
+
+        When this is set, a save of a notebook or (non-chunked) file returns
+        once it is synced to this directory, and is uploaded in the
+        background, overwriting any change made to the file in GCS since.
+        Saves left over from a previous run are uploaded on startup. Only
+        supported by the "google-cloud-storage" storage backend.""",
+    )
+
+    write_back_delay = Float(
+        2.0,
+        config=True,
+        help="""
+        Number of seconds a staged save waits before it is uploaded.
+
+        Further saves of the same file within this window (e.g. autosaves)
+        are coalesced into a single upload of the latest version. Only used
+        when `write_back_dir` is set.""",
+    )
+
+    @default("checkpoints_class")
+    def _checkpoints_class_default(self):
+        return GCSCheckpointManager
+
+    @default("bucket_notebooks_path")
+    def _bucket_notebooks_path_default(self):
+        return ""
+
+    def __init__(self, *args, **kwargs):
+        super(GCSContentsManager, self).__init__(*args, **kwargs)
+        if self.storage_backend == "asyncio":
+            self._file_manager = AsyncGCSBasedFileManager(
+                self.project,
+                self.bucket_name,
+                self.bucket_notebooks_path,
+                metadata_cache_size=self.metadata_cache_size,
+                metadata_cache_ttl=self.metadata_cache_ttl,
+                max_inline_content_size=self.max_inline_content_size,
+                max_listing_entries=self.max_listing_entries,
+                content_cache_size=self.content_cache_size,
+                gzip_uploads=self.gzip_uploads,
+                fast_notebook_io=self.fast_notebook_io,
+                api_endpoint=self.storage_api_endpoint,
+                max_connections=self.async_max_connections,
+                log=self.log,
+            )
+        else:
+            self._file_manager = GCSBasedFileManager(
+                self.project,
+                self.bucket_name,
+                self.bucket_notebooks_path,
+                metadata_cache_size=self.metadata_cache_size,
+                metadata_cache_ttl=self.metadata_cache_ttl,
+                max_inline_content_size=self.max_inline_content_size,
+                max_listing_entries=self.max_listing_entries,
+                content_cache_size=self.content_cache_size,
+                gzip_uploads=self.gzip_uploads,
+                fast_notebook_io=self.fast_notebook_io,
+                chunked_upload_mode=self.chunked_upload_mode,
+                upload_session_timeout=self.upload_session_timeout,
+                fanout_threads=self.fanout_io_threads,
+                copy_concurrency=self.rename_concurrency,
+                http_pool_size=self._http_pool_size,
+                api_endpoint=self.storage_api_endpoint,
+                metadata_index_path=self.metadata_index_path,
+                metadata_index_max_staleness=self.metadata_index_max_staleness,
+                metadata_index_refresh_interval=self.metadata_index_refresh_interval,
+                log=self.log,
+            )
+        # Reads and saves get their own executor, so that they are not stuck
+        # behind bulk operations like recursive deletes and listings.
+        instance = f"{self.bucket_name}/{self.bucket_notebooks_path}"
+        self._executor = InstrumentedExecutor(
+            "interactive", self.interactive_io_threads, instance
+        )
+        self._bulk_executor = InstrumentedExecutor(
+            "bulk", self.bulk_io_threads, instance
+        )
+        if self.metadata_index_path and self.storage_backend == "asyncio":
+            self.log.warning(
+                "The metadata index is not supported by the asyncio storage "
+                "backend; every lookup will go to GCS."
+            )
+        self._write_back = None
+        if self.write_back_dir and self.storage_backend == "asyncio":
+            self.log.warning(
+                "Staging saves in write_back_dir is not supported by the asyncio "
+                "storage backend; every save will be uploaded before it returns."
+            )
+        elif self.write_back_dir:
+            # Keep the saves of every bucket and root directory apart, so that
+            # several contents managers can share the same staging directory.
+            staging_key = hashlib.sha256(
+                f"{self.bucket_name}/{self.bucket_notebooks_path}".encode(utf8_encoding)
+            ).hexdigest()[:16]
+            self._write_back = WriteBackStager(
+                os.path.join(self.write_back_dir, staging_key),
+                self.write_back_delay,
+                self._upload_staged,
+                InstrumentedExecutor("write-back", self.bulk_io_threads, instance),
+                self.log,
+            )
+        self._close_on_server_shutdown()
+
+    def _close_on_server_shutdown(self):
+        """Close this contents manager when the Jupyter server shuts down."""
+        # Jupyter has no shutdown hook for contents managers, so piggyback on
+        # the server's cleanup of its extensions.
+        cleanup_extensions = getattr(self.parent, "cleanup_extensions", None)
+        if cleanup_extensions is None:
+            return
+
+        async def cleanup_extensions_and_close():
+            await cleanup_extensions()
+            await self.close()
+
+        self.parent.cleanup_extensions = cleanup_extensions_and_close
+
+    async def close(self):
+        """Close the GCS client and metadata index of this contents manager."""
+        await self._run(self._bulk_executor, self._file_manager.close)
+
+    @property
+    def _http_pool_size(self):
+        """The number of threads of this manager and its checkpoints that may use GCS at once."""
+        # The contents and checkpoint file managers each have a fanout executor.
+        return (
+            self.interactive_io_threads
+            + self.bulk_io_threads
+            + self.checkpoint_io_threads
+            + 2 * self.fanout_io_threads
+            + self.rename_concurrency
+        )
+
+    async def _run(self, executor, fn, *args):
+        """Run a file manager method, on the given executor if it is blocking."""
+        if inspect.iscoroutinefunction(fn):
+            return await fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, fn, *args)
+
+    def _is_hidden(self, path):
+        path = normalize_path(path)
+        return posixpath.basename(path).startswith(".")
+
+    def _upload_staged(self, path, data, record):
+        try:
+            return self._file_manager.create_file(
+                data, record["content_type"], path, None
+            )
+        except HTTPError as err:
+            if err.status_code != 409:
+                raise
+        # The save was already acknowledged, so it wins over whatever
+        # changed the file in GCS since it was last read.
+        self.log.warning(
+            f'"{path}" was changed in GCS after it was last read; '
+            "overwriting it with a staged save"
+        )
+        self._file_manager._invalidate_metadata(self._file_manager._gcs_path(path))
+        return self._file_manager.create_file(data, record["content_type"], path, None)
+
+    def _stage_save(self, model, path, content_type):
+        path = normalize_path(path)
+        contents = model["content"]
+        if model["type"] == "notebook":
+            contents = _write_notebook(contents, self.fast_notebook_io)
+            content_type, content_format = "text/plain", "json"
+        else:
+            content_format = model["format"]
+            if content_format == "base64":
+                contents = base64.decodebytes(contents.encode("ascii"))
+        if isinstance(contents, str):
+            contents = contents.encode(utf8_encoding)
+        record = self._write_back.stage(
+            path,
+            contents,
+            {
+                "type": model["type"],
+                "format": content_format,
+                "content_type": content_type,
+                "saved": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            },
+        )
+        return self._staged_model(record)
+
+    def _staged_model(self, record, contents=None):
+        """Build the model of a file from its staged save."""
+        saved = datetime.datetime.fromisoformat(record["saved"])
+        path = record["path"]
+        model = {
+            "path": path,
+            "name": posixpath.basename(path),
+            "last_modified": saved,
+            "created": saved,
+            "writable": True,
+            "type": record["type"],
+            "content": None,
+            "format": None,
+            "mimetype": None,
+        }
+        if contents is None:
+            return model
+        model["format"] = record["format"]
+        if record["type"] == "notebook":
+            model["content"] = _read_notebook(contents, self.fast_notebook_io)
+        elif record["format"] == "text":
+            model["mimetype"] = "text/plain"
+            model["content"] = contents.decode(utf8_encoding)
+        else:
+            model["mimetype"] = "application/octet-stream"
+            model["content"] = base64.b64encode(contents).decode("ascii")
+        return model
+
+    def _get_staged(self, path, content):
+        if not content:
+            record = self._write_back.record(normalize_path(path))
+            return self._staged_model(record, None) if record else None
+        staged = self._write_back.get(normalize_path(path))
+        if staged is None:
+            return None
+        return self._staged_model(*staged)
+
+    async def _flush_write_back(self, path):
+        """Upload any staged saves of (or underneath) a path right away."""
+        if self._write_back:
+            await self._run(
+                self._bulk_executor, self._write_back.flush, normalize_path(path)
+            )
+
+    async def _discard_write_back(self, path):
+        """Drop any staged saves of (or underneath) a path."""
+        if self._write_back:
+            await self._run(
+                self._bulk_executor, self._write_back.discard, normalize_path(path)
+            )
+
+    async def is_hidden(self, path):
+        return self._is_hidden(path)
+
+    async def file_exists(self, path):
+        self.log.debug(f'Checking for the existence of the path "{path}" in GCS...')
+        try:
+            if self._write_back and self._write_back.record(normalize_path(path)):
+                return True
+            return await self._run(self._executor, self._file_manager.file_exists, path)
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(500, "Internal server error: {}".format(str(ex)))
+
+    async def dir_exists(self, path):
+        self.log.debug(
+            f'Checking for the existence of the directory "{path}" in GCS...'
+        )
+        try:
+            return await self._run(self._executor, self._file_manager.dir_exists, path)
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(500, "Internal server error: {}".format(str(ex)))
+
+    async def list_page(self, path, page_token=None, page_size=None, path_prefix=None):
+        """Return the models of one page of a directory, and the next page token."""
+        self.log.debug(f'Listing a page of the directory "{path}" in GCS...')
+        if not page_token and not await self.dir_exists(path):
+            raise HTTPError(404, f"Not found: {path}")
+        try:
+            entries, next_page_token = await self._run(
+                self._bulk_executor,
+                self._file_manager.list_page,
+                path,
+                page_token,
+                page_size,
+            )
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(500, "Internal server error: {}".format(str(ex)))
+        dir_path = normalize_path(path)
+        if path_prefix is not None:
+            dir_path = _mount_path(path_prefix, dir_path)
+        allow_hidden = self.allow_hidden
+        models = [
+            entry.to_model(dir_path)
+            for entry in entries
+            if allow_hidden or not entry.name.startswith(".")
+        ]
+        return models, next_page_token
+
+    async def get(
+        self,
+        path,
+        content=True,
+        type=None,
+        format=None,
+        require_hash=False,
+        path_prefix=None,
+        **kwargs,
+    ):
+        """Get the model of a path, with its paths moved under `path_prefix` if set."""
+        model = await self._get_model(path, content, type, require_hash)
+        if content and model.get("type", None) == "directory":
+            self._finish_listing(model, path, path_prefix)
+        if path_prefix is not None:
+            model["path"] = _mount_path(path_prefix, model["path"])
+        return model
+
+    async def _get_model(self, path, content, type, require_hash):
+        """Get the model of a path, leaving any directory listing to `_finish_listing`."""
+        self.log.debug(f'Getting the file "{path}" from GCS...')
+        try:
+            if self._write_back and type != "directory":
+                staged_model = await self._run(
+                    self._executor, self._get_staged, path, content
+                )
+                if staged_model:
+                    return staged_model
+            executor = self._bulk_executor if type == "directory" else self._executor
+            model = await self._run(
+                executor,
+                self._file_manager.get_file,
+                path,
+                type,
+                content,
+                require_hash,
+                True,
+            )
+            if not model:
+                self.log.debug(f"No such file found in the GCS bucket for {path}")
+                raise HTTPError(404, f"Not found: {path}")
+            return model
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(500, "Internal server error: {}".format(str(ex)))
+
+    def _finish_listing(self, model, path, path_prefix=None):
+        """Turn the listed entries into models, in a single pass over the children."""
+        staged_models = {}
+        if self._write_back:
+            staged_models = {
+                posixpath.basename(record["path"]): self._staged_model(record)
+                for record in self._write_back.records_in(normalize_path(path))
+            }
+        allow_hidden = self.allow_hidden
+        dir_path = model["path"]
+        if path_prefix is not None:
+            dir_path = _mount_path(path_prefix, dir_path)
+        children = []
+
+        def add_staged(child):
+            if not allow_hidden and child["name"].startswith("."):
+                return
+            if path_prefix is not None:
+                child["path"] = _mount_path(path_prefix, child["path"])
+            children.append(child)
+
+        for entry in model["content"]:
+            if not allow_hidden and entry.name.startswith("."):
+                continue
+            staged_model = staged_models.pop(entry.name, None)
+            if staged_model:
+                add_staged(staged_model)
+            else:
+                children.append(entry.to_model(dir_path))
+        for child in staged_models.values():
+            add_staged(child)
+        model["content"] = children
+
+    async def save(self, model, path):
+        self.log.debug(f'Saving the file "{model}" to the GCS path "{path}"...')
+        try:
+            chunk = model.get("chunk", None)
+            if chunk is None or chunk == 1:
+                self.run_pre_save_hooks(model=model, path=path)
+
+            if chunk and model["type"] != "file":
+                raise HTTPError(
+                    400, "Chunked uploads to GCS are only supported for plain files."
+                )
+
+            if model["type"] == "directory":
+                return await self._run(self._executor, self._file_manager.mkdir, path)
+
+            content_type = model.get("mimetype", None)
+            if not content_type:
+                content_type, _ = mimetypes.guess_type(path or "")
+            contents = model["content"]
+            created_model = None
+            if chunk == 1:
+                # The chunked upload replaces anything staged for the path.
+                await self._discard_write_back(path)
+            if self._write_back and chunk is None:
+                # Acknowledge the save once it is on local disk; it is
+                # uploaded in the background.
+                created_model = await self._run(
+                    self._executor, self._stage_save, model, path, content_type
+                )
+            elif model["type"] == "notebook":
+                # The notebook is converted and serialized by the file manager,
+                # off of the event loop.
+                created_model = await self._run(
+                    self._executor, self._file_manager.create_notebook, contents, path
+                )
+            elif model["type"] == "file":
+                if model["format"] == "base64":
+                    b64_bytes = contents.encode("ascii")
+                    contents = base64.decodebytes(b64_bytes)
+                created_model = await self._run(
+                    self._executor,
+                    self._file_manager.create_file,
+                    contents,
+                    content_type,
+                    path,
+                    chunk,
+                )
+                if chunk is not None and chunk != -1:
+                    return created_model
+            # Follow the upstream pattern of only running the post-save hooks for the last chunk
+            # (or for non-chunked uploads).
+            self.run_post_save_hooks(model=model, os_path=path)
+            if created_model is None:
+                return await self.get(path, type=model["type"], content=False)
+            # The upload already returned the metadata of the saved object.
+            return created_model
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(500, "Internal server error: {}".format(str(ex)))
+
+    async def delete_file(self, path):
+        self.log.debug(f'Deleting the file "{path}" from GCS...')
+        try:
+            await self._discard_write_back(path)
+            return await self._run(
+                self._bulk_executor, self._file_manager.delete_file, path
+            )
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(500, "Internal server error: {}".format(str(ex)))
+
+    async def rename_file(self, old_path, new_path):
+        self.log.debug(f'Renaming the file "{old_path}" in GCS to {new_path}...')
+        try:
+            await self._flush_write_back(old_path)
+            await self._discard_write_back(new_path)
+            return await self._run(
+                self._bulk_executor,
+                self._file_manager.rename_file,
+                old_path,
+                new_path,
+            )
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(500, "Internal server error: {}".format(str(ex)))
+
+
+class CombinedContentsManager(AsyncContentsManager):
+    root_dir = Unicode(config=True)
+
+    preferred_dir = Unicode("", config=True)
+
+    mounts = Dict(
+        config=True,
+        help="""
+        The top-level directories, and what each of them is backed by.
+
+        Each key is the name of a top-level directory, and each value is a
+        dict with a "type" of either "gcs" or "local". The rest of the dict
+        sets traits of the `GCSContentsManager` (e.g. "bucket_name" and
+        "bucket_notebooks_path") or the `FileContentsManager` (e.g.
+        "root_dir") backing the directory, overriding their configured
+        values. For example:
+
+            {
+                "Team A": {"type": "gcs", "bucket_name": "team-a-notebooks"},
+                "Scratch": {"type": "local", "root_dir": "/scratch"},
+            }
+
+        Every GCS directory gets its own executors and caches. When this is
+        empty, there are two directories: "Local Disk" and "GCS".""",
+    )
+
+    mount_timeout = Float(
+        5.0,
+        config=True,
+        help="""
+        Number of seconds to wait for each mount when listing the top-level
+        directory.
+
+        A mount that does not respond in time is still listed, with
+        placeholder metadata, rather than holding up the listing. Set to 0
+        to wait for every mount for as long as it takes.""",
+    )
+
+    root_listing_cache_ttl = Float(
+        10.0,
+        config=True,
+        help="""
+        Number of seconds for which a listing of the top-level directory is
+        reused. Listings with mounts that failed to respond are not reused.
+        Set to 0 to disable this cache.""",
+    )
+
+    @validate("mounts")
+    def _validate_mounts(self, proposal):
+        mount_classes = {"gcs": GCSContentsManager, "local": AsyncLargeFileManager}
+        for name, settings in proposal["value"].items():
+            if not name or "/" in name:
+                raise TraitError(f'Invalid mount name "{name}"')
+            mount_class = mount_classes.get(settings.get("type", None), None)
+            if mount_class is None:
+                raise TraitError(
+                    f'The mount "{name}" must have a "type" of "gcs" or "local"'
+                )
+            unknown = (
+                set(settings)
+                - {"type"}
+                - set(mount_class.class_trait_names(config=True))
+            )
+            if unknown:
+                raise TraitError(
+                    f'Unknown settings for the mount "{name}": '
+                    f"{', '.join(sorted(unknown))}"
+                )
+        return proposal["value"]
+
+    @default("checkpoints")
+    def _default_checkpoints(self):
+        return CombinedCheckpointsManager(self._content_managers)
+
+    def __init__(self, *args, **kwargs):
+        super(CombinedContentsManager, self).__init__(*args, **kwargs)
+
+        mounts = self.mounts or {
+            "Local Disk": {"type": "local"},
+            "GCS": {"type": "gcs"},
+        }
+        self._root_listing = None
+        # The mounted contents managers share the same parent and config,
+        # but not the settings that only apply to this contents manager.
+        own_traits = set(self.trait_names()) - set(
+            AsyncContentsManager.class_trait_names()
+        )
+        kwargs = {k: v for k, v in kwargs.items() if k not in own_traits}
+        self._content_managers = {}
+        for name, settings in mounts.items():
+            settings = dict(settings)
+            if settings.pop("type") == "local":
+                file_cm = AsyncLargeFileManager(*args, **{**kwargs, **settings})
+                file_cm.checkpoints = AsyncGenericFileCheckpoints(
+                    **file_cm.checkpoints_kwargs
+                )
+                self._content_managers[name] = file_cm
+            else:
+                self._content_managers[name] = GCSContentsManager(
+                    *args, **{**kwargs, **settings}
+                )
+
+    def _content_manager_for_path(self, path):
+        path = normalize_path(path)
+        mount_name, _, relative_path = path.partition("/")
+        if mount_name in self._content_managers:
+            return (
+                self._content_managers[mount_name],
+                path[len(mount_name) :],
+                mount_name,
+            )
+        if "/" in path:
+            return None, relative_path, mount_name
+        return None, path, ""
+
+    async def is_hidden(self, path):
+        try:
+            cm, relative_path, unused_path_prefix = self._content_manager_for_path(path)
+            if not cm:
+                return False
+            return await cm.is_hidden(relative_path)
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(
+                500, "Internal server error: [{}] {}".format(type(ex), str(ex))
+            )
+
+    async def file_exists(self, path):
+        try:
+            cm, relative_path, unused_path_prefix = self._content_manager_for_path(path)
+            if not cm:
+                return False
+            return await cm.file_exists(relative_path)
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(
+                500, "Internal server error: [{}] {}".format(type(ex), str(ex))
+            )
+
+    async def dir_exists(self, path):
+        if path in ["", "/"]:
+            return True
+        try:
+            cm, relative_path, unused_path_prefix = self._content_manager_for_path(path)
+            if not cm:
+                return False
+            return await cm.dir_exists(relative_path)
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(
+                500, "Internal server error: [{}] {}".format(type(ex), str(ex))
+            )
+
+    async def list_page(self, path, page_token=None, page_size=None):
+        """See `GCSContentsManager.list_page`."""
+        cm, relative_path, path_prefix = self._content_manager_for_path(path)
+        if not cm:
+            raise HTTPError(404, 'No content manager defined for "{}"'.format(path))
+        if not isinstance(cm, GCSContentsManager):
+            raise HTTPError(
+                400, "Paginated listings are only supported for GCS directories"
+            )
+        return await cm.list_page(relative_path, page_token, page_size, path_prefix)
+
+    @staticmethod
+    def _make_model_relative(model, path_prefix):
+        """Move the path of a model, and those of its children, under a mount."""
+        if "path" in model:
+            model["path"] = _mount_path(path_prefix, model["path"])
+        children = model.get("content", None)
+        if children and model.get("type", None) == "directory":
+            for child in children:
+                if "path" in child:
+                    child["path"] = _mount_path(path_prefix, child["path"])
+
+    async def _get_mount(self, path_prefix, **kwargs):
+        """Return the model of a mount's root, and whether it responded in time."""
+        try:
+            child_obj = await asyncio.wait_for(
+                self._content_managers[path_prefix].get(
+                    "", content=False, type="directory", **kwargs
+                ),
+                self.mount_timeout or None,
+            )
+            responded = True
+        except Exception as ex:
+            self.log.warning(f'Failed to get the mount "{path_prefix}": {ex!r}')
+            now = datetime.datetime.now(datetime.timezone.utc)
+            child_obj = {
+                "type": "directory",
+                "mimetype": None,
+                "format": None,
+                "content": None,
+                "created": now,
+                "last_modified": now,
+            }
+            responded = False
+        child_obj["path"] = path_prefix
+        child_obj["name"] = path_prefix
+        child_obj["writable"] = False
+        return child_obj, responded
+
+    async def _list_mounts(self, **kwargs):
+        """Get the models of every mount concurrently, reusing a recent listing."""
+        if self._root_listing and time.monotonic() < self._root_listing[0]:
+            return [dict(child_obj) for child_obj in self._root_listing[1]]
+        results = await asyncio.gather(
+            *(
+                self._get_mount(path_prefix, **kwargs)
+                for path_prefix in self._content_managers
+            )
+        )
+        contents = [child_obj for child_obj, _ in results]
+        if self.root_listing_cache_ttl and all(responded for _, responded in results):
+            self._root_listing = (
+                time.monotonic() + self.root_listing_cache_ttl,
+                [dict(child_obj) for child_obj in contents],
+            )
+        return contents
+
+    async def get(self, path, content=True, type=None, format=None, **kwargs):
+        if path in ["", "/"]:
+            dir_obj = {}
+            dir_obj["path"] = ""
+            dir_obj["name"] = ""
+            dir_obj["type"] = "directory"
+            dir_obj["mimetype"] = None
+            dir_obj["writable"] = False
+            dir_obj["format"] = None
+            dir_obj["content"] = None
+            contents = await self._list_mounts(**kwargs)
+            if content:
+                dir_obj["content"] = contents
+                dir_obj["format"] = "json"
+            dir_obj["created"] = contents[0]["created"]
+            dir_obj["last_modified"] = contents[0]["last_modified"]
+            return dir_obj
+        try:
+            cm, relative_path, path_prefix = self._content_manager_for_path(path)
+            if not cm:
+                raise HTTPError(404, 'No content manager defined for "{}"'.format(path))
+            if isinstance(cm, GCSContentsManager):
+                # Filter and move the listing of a GCS directory in a single pass.
+                return await cm.get(
+                    relative_path,
+                    content=content,
+                    type=type,
+                    format=format,
+                    path_prefix=path_prefix,
+                    **kwargs,
+                )
+            model = await cm.get(
+                relative_path, content=content, type=type, format=format, **kwargs
+            )
+            if model:
+                self._make_model_relative(model, path_prefix)
+            return model
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(
+                500, "Internal server error: [{}] {}".format(type(ex), str(ex))
+            )
+
+    async def save(self, model, path):
+        if path in ["", "/"]:
+            raise HTTPError(403, "The top-level directory is read-only")
+        try:
+            chunk = model.get("chunk", None)
+            if chunk is None or chunk == 1:
+                # Follow the upstream pattern of only running the pre-save hooks for the first chunk
+                # (or for non-chunked uploads).
+                self.run_pre_save_hooks(model=model, path=path)
+
+            cm, relative_path, path_prefix = self._content_manager_for_path(path)
+            if (relative_path in ["", "/"]) or (path_prefix in ["", "/"]):
+                raise HTTPError(403, "The top-level directory contents are read-only")
+            if not cm:
+                raise HTTPError(404, 'No content manager defined for "{}"'.format(path))
+
+            if "path" in model:
+                model["path"] = relative_path
+
+            model = await cm.save(model, relative_path)
+            if "path" in model:
+                model["path"] = path
+            if chunk is None or chunk == -1:
+                # Follow the upstream pattern of only running the post-save hooks for the last chunk
+                # (or for non-chunked uploads).
+                self.run_post_save_hooks(model=model, os_path=relative_path)
+            return model
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(
+                500, "Internal server error: [{}] {}".format(type(ex), str(ex))
+            )
+
+    async def delete_file(self, path):
+        if path in ["", "/"]:
+            raise HTTPError(403, "The top-level directory is read-only")
+        try:
+            cm, relative_path, path_prefix = self._content_manager_for_path(path)
+            if (relative_path in ["", "/"]) or (path_prefix in ["", "/"]):
+                raise HTTPError(403, "The top-level directory contents are read-only")
+            if not cm:
+                raise HTTPError(404, 'No content manager defined for "{}"'.format(path))
+            return await cm.delete_file(relative_path)
+        except OSError as err:
+            # The built-in file contents manager will not attempt to wrap permissions
+            # errors when deleting files if they occur while trying to move the
+            # to-be-deleted file to the trash, because the underlying send2trash
+            # library does not set the errno attribute of the raised OSError.
+            #
+            # To work around this we explicitly catch such errors, check if they
+            # start with the magic text "Permission denied", and then wrap them
+            # in an HTTPError.
+            if str(err).startswith("Permission denied"):
+                raise HTTPError(403, str(err))
+            raise HTTPError(
+                500, "Internal server error: [{}] {}".format(err.errno, str(err))
+            )
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(
+                500, "Internal server error: [{}] {}".format(type(ex), str(ex))
+            )
+
+    async def rename_file(self, old_path, new_path):
+        if (old_path in ["", "/"]) or (new_path in ["", "/"]):
+            raise HTTPError(403, "The top-level directory is read-only")
+        try:
+            old_cm, old_relative_path, old_prefix = self._content_manager_for_path(
+                old_path
+            )
+            if (old_relative_path in ["", "/"]) or (old_prefix in ["", "/"]):
+                raise HTTPError(403, "The top-level directory contents are read-only")
+            if not old_cm:
+                raise HTTPError(
+                    404, 'No content manager defined for "{}"'.format(old_path)
+                )
+
+            new_cm, new_relative_path, new_prefix = self._content_manager_for_path(
+                new_path
+            )
+            if (new_relative_path in ["", "/"]) or (new_prefix in ["", "/"]):
+                raise HTTPError(403, "The top-level directory contents are read-only")
+            if not new_cm:
+                raise HTTPError(
+                    404, 'No content manager defined for "{}"'.format(new_path)
+                )
+
+            if old_cm != new_cm:
+                raise HTTPError(400, "Unsupported rename across file systems")
+            return await old_cm.rename_file(old_relative_path, new_relative_path)
+        except HTTPError as err:
+            raise err
+        except Exception as ex:
+            raise HTTPError(
+                500, "Internal server error: [{}] {}".format(type(ex), str(ex))
+            )
@@ -0,0 +1,63 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import atexit
+import concurrent.futures
+import time
+
+from prometheus_client import Gauge, Histogram
+
+_executor_queue_depth = Gauge(
+    "gcs_contents_executor_queue_depth",
+    "Number of GCS operations waiting for a free executor thread.",
+    ["pool", "instance"],
+)
+_executor_wait_seconds = Histogram(
+    "gcs_contents_executor_wait_seconds",
+    "Time GCS operations spend waiting for a free executor thread.",
+    ["pool", "instance"],
+)
+
+
+class InstrumentedExecutor(concurrent.futures.ThreadPoolExecutor):
+    """A thread pool that reports its queue depth and queueing delay."""
+
+    def __init__(self, pool_name: str, max_workers: int, instance: str = ""):
+        super().__init__(max_workers=max_workers, thread_name_prefix=f"gcs-{pool_name}")
+        self.pool_name = pool_name
+        self._queue_depth = _executor_queue_depth.labels(
+            pool=pool_name, instance=instance
+        )
+        self._wait_seconds = _executor_wait_seconds.labels(
+            pool=pool_name, instance=instance
+        )
+        atexit.register(self.shutdown)
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted = time.monotonic()
+        self._queue_depth.inc()
+
+        def run():
+            self._queue_depth.dec()
+            self._wait_seconds.observe(time.monotonic() - submitted)
+            return fn(*args, **kwargs)
+
+        future = super().submit(run)
+        future.add_done_callback(self._dequeue_if_cancelled)
+        return future
+
+    def _dequeue_if_cancelled(self, future):
+        # Cancelled operations (e.g. on shutdown) never start running.
+        if future.cancelled():
+            self._queue_depth.dec()
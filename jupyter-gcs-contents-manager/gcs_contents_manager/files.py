@@ -0,0 +1,1181 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import datetime
+import hashlib
+import logging
+import posixpath
+import re
+import threading
+import time
+
+from jupyter_server.utils import url_path_join
+
+from tornado.web import HTTPError
+
+import google.auth
+import google.auth.credentials
+from google.api_core import exceptions as api_exceptions
+import google.auth.transport.requests
+import requests.adapters
+from google.cloud import storage
+from prometheus_client import Counter
+
+from gcs_contents_manager.caches import ContentCache, MetadataCache
+from gcs_contents_manager.executors import InstrumentedExecutor
+from gcs_contents_manager.index import MetadataIndex
+from gcs_contents_manager.utils import (
+    _CLASSIFY_MAX_RESULTS,
+    _ContentEncoder,
+    _ContentTooLarge,
+    _DECODED_CRC32C_KEY,
+    _DECODED_SIZE_KEY,
+    _GCS_API_ENDPOINT,
+    _GCS_SCOPES,
+    _MAX_BATCH_SIZE,
+    _MAX_COMPOSE_SOURCES,
+    _READ_CHUNK_SIZE,
+    _crc32c,
+    _gunzip_chunks,
+    _gzip,
+    _limit_chunks,
+    _read_notebook,
+    _slice_chunks,
+    _storage_api_endpoint,
+    _write_notebook,
+    normalize_path,
+    utf8_encoding,
+)
+
+_uploads_skipped = Counter(
+    "gcs_contents_uploads_skipped",
+    "Number of saves that skipped the upload because the contents were unchanged.",
+)
+_upload_bytes_skipped = Counter(
+    "gcs_contents_upload_bytes_skipped",
+    "Number of bytes not uploaded because the saved contents were unchanged.",
+)
+
+
+# The number of bytes buffered by a resumable upload session before they are
+# sent to GCS. This must be a multiple of 256 KiB.
+_UPLOAD_SESSION_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+# Bucket handles shared by every file manager in the process.
+_storage_buckets = {}
+_storage_lock = threading.Lock()
+
+
+def _shared_bucket(project, bucket_name, pool_size, api_endpoint=None):
+    """Return the process-wide handle for a bucket, without fetching its metadata."""
+    api_endpoint = _storage_api_endpoint(api_endpoint)
+    with _storage_lock:
+        key = (project, api_endpoint, bucket_name)
+        if key not in _storage_buckets:
+            client_options = None
+            if api_endpoint == _GCS_API_ENDPOINT:
+                credentials, default_project = google.auth.default(scopes=_GCS_SCOPES)
+                project = project or default_project
+            else:
+                credentials = google.auth.credentials.AnonymousCredentials()
+                client_options = {"api_endpoint": api_endpoint}
+            http = google.auth.transport.requests.AuthorizedSession(credentials)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size
+            )
+            http.mount("https://", adapter)
+            http.mount("http://", adapter)
+            client = storage.Client(
+                project=project or None,
+                credentials=credentials,
+                client_options=client_options,
+                _http=http,
+            )
+            _storage_buckets[key] = client.bucket(bucket_name)
+        return _storage_buckets[key]
+
+
+class _UploadSession:
+    """An in-progress, resumable upload of a single file."""
+
+    def __init__(self, blob, writer):
+        self.blob = blob
+        self.writer = writer
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.last_active = time.monotonic()
+
+
+class ListingEntry:
+    """A compact record of a single child in a directory listing."""
+
+    __slots__ = ("name", "type", "created", "last_modified")
+
+    def __init__(self, name, type, created, last_modified):
+        self.name = name
+        self.type = type
+        self.created = created
+        self.last_modified = last_modified
+
+    def to_model(self, dir_path):
+        return {
+            "path": url_path_join(dir_path, self.name),
+            "name": self.name,
+            "type": self.type,
+            "last_modified": self.last_modified,
+            "created": self.created,
+            "content": None,
+            "format": None,
+            "mimetype": None,
+            "writable": True,
+        }
+
+
+class GCSFileManagerBase:
+    """Logic shared by the `google-cloud-storage` and asyncio GCS file managers."""
+
+    def __init__(
+        self,
+        project: str,
+        bucket_name: str,
+        bucket_path_prefix: str,
+        metadata_cache_size: int = 1024,
+        metadata_cache_ttl: float = 5.0,
+        max_inline_content_size: int = 0,
+        max_listing_entries: int = 0,
+        content_cache_size: int = 64 * 1024 * 1024,
+        gzip_uploads: bool = False,
+        fast_notebook_io: bool = False,
+        log=None,
+    ):
+        self.project = project
+        self.gzip_uploads = gzip_uploads
+        self.fast_notebook_io = fast_notebook_io
+        self.max_inline_content_size = max_inline_content_size
+        self.max_listing_entries = max_listing_entries
+        self._content_cache = ContentCache(content_cache_size)
+        # The last generation of each blob read or written here; saves are
+        # conditional on it so they don't overwrite other writers' changes.
+        self._generations = MetadataCache(metadata_cache_size, float("inf"))
+        self.log = log or logging.getLogger(__name__)
+        self.bucket_name = bucket_name
+        self.bucket_path_prefix = bucket_path_prefix
+        self._metadata_cache = MetadataCache(metadata_cache_size, metadata_cache_ttl)
+        self._index = None
+
+    def _gcs_path(self, path):
+        path = normalize_path(path)
+        if not self.bucket_path_prefix:
+            return path
+        if not path:
+            return self.bucket_path_prefix
+        return url_path_join(self.bucket_path_prefix, path)
+
+    def _chunks_dir(self, path):
+        path_hash = hashlib.sha256(path.encode("utf-8")).hexdigest()
+        return self._gcs_path(url_path_join(".chunks/", path_hash))
+
+    def _chunks_path(self, path):
+        return url_path_join(self._chunks_dir(path), "chunk#")
+
+    def _dir_prefix(self, path):
+        """Return the blob name prefix of everything inside the given directory."""
+        blob_name_prefix = self._gcs_path(path)
+        return blob_name_prefix + "/" if blob_name_prefix else ""
+
+    def _invalidate_metadata(self, blob_name, recursive=False):
+        """Drop any cached metadata that a write to `blob_name` could make stale."""
+        cache = self._metadata_cache
+        cache.invalidate(("blob", blob_name))
+        cache.invalidate(("dir", blob_name))
+        if recursive:
+            cache.invalidate_prefix(blob_name + "/")
+        # Cached contents are keyed by generation, so they can never be
+        # stale; they are only dropped here to free up the memory sooner.
+        if recursive:
+            self._content_cache.invalidate_prefix(blob_name + "/")
+        # Forgetting the generation after a failed write means that a second
+        # attempt at the same save goes through, overwriting the other writer.
+        self._generations.invalidate(("generation", blob_name))
+        if recursive:
+            self._generations.invalidate_prefix(blob_name + "/")
+        parent = posixpath.dirname(blob_name)
+        while parent:
+            cache.invalidate(("dir", parent))
+            parent = posixpath.dirname(parent)
+        if self._index:
+            self._index.invalidate(blob_name, recursive)
+
+    def _index_put(self, blob):
+        if self._index:
+            self._index.put(blob)
+
+    def _remember_generation(self, blob):
+        self._generations.put(("generation", blob.name), blob.generation)
+
+    def _expected_generation(self, blob_name, blob):
+        """Return the generation that a save to `blob_name` should replace."""
+        generation = self._generations.get(("generation", blob_name))
+        if generation is MetadataCache.MISSING:
+            generation = blob.generation if blob else None
+        return generation or 0
+
+    def _content_encoding(self, content_type):
+        """Return the Content-Encoding to store a new file of the given type with."""
+        if self.gzip_uploads and content_type and content_type.startswith("text/"):
+            return "gzip"
+        return None
+
+    def _encode_for_upload(self, content, content_encoding):
+        if content_encoding == "gzip":
+            return _gzip(content)
+        return content
+
+    @staticmethod
+    def _upload_metadata(blob, content, content_encoding):
+        """Return the custom metadata to store a new version of a blob with."""
+        metadata = dict((blob.metadata if blob else None) or {})
+        metadata.pop(_DECODED_SIZE_KEY, None)
+        metadata.pop(_DECODED_CRC32C_KEY, None)
+        if content_encoding == "gzip":
+            metadata[_DECODED_SIZE_KEY] = str(len(content))
+            metadata[_DECODED_CRC32C_KEY] = _crc32c(content)
+        return metadata or None
+
+    @staticmethod
+    def _decoded_size(blob):
+        """Return the size of the decoded contents of a blob, or None if unknown."""
+        if blob.content_encoding != "gzip":
+            return blob.size or 0
+        size = (blob.metadata or {}).get(_DECODED_SIZE_KEY, None)
+        return int(size) if size is not None else None
+
+    @staticmethod
+    def _content_hash(blob):
+        """Return the CRC32C reported as the hash of a file."""
+        if blob.content_encoding == "gzip":
+            return (blob.metadata or {}).get(_DECODED_CRC32C_KEY, blob.crc32c)
+        return blob.crc32c
+
+    def _is_unchanged(self, blob_name, blob, data, content_type, content_encoding):
+        """Check whether uploading `data` would leave the blob as it already is."""
+        if not blob or blob.generation is None or not blob.crc32c:
+            return False
+        if blob.content_type != content_type:
+            return False
+        if blob.content_encoding != content_encoding:
+            return False
+        if blob.generation != self._expected_generation(blob_name, blob):
+            # Let the save go ahead, so that the conflict is reported.
+            return False
+        return _crc32c(data) == blob.crc32c
+
+    def _skip_upload(self, path, blob, data):
+        """Return the model of a save whose upload is skipped as unchanged."""
+        _uploads_skipped.inc()
+        _upload_bytes_skipped.inc(len(data))
+        self._metadata_cache.put(("blob", blob.name), blob)
+        self._remember_generation(blob)
+        return self._file_metadata(path, blob)
+
+    @staticmethod
+    def _conflict(path):
+        return HTTPError(
+            409,
+            f'"{path}" was changed by another writer since it was last read; '
+            "reload it, or save again to overwrite those changes",
+        )
+
+    def _classify_candidates(self, blob_name, candidates, max_results):
+        """Return (blob, is_dir, unknown) given the first blobs listed under a path."""
+        if candidates and candidates[0].name == blob_name:
+            return candidates[0], False, False
+        dir_prefix = blob_name + "/"
+        if any(c.name.startswith(dir_prefix) for c in candidates):
+            return None, True, False
+        return None, False, len(candidates) == max_results
+
+    def _file_metadata(self, path, blob):
+        return {
+            "path": path,
+            "name": posixpath.basename(path),
+            "last_modified": blob.updated,
+            "created": blob.time_created,
+            "writable": True,
+            "type": "notebook" if path.endswith(".ipynb") else "file",
+            "content": None,
+            "format": None,
+            "mimetype": None,
+        }
+
+    def _check_inline_size(self, path, blob):
+        """Reject large files; returns the limit on their decoded size, or 0."""
+        limit = self.max_inline_content_size
+        size = self._decoded_size(blob)
+        if size is None:
+            return limit
+        if limit and size > limit:
+            raise self._too_large(path, size)
+        return 0
+
+    def _too_large(self, path, size=None):
+        size = f" ({size} bytes)" if size is not None else ""
+        return HTTPError(
+            413,
+            f'"{path}" is too large to open{size}; '
+            f"the maximum size is {self.max_inline_content_size} bytes",
+        )
+
+    @staticmethod
+    def _content_format(blob):
+        if blob.content_type and blob.content_type.startswith("text/"):
+            return "text/plain", "text"
+        return "application/octet-stream", "base64"
+
+    @staticmethod
+    def _byte_ranges(size, start, end):
+        """Split the bytes [start, end) of an object into download-sized ranges."""
+        end = size if end is None else min(end, size)
+        for offset in range(start, end, _READ_CHUNK_SIZE):
+            yield offset, min(offset + _READ_CHUNK_SIZE, end)
+
+    def _dir_metadata(self, path):
+        return {
+            "path": path,
+            "name": posixpath.basename(path),
+            "type": "directory",
+            "last_modified": self._dir_timestamp,
+            "created": self._dir_timestamp,
+            "content": None,
+            "format": None,
+            "mimetype": None,
+            "writable": True,
+        }
+
+    def _add_listing_page(
+        self, files, subdirs, blob_name_prefix, objects, subdir_names
+    ):
+        """Add one page of a delimited listing to the entries listed so far."""
+        for obj in objects:
+            name = obj.name[len(blob_name_prefix) :]
+            if name:  # Ignore the place-holder blob for the directory itself
+                file_type = "notebook" if name.endswith(".ipynb") else "file"
+                files[name] = ListingEntry(
+                    name, file_type, obj.time_created, obj.updated
+                )
+        if subdir_names:
+            dir_timestamp = self._dir_timestamp
+            for name in subdir_names:
+                if name:
+                    subdirs[name] = ListingEntry(
+                        name, "directory", dir_timestamp, dir_timestamp
+                    )
+        limit = self.max_listing_entries
+        return not limit or len(files) + len(subdirs) < limit
+
+    @staticmethod
+    def _merge_entries(files, subdirs):
+        # A regular file overrides a sub-directory with the same name; see `dir_exists`.
+        entries = list(files.values())
+        entries.extend(entry for name, entry in subdirs.items() if name not in files)
+        return entries
+
+    def _page_entries(self, blob_name_prefix, objects, subdir_names):
+        """Get the entries for a single page of a delimited listing."""
+        files = {}
+        subdirs = {}
+        self._add_listing_page(files, subdirs, blob_name_prefix, objects, subdir_names)
+        return self._merge_entries(files, subdirs)
+
+    def _finish_listing(self, dir_obj, files, subdirs, truncated, compact):
+        """Set the content of a directory model to the entries listed."""
+        entries = self._merge_entries(files, subdirs)
+        limit = self.max_listing_entries
+        if limit and len(entries) > limit:
+            del entries[limit:]
+            truncated = True
+        if truncated:
+            dir_obj["truncated"] = True
+        if compact:
+            dir_obj["content"] = entries
+        else:
+            dir_obj["content"] = [entry.to_model(dir_obj["path"]) for entry in entries]
+        return dir_obj
+
+
+class GCSBasedFileManager(GCSFileManagerBase):
+    def __init__(
+        self,
+        project: str,
+        bucket_name: str,
+        bucket_path_prefix: str,
+        metadata_cache_size: int = 1024,
+        metadata_cache_ttl: float = 5.0,
+        max_inline_content_size: int = 0,
+        max_listing_entries: int = 0,
+        content_cache_size: int = 64 * 1024 * 1024,
+        gzip_uploads: bool = False,
+        fast_notebook_io: bool = False,
+        chunked_upload_mode: str = "compose",
+        upload_session_timeout: float = 3600.0,
+        fanout_threads: int = 16,
+        copy_concurrency: int = 32,
+        http_pool_size: int = 10,
+        api_endpoint: str = None,
+        metadata_index_path: str = "",
+        metadata_index_max_staleness: float = 600.0,
+        metadata_index_refresh_interval: float = 300.0,
+        log=None,
+    ):
+        super().__init__(
+            project,
+            bucket_name,
+            bucket_path_prefix,
+            metadata_cache_size=metadata_cache_size,
+            metadata_cache_ttl=metadata_cache_ttl,
+            max_inline_content_size=max_inline_content_size,
+            max_listing_entries=max_listing_entries,
+            content_cache_size=content_cache_size,
+            gzip_uploads=gzip_uploads,
+            fast_notebook_io=fast_notebook_io,
+            log=log,
+        )
+        self.chunked_upload_mode = chunked_upload_mode
+        self.upload_session_timeout = upload_session_timeout
+        self.fanout_threads = fanout_threads
+        self.copy_concurrency = copy_concurrency
+        self.http_pool_size = http_pool_size
+        self.api_endpoint = api_endpoint
+        self._cached_bucket = None
+        self._upload_sessions = {}
+        self._upload_sessions_lock = threading.Lock()
+        self._upload_session_sweep = None
+        # Fans out GCS requests from work already running on the contents
+        # manager's executors. Work here must never wait on other work here.
+        instance = f"{bucket_name}/{bucket_path_prefix}"
+        self._fanout_executor = InstrumentedExecutor("fanout", fanout_threads, instance)
+        # Background cleanups fan out their own deletes, so they run elsewhere.
+        self._cleanup_executor = InstrumentedExecutor("cleanup", 1, instance)
+        self._copy_executor = InstrumentedExecutor("copy", copy_concurrency, instance)
+        self._closed = threading.Event()
+        self._index_refresher = None
+        if metadata_index_path:
+            self._index = MetadataIndex(
+                metadata_index_path,
+                bucket_name,
+                self._dir_prefix(""),
+                metadata_index_max_staleness,
+                refresh_interval=metadata_index_refresh_interval,
+                log=self.log,
+            )
+            self._index_refresher = threading.Thread(
+                target=self._refresh_index,
+                name="gcs-metadata-index",
+                daemon=True,
+            )
+            self._index_refresher.start()
+
+    def _refresh_index(self):
+        """Keep relisting the indexed prefix in full, until closed."""
+        interval = self._index.refresh_interval
+        while not self._closed.is_set():
+            try:
+                interval = self._index.refresh(self._index_pages())
+            except Exception as ex:
+                if not self._closed.is_set():
+                    self.log.warning(f"Failed to refresh the GCS metadata index: {ex}")
+            self._closed.wait(interval)
+
+    def _index_pages(self):
+        blobs = self.bucket.list_blobs(
+            prefix=self._index.prefix,
+            fields=(
+                "items(name,generation,size,contentType,contentEncoding,"
+                "crc32c,timeCreated,updated,metadata),nextPageToken"
+            ),
+        )
+        for page in blobs.pages:
+            if self._closed.is_set():
+                # Abandon the listing before the index drops what it has not seen.
+                raise RuntimeError("The file manager was closed")
+            yield list(page)
+
+    def close(self):
+        """Stop refreshing the metadata index, and close it."""
+        self._closed.set()
+        if self._index_refresher is not None:
+            self._index_refresher.join()
+            self._index.close()
+
+    @property
+    def bucket(self):
+        if not self._cached_bucket:
+            self._cached_bucket = _shared_bucket(
+                self.project, self.bucket_name, self.http_pool_size, self.api_endpoint
+            )
+        return self._cached_bucket
+
+    def _bucket_metadata(self):
+        """Return the bucket, fetching its metadata the first time it is needed."""
+        bucket = self.bucket
+        if bucket.time_created is None:
+            bucket.reload()
+        return bucket
+
+    @property
+    def _dir_timestamp(self):
+        return self._bucket_metadata().time_created
+
+    def _list_chunks(self, path):
+        return [blob for blob in self.bucket.list_blobs(prefix=self._chunks_path(path))]
+
+    def _blob(self, path, create_if_missing=False, chunk=None):
+        blob_name = self._gcs_path(path)
+        if chunk:
+            # Chunks are short-lived, so there is no point in caching them.
+            blob_name = f"{self._chunks_path(path)}{chunk:09d}"
+            blob = self.bucket.get_blob(blob_name)
+        else:
+            blob = self._metadata_cache.get(("blob", blob_name))
+            if blob is MetadataCache.MISSING:
+                blob = self.bucket.get_blob(blob_name)
+                self._metadata_cache.put(("blob", blob_name), blob)
+        if not blob and create_if_missing:
+            blob = self.bucket.blob(blob_name)
+        return blob
+
+    def _combine_chunks(self, path, content_type):
+        blob_name = self._gcs_path(path)
+        blob = self.bucket.blob(blob_name)
+        chunk_blobs = self._list_chunks(path)
+        # The last chunk is -1, which lexicographically comes first; move it to the end.
+        chunk_blobs = chunk_blobs[1:] + chunk_blobs[0:1]
+        intermediate_blobs = self._compose(
+            blob,
+            chunk_blobs,
+            content_type,
+            url_path_join(self._chunks_dir(path), "compose#"),
+        )
+        # Clean up the no-longer needed chunk blobs in the background, so that
+        # the final request of the upload does not have to wait for it.
+        cleanup = self._cleanup_executor.submit(
+            self._delete_blobs, chunk_blobs + intermediate_blobs, True
+        )
+        cleanup.add_done_callback(self._log_cleanup_failure)
+        return blob
+
+    def _log_cleanup_failure(self, future):
+        if future.exception():
+            self.log.warning(
+                "Failed to clean up the chunks of an upload: %s", future.exception()
+            )
+
+    def _compose(self, blob, sources, content_type, intermediate_prefix):
+        """Compose the sources into `blob`; returns the intermediate blobs."""
+        intermediate_blobs = []
+        level = 0
+        while len(sources) > _MAX_COMPOSE_SOURCES:
+            groups = [
+                sources[i : i + _MAX_COMPOSE_SOURCES]
+                for i in range(0, len(sources), _MAX_COMPOSE_SOURCES)
+            ]
+            targets = [
+                self.bucket.blob(f"{intermediate_prefix}{level:03d}-{i:09d}")
+                for i in range(len(groups))
+            ]
+
+            def compose_group(target, group):
+                target.content_type = content_type
+                target.compose(group)
+                return target
+
+            sources = list(self._fanout_executor.map(compose_group, targets, groups))
+            intermediate_blobs.extend(sources)
+            level += 1
+        blob.content_type = content_type
+        blob.compose(sources, if_generation_match=0)
+        return intermediate_blobs
+
+    def _delete_blobs(self, blobs, if_unchanged=False, description=None):
+        """Delete the given blobs using concurrent batch requests."""
+        progress_lock = threading.Lock()
+        progress = {"deleted": 0, "failed": []}
+        ignored_errors = (api_exceptions.NotFound,)
+        if if_unchanged:
+            ignored_errors += (api_exceptions.PreconditionFailed,)
+
+        def delete(blob):
+            blob.delete(if_generation_match=(blob.generation if if_unchanged else None))
+
+        def delete_batch(batch_blobs):
+            failed = []
+            try:
+                with self.bucket.client.batch():
+                    for blob in batch_blobs:
+                        delete(blob)
+            except Exception:
+                # A failed batch only reports its last error, so retry its
+                # deletions one by one to find out which of them failed.
+                for blob in batch_blobs:
+                    try:
+                        delete(blob)
+                    except ignored_errors:
+                        pass
+                    except Exception as ex:
+                        self.log.warning("Failed to delete %s: %s", blob.name, ex)
+                        failed.append(blob.name)
+            with progress_lock:
+                progress["deleted"] += len(batch_blobs) - len(failed)
+                progress["failed"].extend(failed)
+                if description:
+                    self.log.info(
+                        "Deleted %d objects %s so far", progress["deleted"], description
+                    )
+
+        # Only list ahead as far as the fanout executor can keep up with.
+        in_flight = threading.BoundedSemaphore(self.fanout_threads)
+        futures = []
+
+        def submit(batch_blobs):
+            in_flight.acquire()
+            future = self._fanout_executor.submit(delete_batch, batch_blobs)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+
+        batch_blobs = []
+        for blob in blobs:
+            batch_blobs.append(blob)
+            if len(batch_blobs) == _MAX_BATCH_SIZE:
+                submit(batch_blobs)
+                batch_blobs = []
+        if batch_blobs:
+            submit(batch_blobs)
+        concurrent.futures.wait(futures)
+
+        failed = progress["failed"]
+        if failed:
+            raise HTTPError(
+                500,
+                f"Failed to delete {len(failed)} of "
+                f"{progress['deleted'] + len(failed)} objects; "
+                f"for example: {', '.join(failed[:5])}",
+            )
+
+    def _classify(self, path):
+        """Return the path type ("file", "directory" or None) and the file's blob."""
+        path = normalize_path(path)
+        blob_name = self._gcs_path(path)
+        if not path:
+            exists = self._metadata_cache.get(("dir", blob_name))
+            if exists is MetadataCache.MISSING:
+                exists = self.bucket.exists()
+                self._metadata_cache.put(("dir", blob_name), exists)
+            return ("directory" if exists else None), None
+
+        blob = self._metadata_cache.get(("blob", blob_name))
+        is_dir = self._metadata_cache.get(("dir", blob_name))
+        if blob is not MetadataCache.MISSING:
+            if blob:
+                return "file", blob
+            if is_dir is not MetadataCache.MISSING:
+                return ("directory" if is_dir else None), None
+
+        candidates = list(
+            self.bucket.list_blobs(prefix=blob_name, max_results=_CLASSIFY_MAX_RESULTS)
+        )
+        blob, is_dir, unknown = self._classify_candidates(
+            blob_name, candidates, _CLASSIFY_MAX_RESULTS
+        )
+        if unknown:
+            for _ in self.bucket.list_blobs(prefix=blob_name + "/", max_results=1):
+                is_dir = True
+        self._metadata_cache.put(("blob", blob_name), blob)
+        self._metadata_cache.put(("dir", blob_name), is_dir)
+        if blob:
+            return "file", blob
+        return ("directory" if is_dir else None), None
+
+    def _indexed_type(self, path):
+        """Return the type of a path according to the metadata index, if it can tell."""
+        path = normalize_path(path)
+        if not self._index or not path:
+            return MetadataCache.MISSING
+        return self._index.classify(self._gcs_path(path))
+
+    def file_exists(self, path):
+        path = normalize_path(path)
+        if not path:
+            return False
+        path_type = self._indexed_type(path)
+        if path_type is MetadataCache.MISSING:
+            path_type, _ = self._classify(path)
+        return path_type == "file"
+
+    def dir_exists(self, path):
+        path_type = self._indexed_type(path)
+        if path_type is MetadataCache.MISSING:
+            path_type, _ = self._classify(path)
+        return path_type == "directory"
+
+    def _live_blob(self, blob_name, blob=None):
+        """Return a new handle on the live version of a blob, keeping its KMS key."""
+        # Cached blobs may be stale, and are shared between threads, so
+        # requests are never made through them.
+        kms_key_name = blob.kms_key_name if blob else None
+        if kms_key_name:
+            # GCS doesn't allow specifying the key version, so drop it if present
+            kms_key_name = re.split(r"/cryptoKeyVersions/\d+$", kms_key_name)[0]
+        return self.bucket.blob(blob_name, kms_key_name=kms_key_name)
+
+    def _expire_upload_sessions(self):
+        deadline = time.monotonic() - self.upload_session_timeout
+        with self._upload_sessions_lock:
+            expired = [
+                blob_name
+                for blob_name, session in self._upload_sessions.items()
+                if session.last_active < deadline
+            ]
+            expired_sessions = [self._upload_sessions.pop(name) for name in expired]
+        for session in expired_sessions:
+            self.log.warning(
+                "Abandoning the inactive upload session for %s", session.blob.name
+            )
+            try:
+                session.writer.terminate()
+            except Exception as ex:
+                self.log.debug("Failed to cancel an upload session: %s", ex)
+
+    def _schedule_upload_session_sweep(self):
+        """Expire inactive upload sessions even if no further chunks arrive."""
+        self._upload_session_sweep = threading.Timer(
+            self.upload_session_timeout, self._sweep_upload_sessions
+        )
+        self._upload_session_sweep.daemon = True
+        self._upload_session_sweep.start()
+
+    def _sweep_upload_sessions(self):
+        self._expire_upload_sessions()
+        with self._upload_sessions_lock:
+            self._upload_session_sweep = None
+            if self._upload_sessions:
+                self._schedule_upload_session_sweep()
+
+    def _write_to_upload_session(self, content, content_type, path, chunk):
+        """Stream one chunk of a chunked upload directly into the final object."""
+        self._expire_upload_sessions()
+        blob_name = self._gcs_path(path)
+        if chunk == 1:
+            blob = self._live_blob(blob_name, self._blob(path))
+            writer = blob.open(
+                "wb",
+                chunk_size=_UPLOAD_SESSION_CHUNK_SIZE,
+                ignore_flush=True,
+                content_type=content_type,
+            )
+            with self._upload_sessions_lock:
+                stale_session = self._upload_sessions.pop(blob_name, None)
+                self._upload_sessions[blob_name] = _UploadSession(blob, writer)
+                if self._upload_session_sweep is None:
+                    self._schedule_upload_session_sweep()
+            if stale_session:
+                stale_session.writer.terminate()
+        with self._upload_sessions_lock:
+            session = self._upload_sessions.get(blob_name, None)
+            if chunk == -1:
+                self._upload_sessions.pop(blob_name, None)
+        if not session:
+            raise HTTPError(
+                400, f"No upload is in progress for {path}; it may have expired"
+            )
+
+        if isinstance(content, str):
+            content = content.encode(utf8_encoding)
+        session.last_active = time.monotonic()
+        if chunk != -1:
+            session.writer.write(content)
+            file_model = self._file_metadata(path, session.blob)
+            file_model["created"] = session.started
+            file_model["last_modified"] = session.started
+            return file_model
+
+        try:
+            session.writer.write(content)
+            session.writer.close()
+            session.blob.reload()
+        finally:
+            self._invalidate_metadata(blob_name)
+        self._metadata_cache.put(("blob", blob_name), session.blob)
+        self._index_put(session.blob)
+        self._remember_generation(session.blob)
+        return self._file_metadata(path, session.blob)
+
+    def create_file(self, content, content_type, path, chunk):
+        if chunk and self.chunked_upload_mode == "resumable":
+            return self._write_to_upload_session(content, content_type, path, chunk)
+
+        blob = self._blob(path, create_if_missing=True, chunk=chunk)
+        blob_name = self._gcs_path(path)
+        if not chunk:
+            if isinstance(content, str):
+                content = content.encode(utf8_encoding)
+            content_encoding = self._content_encoding(content_type)
+            data = self._encode_for_upload(content, content_encoding)
+            if self._is_unchanged(
+                blob_name, blob, data, content_type, content_encoding
+            ):
+                # The cached metadata may be stale, so check with GCS first.
+                blob = self.bucket.get_blob(blob_name)
+                if self._is_unchanged(
+                    blob_name, blob, data, content_type, content_encoding
+                ):
+                    return self._skip_upload(path, blob, data)
+                blob = blob or self.bucket.blob(blob_name)
+        new_blob = self._live_blob(blob.name, blob)
+        try:
+            if chunk:
+                new_blob.upload_from_string(content, content_type=content_type)
+            else:
+                new_blob.content_encoding = content_encoding
+                new_blob.metadata = self._upload_metadata(
+                    blob, content, content_encoding
+                )
+                new_blob.upload_from_string(
+                    data,
+                    content_type=content_type,
+                    if_generation_match=self._expected_generation(blob_name, blob),
+                )
+            blob = new_blob
+            if chunk == -1:
+                blob = self._combine_chunks(path, content_type)
+        except api_exceptions.PreconditionFailed:
+            raise self._conflict(path)
+        finally:
+            self._invalidate_metadata(blob_name)
+        if not chunk or chunk == -1:
+            self._metadata_cache.put(("blob", blob_name), blob)
+            self._index_put(blob)
+            self._remember_generation(blob)
+        if not chunk:
+            self._content_cache.put(blob_name, blob.generation, content)
+        return self._file_metadata(path, blob)
+
+    def create_notebook(self, nb, path):
+        content = _write_notebook(nb, self.fast_notebook_io)
+        return self.create_file(content, "text/plain", path, None)
+
+    def _download(self, blob, max_size=0):
+        """Return the generation and contents of a blob, using the cache if current."""
+        cached = self._content_cache.get(blob.name)
+        if cached is not None and cached[0] == blob.generation:
+            return cached[0], cached[1]
+        # The metadata of `blob` may be stale, so read whatever is live, and
+        # take the generation and content encoding from the response.
+        live_blob = self._live_blob(blob.name)
+        try:
+            # Compressed blobs are downloaded as they are stored, and then
+            # decompressed here, rather than relying on transcoding by GCS.
+            contents = live_blob.download_as_bytes(
+                if_generation_not_match=cached[0] if cached else None,
+                raw_download=True,
+            )
+        except api_exceptions.NotModified:
+            return cached[0], cached[1]
+        except api_exceptions.NotFound:
+            self._invalidate_metadata(blob.name)
+            raise HTTPError(404, "No such file; it was deleted while being read")
+        if live_blob.generation != blob.generation:
+            self._metadata_cache.invalidate(("blob", blob.name))
+        if live_blob.content_encoding == "gzip":
+            contents = b"".join(_limit_chunks(_gunzip_chunks([contents]), max_size))
+        self._content_cache.put(blob.name, live_blob.generation, contents)
+        return live_blob.generation, contents
+
+    def file_contents(self, path: str, blob=None):
+        blob = blob or self._blob(path)
+        if not blob:
+            return None, None
+        _, contents = self._download(blob)
+        return contents, blob.content_type
+
+    def notebook_contents(self, path: str, blob=None, max_size=0):
+        blob = blob or self._blob(path)
+        if not blob:
+            return None
+        return self._notebook_contents(blob, max_size)[1]
+
+    def _notebook_contents(self, blob, max_size=0):
+        """Return the generation that was read of a notebook, and its contents."""
+        notebook = self._content_cache.get_notebook(blob.name, blob.generation)
+        if notebook is not None:
+            return blob.generation, notebook
+        generation, contents = self._download(blob, max_size)
+        notebook = _read_notebook(contents, self.fast_notebook_io)
+        self._content_cache.put_notebook(blob.name, generation, notebook)
+        return generation, notebook
+
+    def iter_file_contents(self, path: str, start=0, end=None, blob=None):
+        """Download the bytes [start, end) of a file, one range at a time."""
+        # Every range is read from the generation of `blob`, so unless the
+        # caller just fetched it, look up the current one.
+        blob = blob or self.bucket.get_blob(self._gcs_path(path))
+        if not blob:
+            raise HTTPError(404, f'No such file: "{path}"')
+        if blob.content_encoding == "gzip":
+            # Compressed offsets don't map to file offsets, so stream the
+            # whole blob and keep only the requested range.
+            decompressed = _gunzip_chunks(self._download_ranges(path, blob, 0, None))
+            yield from _slice_chunks(decompressed, start, end)
+            return
+        yield from self._download_ranges(path, blob, start, end)
+
+    def _download_ranges(self, path, blob, start, end):
+        pinned_blob = self.bucket.blob(blob.name, generation=blob.generation)
+        for range_start, range_end in self._byte_ranges(blob.size or 0, start, end):
+            try:
+                yield pinned_blob.download_as_bytes(
+                    start=range_start,
+                    end=range_end - 1,
+                    if_generation_match=blob.generation,
+                    raw_download=True,
+                )
+            except (api_exceptions.NotFound, api_exceptions.PreconditionFailed):
+                raise HTTPError(409, f'"{path}" was modified while being read')
+
+    def read_range(self, path: str, start: int, end=None):
+        """Read the bytes [start, end) of a file."""
+        return b"".join(self.iter_file_contents(path, start=start, end=end))
+
+    def delete_file(self, path):
+        try:
+            blob = self._blob(path)
+            if blob:
+                # The path corresponds to a regular file; delete it.
+                try:
+                    self._live_blob(blob.name).delete()
+                except api_exceptions.NotFound:
+                    pass
+
+            # The path (possibly) corresponds to a directory. Delete
+            # every file underneath it.
+            dir_prefix = self._dir_prefix(path)
+            self._delete_blobs(
+                self.bucket.list_blobs(
+                    prefix=dir_prefix, fields="items(name,generation),nextPageToken"
+                ),
+                description=f'under "{dir_prefix}"',
+            )
+        finally:
+            self._invalidate_metadata(self._gcs_path(path), recursive=True)
+        if self._index:
+            self._index.remove(self._gcs_path(path), recursive=True)
+        return None
+
+    def _copy_blob(self, blob, new_name):
+        """Copy a blob server-side, continuing the rewrite until it is done."""
+        new_blob = self.bucket.blob(new_name)
+        rewrite_token, _, _ = new_blob.rewrite(blob)
+        while rewrite_token is not None:
+            rewrite_token, _, _ = new_blob.rewrite(blob, token=rewrite_token)
+        return new_blob
+
+    def _copy_blobs(self, blobs, new_name_fn):
+        """Copy blobs concurrently, returning the copies and the names that failed."""
+        in_flight = threading.BoundedSemaphore(self.copy_concurrency)
+        futures = {}
+        for blob in blobs:
+            in_flight.acquire()
+            future = self._copy_executor.submit(
+                self._copy_blob, blob, new_name_fn(blob.name)
+            )
+            future.add_done_callback(lambda _: in_flight.release())
+            futures[future] = blob
+        concurrent.futures.wait(futures)
+
+        copied = []
+        failed = []
+        for future, blob in futures.items():
+            if future.exception():
+                self.log.warning("Failed to copy %s: %s", blob.name, future.exception())
+                failed.append(blob.name)
+            else:
+                copied.append(blob)
+        return copied, failed
+
+    def copy_file(self, old_path, new_path):
+        """Copy a file server-side, returning the new model or None if it is missing."""
+        blob = self._blob(old_path)
+        if not blob:
+            return None
+        new_name = self._gcs_path(new_path)
+        try:
+            new_blob = self._copy_blob(self._live_blob(blob.name), new_name)
+        finally:
+            self._invalidate_metadata(new_name)
+        self._metadata_cache.put(("blob", new_name), new_blob)
+        self._index_put(new_blob)
+        return self._file_metadata(new_path, new_blob)
+
+    def rename_file(self, old_path, new_path):
+        old_name = self._gcs_path(old_path)
+        new_name = self._gcs_path(new_path)
+        blob = self._blob(old_path)
+        if blob:
+            try:
+                new_blob = self.bucket.rename_blob(self._live_blob(blob.name), new_name)
+            finally:
+                self._invalidate_metadata(old_name)
+                self._invalidate_metadata(new_name)
+            if self._index:
+                self._index.remove(old_name)
+                self._index.put(new_blob)
+            return None
+
+        try:
+            # The path (possibly) corresponds to a directory. Only delete
+            # the originals once every file underneath it has been copied.
+            old_prefix = self._dir_prefix(old_path)
+            new_prefix = self._dir_prefix(new_path)
+            copied, failed = self._copy_blobs(
+                self.bucket.list_blobs(prefix=old_prefix),
+                lambda name: new_prefix + name[len(old_prefix) :],
+            )
+            if failed:
+                raise HTTPError(
+                    500,
+                    f"Failed to copy {len(failed)} of {len(copied) + len(failed)} "
+                    f"objects; for example: {', '.join(failed[:5])}",
+                )
+            # Files that were modified after they were copied are kept, so
+            # that the modifications are not lost.
+            self._delete_blobs(
+                copied, if_unchanged=True, description=f'under "{old_prefix}"'
+            )
+        finally:
+            self._invalidate_metadata(old_name, recursive=True)
+            self._invalidate_metadata(new_name, recursive=True)
+        return None
+
+    def mkdir(self, path):
+        blob_name = self._gcs_path(path) + "/"
+        blob = self.bucket.blob(blob_name)
+        try:
+            blob.upload_from_string("", content_type="text/plain")
+        finally:
+            self._invalidate_metadata(self._gcs_path(path))
+        self._index_put(blob)
+        return self._dir_metadata(path)
+
+    def list_dir(self, path, include_content, compact=False):
+        dir_obj = self._dir_metadata(path)
+        if not include_content:
+            return dir_obj
+
+        dir_obj["format"] = "json"
+
+        # The delimiter collapses each sub-directory (including implicit ones)
+        # into a single prefix, so only the immediate children are listed.
+        blob_name_prefix = self._dir_prefix(path)
+        files = {}
+        subdirs = {}
+        truncated = False
+        indexed = MetadataCache.MISSING
+        if self._index:
+            indexed = self._index.list_dir(self._gcs_path(path), blob_name_prefix)
+        if indexed is not MetadataCache.MISSING:
+            self._add_listing_page(files, subdirs, blob_name_prefix, *indexed)
+        else:
+            blobs = self.bucket.list_blobs(prefix=blob_name_prefix, delimiter="/")
+            for page in blobs.pages:
+                subdir_names = [
+                    subdir_prefix[len(blob_name_prefix) : -1]
+                    for subdir_prefix in page.prefixes
+                ]
+                if not self._add_listing_page(
+                    files, subdirs, blob_name_prefix, page, subdir_names
+                ):
+                    truncated = blobs.next_page_token is not None
+                    break
+        return self._finish_listing(dir_obj, files, subdirs, truncated, compact)
+
+    def list_page(self, path, page_token=None, page_size=None):
+        """Return the entries of one page of a directory, and the next page token."""
+        blob_name_prefix = self._dir_prefix(path)
+        blobs = self.bucket.list_blobs(
+            prefix=blob_name_prefix,
+            delimiter="/",
+            max_results=page_size,
+            page_token=page_token,
+        )
+        page = next(blobs.pages, None)
+        if page is None:
+            return [], None
+        subdir_names = [
+            subdir_prefix[len(blob_name_prefix) : -1] for subdir_prefix in page.prefixes
+        ]
+        entries = self._page_entries(blob_name_prefix, page, subdir_names)
+        return entries, blobs.next_page_token
+
+    def get_file(self, path, type, include_content, require_hash, compact=False):
+        blob = None
+        if not type:
+            type, blob = self._classify(path)
+            if not type:
+                return None
+        if type == "directory":
+            return self.list_dir(path, include_content, compact)
+
+        blob = blob or self._blob(path)
+        if not blob:
+            return None
+
+        file_model = self._file_metadata(path, blob)
+        if require_hash:
+            file_model["hash"] = self._content_hash(blob)
+            file_model["hash_algorithm"] = "crc32c"
+        if not include_content:
+            return file_model
+
+        max_size = self._check_inline_size(path, blob)
+        try:
+            if file_model["type"] == "notebook":
+                file_model["format"] = "json"
+                generation, file_model["content"] = self._notebook_contents(
+                    blob, max_size
+                )
+            else:
+                file_model["mimetype"], file_model["format"] = self._content_format(
+                    blob
+                )
+                encoder = _ContentEncoder(file_model["format"])
+                if (blob.size or 0) <= _READ_CHUNK_SIZE:
+                    # Files that fit in a single read are served from the cache.
+                    generation, contents = self._download(blob, max_size)
+                    encoder.update(contents)
+                else:
+                    blob = self.bucket.get_blob(blob.name)
+                    if not blob:
+                        self._invalidate_metadata(self._gcs_path(path))
+                        return None
+                    generation = blob.generation
+                    chunks = self.iter_file_contents(path, blob=blob)
+                    for chunk in _limit_chunks(chunks, max_size):
+                        encoder.update(chunk)
+                file_model["content"] = encoder.result()
+        except _ContentTooLarge:
+            raise self._too_large(path)
+        # Later saves replace the generation that was read, which the cached
+        # metadata the model was built from may be older than.
+        self._generations.put(("generation", blob.name), generation)
+        return file_model
@@ -0,0 +1,73 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+from jupyter_client.jsonutil import json_default
+from jupyter_server.auth.decorator import authorized
+from jupyter_server.base.handlers import APIHandler
+
+from tornado.iostream import StreamClosedError
+from tornado.web import HTTPError, authenticated
+
+from gcs_contents_manager.contents import CombinedContentsManager, GCSContentsManager
+from gcs_contents_manager.utils import _MAX_PAGE_SIZE
+
+
+class GCSListingHandler(APIHandler):
+    """Lists a GCS directory one page at a time, or streams it as NDJSON."""
+
+    auth_resource = "contents"
+
+    @authenticated
+    @authorized
+    async def get(self, path=""):
+        cm = self.contents_manager
+        if not isinstance(cm, (GCSContentsManager, CombinedContentsManager)):
+            raise HTTPError(400, "Paginated listings are only supported for GCS")
+        page_token = self.get_query_argument("page_token", None)
+        page_size = self.get_query_argument("page_size", None)
+        if page_size is not None:
+            if not page_size.isdigit() or not 0 < int(page_size) <= _MAX_PAGE_SIZE:
+                raise HTTPError(
+                    400, f"page_size must be between 1 and {_MAX_PAGE_SIZE}"
+                )
+            page_size = int(page_size)
+        if self.get_query_argument("format", "json") != "ndjson":
+            content, next_page_token = await cm.list_page(path, page_token, page_size)
+            self.set_header("Content-Type", "application/json")
+            self.finish(
+                json.dumps(
+                    {"content": content, "next_page_token": next_page_token},
+                    default=json_default,
+                )
+            )
+            return
+
+        # Look up the first page before starting the response, so that
+        # errors such as a missing directory can still be reported.
+        content, page_token = await cm.list_page(path, page_token, page_size)
+        self.set_header("Content-Type", "application/x-ndjson")
+        try:
+            while True:
+                for model in content:
+                    self.write(json.dumps(model, default=json_default) + "\n")
+                await self.flush()
+                if not page_token:
+                    break
+                content, page_token = await cm.list_page(path, page_token, page_size)
+        except StreamClosedError:
+            self.log.debug(f'The listing of "{path}" was closed by the client')
+            return
+        self.finish()
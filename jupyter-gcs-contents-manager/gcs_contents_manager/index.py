@@ -0,0 +1,310 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from gcs_contents_manager.caches import MetadataCache
+from gcs_contents_manager.utils import GCSObject
+
+
+class MetadataIndex:
+    """A persistent (SQLite) index of the metadata of every object under a prefix."""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS objects (
+            bucket TEXT NOT NULL,
+            name TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            size INTEGER,
+            content_type TEXT,
+            content_encoding TEXT,
+            crc32c TEXT,
+            time_created TEXT,
+            updated TEXT,
+            metadata TEXT,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            seen INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, name)
+        );
+        CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value);
+    """
+
+    _COLUMNS = (
+        "name, generation, size, content_type, content_encoding, crc32c, "
+        "time_created, updated, metadata"
+    )
+
+    # Bumped whenever the schema changes, so that older indexes are rebuilt.
+    _SCHEMA_VERSION = 2
+
+    # Largest possible code point, used as the exclusive end of a name range.
+    _MAX_CHAR = "\U0010ffff"
+
+    def __init__(
+        self,
+        db_path,
+        bucket_name,
+        prefix,
+        max_staleness,
+        refresh_interval=None,
+        log=None,
+        clock=time.time,
+    ):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.max_staleness = max_staleness
+        if refresh_interval is None:
+            refresh_interval = max_staleness / 2
+        self.refresh_interval = refresh_interval
+        self.log = log or logging.getLogger(__name__)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._uncertain = {}
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version != self._SCHEMA_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS objects")
+                self._db.execute("DROP TABLE IF EXISTS state")
+                self._db.execute(f"PRAGMA user_version = {self._SCHEMA_VERSION}")
+            self._db.executescript(self._SCHEMA)
+
+    def _state(self, key, default=None):
+        row = self._db.execute("SELECT value FROM state WHERE key = ?", (key,))
+        row = row.fetchone()
+        return row[0] if row else default
+
+    def _set_state(self, key, value):
+        self._db.execute(
+            "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    @property
+    def _refreshed_at_key(self):
+        return f"refreshed_at:{self.bucket_name}/{self.prefix}"
+
+    def _refresh_id(self):
+        # Refreshes are numbered across every index sharing the database, so
+        # that a row written while any of them is running is not dropped by it.
+        return self._state("refresh_id", 0)
+
+    def _row(self, blob, seen):
+        def timestamp(value):
+            return value.isoformat() if value else None
+
+        return (
+            self.bucket_name,
+            blob.name,
+            blob.generation,
+            blob.size,
+            blob.content_type,
+            blob.content_encoding,
+            blob.crc32c,
+            timestamp(blob.time_created),
+            timestamp(blob.updated),
+            json.dumps(blob.metadata) if blob.metadata else None,
+            seen,
+        )
+
+    @staticmethod
+    def _object(row):
+        name, generation, size, content_type, content_encoding, crc32c = row[:6]
+        return GCSObject(
+            {
+                "name": name,
+                "generation": generation,
+                "size": size,
+                "contentType": content_type,
+                "contentEncoding": content_encoding,
+                "crc32c": crc32c,
+                "timeCreated": row[6],
+                "updated": row[7],
+                "metadata": json.loads(row[8]) if row[8] else None,
+            }
+        )
+
+    def _upsert(self, blobs, seen):
+        # Only newer generations replace rows, so stale pages can't undo writes.
+        self._db.executemany(
+            f"""
+            INSERT INTO objects (bucket, {self._COLUMNS}, seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (bucket, name) DO UPDATE SET
+                generation = excluded.generation,
+                size = excluded.size,
+                content_type = excluded.content_type,
+                content_encoding = excluded.content_encoding,
+                crc32c = excluded.crc32c,
+                time_created = excluded.time_created,
+                updated = excluded.updated,
+                metadata = excluded.metadata,
+                deleted = 0,
+                seen = excluded.seen
+            WHERE excluded.generation > objects.generation
+                OR (objects.deleted = 0 AND excluded.generation = objects.generation)
+            """,
+            [self._row(blob, seen) for blob in blobs],
+        )
+
+    def refresh(self, pages):
+        """Apply a full listing; returns the number of seconds until the next one."""
+        started = self._clock()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO state (key, value) VALUES ('refresh_id', 1) "
+                "ON CONFLICT (key) DO UPDATE SET value = value + 1"
+            )
+            refresh_id = self._refresh_id()
+        for page in pages:
+            with self._lock, self._db:
+                self._upsert(page, refresh_id)
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM objects "
+                "WHERE bucket = ? AND seen < ? AND name >= ? AND name < ?",
+                (
+                    self.bucket_name,
+                    refresh_id,
+                    self.prefix,
+                    self.prefix + self._MAX_CHAR,
+                ),
+            )
+            self._set_state(self._refreshed_at_key, started)
+            self._uncertain = {
+                name: entry
+                for name, entry in self._uncertain.items()
+                if entry[0] >= started
+            }
+        duration = self._clock() - started
+        if duration > self.max_staleness:
+            self.log.warning(
+                f"Refreshing the metadata index of gs://{self.bucket_name}/"
+                f"{self.prefix} took {duration:.0f} seconds, longer than its "
+                f"maximum staleness of {self.max_staleness} seconds, so it "
+                "cannot answer lookups; consider raising the maximum staleness"
+            )
+        return max(self.refresh_interval, 2 * duration)
+
+    def put(self, blob):
+        """Record a successful write of a blob."""
+        with self._lock, self._db:
+            self._upsert([blob], self._refresh_id())
+            # Directory place-holder blobs are invalidated by the name of
+            # the directory, without the trailing slash.
+            name = blob.name.rstrip("/")
+            entry = self._uncertain.get(name, None)
+            if entry and not entry[1]:
+                del self._uncertain[name]
+
+    def remove(self, name, recursive=False):
+        """Record a delete of a blob, and of everything under it if `recursive`."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE objects SET deleted = 1, seen = ? "
+                "WHERE bucket = ? AND name = ?",
+                (self._refresh_id(), self.bucket_name, name),
+            )
+            if recursive:
+                self._db.execute(
+                    "UPDATE objects SET deleted = 1, seen = ? "
+                    "WHERE bucket = ? AND name >= ? AND name < ?",
+                    (
+                        self._refresh_id(),
+                        self.bucket_name,
+                        name + "/",
+                        name + "/" + self._MAX_CHAR,
+                    ),
+                )
+            for uncertain in list(self._uncertain):
+                if uncertain == name or (
+                    recursive and uncertain.startswith(name + "/")
+                ):
+                    del self._uncertain[uncertain]
+
+    def invalidate(self, name, recursive=False):
+        """Stop answering for a name and everything under it until the next refresh."""
+        with self._lock:
+            self._uncertain[name] = (self._clock(), recursive)
+
+    def _can_answer(self, name):
+        # Must be called with the lock held.
+        refreshed_at = self._state(self._refreshed_at_key, 0)
+        if self._clock() - refreshed_at > self.max_staleness:
+            return False
+        for uncertain, (_, recursive) in self._uncertain.items():
+            if (
+                not name
+                or uncertain == name
+                or uncertain.startswith(name + "/")
+                or (recursive and name.startswith(uncertain + "/"))
+            ):
+                return False
+        return True
+
+    def classify(self, name):
+        """Return "file", "directory" or None for a blob name, like `_classify`."""
+        with self._lock:
+            if not self._can_answer(name):
+                return MetadataCache.MISSING
+            row = self._db.execute(
+                "SELECT 1 FROM objects WHERE bucket = ? AND name = ? AND deleted = 0",
+                (self.bucket_name, name),
+            ).fetchone()
+            if row:
+                return "file"
+            row = self._db.execute(
+                "SELECT 1 FROM objects WHERE bucket = ? AND name >= ? AND name < ? "
+                "AND deleted = 0 LIMIT 1",
+                (self.bucket_name, name + "/", name + "/" + self._MAX_CHAR),
+            ).fetchone()
+            return "directory" if row else None
+
+    def list_dir(self, dir_name, dir_prefix):
+        """Return the objects and sub-directory names directly under `dir_prefix`."""
+        with self._lock:
+            if not self._can_answer(dir_name):
+                return MetadataCache.MISSING
+            objects = []
+            subdirs = []
+            lower, inclusive = dir_prefix, True
+            upper = dir_prefix + self._MAX_CHAR
+            while True:
+                rows = self._db.execute(
+                    f"SELECT {self._COLUMNS} FROM objects WHERE bucket = ? "
+                    f"AND name {'>=' if inclusive else '>'} ? AND name < ? "
+                    "AND deleted = 0 ORDER BY name LIMIT 1000",
+                    (self.bucket_name, lower, upper),
+                ).fetchall()
+                if not rows:
+                    return objects, subdirs
+                for row in rows:
+                    rest = row[0][len(dir_prefix) :]
+                    if "/" in rest:
+                        # Skip over the rest of the sub-directory in one go;
+                        # "0" is the character right after "/".
+                        subdir = rest[: rest.index("/")]
+                        subdirs.append(subdir)
+                        lower, inclusive = dir_prefix + subdir + "0", True
+                        break
+                    objects.append(self._object(row))
+                    lower, inclusive = row[0], False
+
+    def close(self):
+        with self._lock:
+            self._db.close()
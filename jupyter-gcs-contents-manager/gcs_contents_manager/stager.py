@@ -0,0 +1,278 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import posixpath
+import threading
+
+from tornado.web import HTTPError
+
+from gcs_contents_manager.utils import utf8_encoding
+
+
+class _StagedWrite:
+    """The latest staged, not yet uploaded, save of a single path."""
+
+    def __init__(self, path, sequence, data_file, record):
+        self.path = path
+        self.sequence = sequence
+        self.data_file = data_file
+        self.record = record
+        self.timer = None
+        self.upload = None
+        self.failures = 0
+        self.discarded = False
+
+
+class WriteBackStager:
+    """Acknowledges saves once they are on local disk, and uploads them later."""
+
+    _MAX_RETRY_DELAY = 300.0
+
+    def __init__(self, staging_dir, delay, upload, executor, log):
+        self.staging_dir = staging_dir
+        self.delay = delay
+        self._upload = upload
+        self._executor = executor
+        self.log = log
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._next_sequence = 0
+        os.makedirs(staging_dir, exist_ok=True)
+        self._recover()
+
+    def _key(self, path):
+        return hashlib.sha256(path.encode(utf8_encoding)).hexdigest()
+
+    def _record_file(self, path):
+        return os.path.join(self.staging_dir, self._key(path) + ".json")
+
+    @staticmethod
+    def _write_durably(file_path, data):
+        with open(file_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _sync_staging_dir(self):
+        fd = os.open(self.staging_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _remove_files(self, entry):
+        for name in (entry.data_file, self._record_file(entry.path)):
+            try:
+                os.remove(os.path.join(self.staging_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def _recover(self):
+        referenced = set()
+        for name in sorted(os.listdir(self.staging_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.staging_dir, name), "rb") as f:
+                    record = json.loads(f.read())
+            except (OSError, ValueError) as ex:
+                self.log.warning(f'Ignoring the unreadable staged save "{name}": {ex}')
+                continue
+            entry = _StagedWrite(
+                record["path"], record["sequence"], record["data"], record
+            )
+            referenced.add(entry.data_file)
+            self._pending[entry.path] = entry
+            self._next_sequence = max(self._next_sequence, entry.sequence + 1)
+        for name in os.listdir(self.staging_dir):
+            # Data files that no record refers to are left over from saves
+            # that were superseded, or interrupted before they were staged.
+            if not name.endswith(".json") and name not in referenced:
+                os.remove(os.path.join(self.staging_dir, name))
+        if self._pending:
+            self.log.info(
+                f"Uploading {len(self._pending)} saves staged by an earlier process..."
+            )
+        with self._lock:
+            for entry in self._pending.values():
+                self._schedule(entry, 0)
+
+    def stage(self, path, data, record):
+        """Durably stage the contents of a save, and schedule their upload."""
+        with self._lock:
+            sequence = self._next_sequence
+            self._next_sequence += 1
+        data_file = f"{self._key(path)}.{sequence}.data"
+        record = dict(record, path=path, sequence=sequence, data=data_file)
+        record_file = self._record_file(path)
+        tmp_file = f"{record_file}.{sequence}.tmp"
+        self._write_durably(os.path.join(self.staging_dir, data_file), data)
+        self._write_durably(tmp_file, json.dumps(record).encode(utf8_encoding))
+
+        stale_file = None
+        with self._lock:
+            entry = self._pending.get(path, None)
+            if entry is not None and entry.discarded:
+                entry = None
+            if entry is not None and entry.sequence > sequence:
+                stale_file = data_file
+                os.remove(tmp_file)
+            else:
+                os.replace(tmp_file, record_file)
+                if entry is None:
+                    entry = _StagedWrite(path, sequence, data_file, record)
+                    self._pending[path] = entry
+                else:
+                    stale_file = entry.data_file
+                    entry.sequence = sequence
+                    entry.data_file = data_file
+                    entry.record = record
+                if entry.timer is None and entry.upload is None:
+                    self._schedule(entry, self.delay)
+        self._sync_staging_dir()
+        if stale_file is not None:
+            # This is only removed once the record replacing it is durable.
+            os.remove(os.path.join(self.staging_dir, stale_file))
+        return record
+
+    def record(self, path):
+        """Return the record of the staged save of a path, or None."""
+        with self._lock:
+            entry = self._pending.get(path, None)
+            return entry.record if entry is not None else None
+
+    def get(self, path):
+        """Return the (record, data) of the staged save of a path, or None."""
+        while True:
+            with self._lock:
+                entry = self._pending.get(path, None)
+                if entry is None:
+                    return None
+                record = entry.record
+                data_file = entry.data_file
+            try:
+                with open(os.path.join(self.staging_dir, data_file), "rb") as f:
+                    return record, f.read()
+            except FileNotFoundError:
+                # Superseded by a newer save, or uploaded, while being read.
+                continue
+
+    def records_in(self, dir_path):
+        """Return the records of the staged saves of the files in a directory."""
+        with self._lock:
+            return [
+                entry.record
+                for path, entry in self._pending.items()
+                if posixpath.dirname(path) == dir_path
+            ]
+
+    def _entries_under(self, prefix):
+        with self._lock:
+            return [
+                entry
+                for path, entry in self._pending.items()
+                if not prefix or path == prefix or path.startswith(prefix + "/")
+            ]
+
+    def _schedule(self, entry, delay):
+        # Must be called with the lock held.
+        entry.timer = threading.Timer(delay, self._start_upload, [entry])
+        entry.timer.daemon = True
+        entry.timer.start()
+
+    def _start_upload(self, entry):
+        with self._lock:
+            if entry.discarded or entry.upload is not None:
+                return None
+            if entry.timer is not None:
+                entry.timer.cancel()
+                entry.timer = None
+            entry.upload = self._executor.submit(self._upload_entry, entry)
+            return entry.upload
+
+    def _upload_entry(self, entry):
+        """Upload the latest staged version of a path, returning whether that worked."""
+        with self._lock:
+            sequence = entry.sequence
+            record = entry.record
+            with open(os.path.join(self.staging_dir, entry.data_file), "rb") as f:
+                data = f.read()
+        try:
+            self._upload(entry.path, data, record)
+        except Exception as ex:
+            with self._lock:
+                entry.upload = None
+                if entry.discarded:
+                    return False
+                entry.failures += 1
+                retry_delay = min(
+                    max(self.delay, 1.0) * 2**entry.failures, self._MAX_RETRY_DELAY
+                )
+                self.log.error(
+                    f'Failed to upload the staged save of "{entry.path}", '
+                    f"retrying in {retry_delay:.0f} seconds: {ex}"
+                )
+                if entry.timer is None:
+                    self._schedule(entry, retry_delay)
+            return False
+        with self._lock:
+            entry.upload = None
+            entry.failures = 0
+            if entry.discarded:
+                return True
+            if entry.sequence == sequence:
+                self._remove_files(entry)
+                del self._pending[entry.path]
+            elif entry.timer is None:
+                # The path was saved again while it was being uploaded.
+                self._schedule(entry, self.delay)
+        return True
+
+    def flush(self, prefix):
+        """Upload the staged saves of a path, or of everything underneath it, now."""
+        for entry in self._entries_under(prefix):
+            while True:
+                with self._lock:
+                    if self._pending.get(entry.path, None) is not entry:
+                        break
+                    upload = entry.upload
+                if upload is None:
+                    upload = self._start_upload(entry)
+                if upload is None and entry.discarded:
+                    break
+                if upload is not None and not upload.result():
+                    raise HTTPError(
+                        500, f'Failed to upload the staged save of "{entry.path}"'
+                    )
+
+    def discard(self, prefix):
+        """Drop the staged saves of a path, or of everything underneath it."""
+        for entry in self._entries_under(prefix):
+            with self._lock:
+                entry.discarded = True
+                if entry.timer is not None:
+                    entry.timer.cancel()
+                    entry.timer = None
+                upload = entry.upload
+            if upload is not None:
+                # Let an upload that is already running finish first, so
+                # that it cannot land after whatever replaces it.
+                upload.result()
+            with self._lock:
+                if self._pending.get(entry.path, None) is entry:
+                    del self._pending[entry.path]
+                    self._remove_files(entry)
@@ -0,0 +1,264 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import codecs
+import datetime
+import json
+import os
+import zlib
+
+import nbformat
+
+import google_crc32c
+
+try:
+    import orjson
+except ImportError:
+    # The fast notebook I/O path falls back to the standard json module.
+    orjson = None
+
+
+utf8_encoding = "utf-8"
+
+_GCS_API_ENDPOINT = "https://storage.googleapis.com"
+_GCS_SCOPES = ["https://www.googleapis.com/auth/devstorage.read_write"]
+
+# The maximum number of source blobs accepted by a single GCS compose call.
+_MAX_COMPOSE_SOURCES = 32
+
+# The maximum number of requests to send in a single GCS batch request.
+_MAX_BATCH_SIZE = 100
+
+# The maximum number of results returned by a single GCS listing request.
+_MAX_PAGE_SIZE = 1000
+
+# The size of the byte ranges in which file contents are downloaded.
+_READ_CHUNK_SIZE = 8 * 1024 * 1024
+
+# The number of blobs fetched when deciding whether a path is a file or a directory.
+_CLASSIFY_MAX_RESULTS = 8
+
+# Custom metadata keys recording the size and CRC32C of the contents of a
+# gzip-compressed blob, as GCS only reports those of the compressed data.
+_DECODED_SIZE_KEY = "decoded-size"
+_DECODED_CRC32C_KEY = "decoded-crc32c"
+
+
+def normalize_path(path):
+    path = path or ""
+    return path.strip("/")
+
+
+def _mount_path(path_prefix, path):
+    """Return the path of a file within a mount, as seen from above the mount."""
+    path = normalize_path(path)
+    return f"{path_prefix}/{path}" if path else path_prefix
+
+
+def _storage_api_endpoint(api_endpoint):
+    """Return the GCS JSON API endpoint to use, honoring STORAGE_EMULATOR_HOST."""
+    return (
+        api_endpoint
+        or os.environ.get("STORAGE_EMULATOR_HOST", None)
+        or _GCS_API_ENDPOINT
+    ).rstrip("/")
+
+
+def _write_notebook(nb, fast=False):
+    if fast and nb.get("nbformat", None) == nbformat.v4.nbformat:
+        return _fast_write_notebook(nb)
+    if type(nb) == dict:
+        nb = nbformat.from_dict(nb)
+    return nbformat.writes(nb)
+
+
+def _read_notebook(content_bytes, fast=False):
+    if fast:
+        nb = orjson.loads(content_bytes) if orjson else json.loads(content_bytes)
+        if nb.get("nbformat", None) == nbformat.v4.nbformat:
+            # Converting to a NotebookNode does not validate the notebook.
+            return nbformat.from_dict(_rejoin_lines(nb))
+    return nbformat.reads(content_bytes.decode(utf8_encoding), as_version=4)
+
+
+def _fast_write_notebook(nb):
+    """Serialize a v4 notebook without validating or deep-copying it."""
+    # Strip the same transient values as nbformat does, copying only the
+    # parts of the notebook that have to change.
+    nb = dict(nb)
+    nb["metadata"] = {
+        key: value
+        for key, value in nb.get("metadata", {}).items()
+        if key not in ("orig_nbformat", "orig_nbformat_minor", "signature")
+    }
+    nb["cells"] = [
+        (
+            dict(
+                cell,
+                metadata={k: v for k, v in cell["metadata"].items() if k != "trusted"},
+            )
+            if "trusted" in cell.get("metadata", {})
+            else cell
+        )
+        for cell in nb.get("cells", [])
+    ]
+    # orjson cannot produce the same layout as nbformat, so it is only used
+    # for reads, to keep the stored bytes independent of whether it is installed.
+    content = json.dumps(
+        nb, indent=1, sort_keys=True, separators=(",", ": "), ensure_ascii=False
+    )
+    return content + "\n"
+
+
+def _is_json_mimetype(mimetype):
+    return mimetype == "application/json" or (
+        mimetype.startswith("application/") and mimetype.endswith("+json")
+    )
+
+
+def _rejoin_mimebundle(bundle):
+    for mimetype, value in bundle.items():
+        if isinstance(value, list) and not _is_json_mimetype(mimetype):
+            bundle[mimetype] = "".join(value)
+
+
+def _rejoin_lines(nb):
+    """Join multi-line strings stored as lists of lines, as `nbformat.reads` does."""
+    for cell in nb.get("cells", []):
+        if isinstance(cell.get("source", None), list):
+            cell["source"] = "".join(cell["source"])
+        for attachment in cell.get("attachments", {}).values():
+            _rejoin_mimebundle(attachment)
+        if cell.get("cell_type", None) != "code":
+            continue
+        for output in cell.get("outputs", []):
+            output_type = output.get("output_type", "")
+            if output_type in ("execute_result", "display_data"):
+                _rejoin_mimebundle(output.get("data", {}))
+            elif isinstance(output.get("text", None), list):
+                output["text"] = "".join(output["text"])
+    return nb
+
+
+def _gzip(content):
+    """Gzip-compress the given bytes deterministically (with no header timestamp)."""
+    compressor = zlib.compressobj(wbits=31)
+    view = memoryview(content)
+    compressed = [
+        compressor.compress(view[i : i + _READ_CHUNK_SIZE])
+        for i in range(0, len(view), _READ_CHUNK_SIZE)
+    ]
+    compressed.append(compressor.flush())
+    return b"".join(compressed)
+
+
+def _crc32c(data):
+    """Return the base64-encoded CRC32C of the given bytes, as reported by GCS."""
+    return base64.b64encode(google_crc32c.Checksum(data).digest()).decode("ascii")
+
+
+class _ContentTooLarge(Exception):
+    """Raised when the decoded contents of a file exceed the allowed size."""
+
+
+def _limit_chunks(chunks, max_size):
+    """Pass through a stream of chunks, raising `_ContentTooLarge` past `max_size`."""
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if max_size and size > max_size:
+            raise _ContentTooLarge()
+        yield chunk
+
+
+def _gunzip_chunks(chunks):
+    """Decompress a stream of gzip-compressed chunks."""
+    decompressor = zlib.decompressobj(wbits=31)
+    for chunk in chunks:
+        while chunk:
+            decompressed = decompressor.decompress(chunk, _READ_CHUNK_SIZE)
+            if decompressed:
+                yield decompressed
+            chunk = decompressor.unconsumed_tail
+    remaining = decompressor.flush()
+    if remaining:
+        yield remaining
+
+
+def _slice_chunks(chunks, start, end):
+    """Yield the bytes [start, end) of the stream formed by the given chunks."""
+    offset = 0
+    for chunk in chunks:
+        chunk_start = offset
+        offset += len(chunk)
+        if offset <= start:
+            continue
+        if end is not None and chunk_start >= end:
+            return
+        yield chunk[
+            max(start - chunk_start, 0) : None if end is None else end - chunk_start
+        ]
+
+
+class _ContentEncoder:
+    """Encodes file contents for a model, one chunk at a time."""
+
+    def __init__(self, format):
+        self.format = format
+        self._parts = []
+        if format == "text":
+            self._decoder = codecs.getincrementaldecoder(utf8_encoding)()
+        else:
+            # Bytes left over from the previous chunk, as base64 encodes
+            # groups of 3 bytes at a time.
+            self._remainder = b""
+
+    def update(self, chunk):
+        if self.format == "text":
+            self._parts.append(self._decoder.decode(chunk))
+            return
+        chunk = self._remainder + chunk
+        split = len(chunk) - len(chunk) % 3
+        self._parts.append(base64.b64encode(chunk[:split]).decode("ascii"))
+        self._remainder = chunk[split:]
+
+    def result(self):
+        if self.format == "text":
+            self._parts.append(self._decoder.decode(b"", final=True))
+        else:
+            self._parts.append(base64.b64encode(self._remainder).decode("ascii"))
+        return "".join(self._parts)
+
+
+class GCSObject:
+    """Metadata of a GCS object, as returned by the GCS JSON API."""
+
+    def __init__(self, resource):
+        self.name = resource["name"]
+        self.generation = int(resource.get("generation", 0))
+        self.size = int(resource.get("size", 0))
+        self.content_type = resource.get("contentType", None)
+        self.content_encoding = resource.get("contentEncoding", None)
+        self.crc32c = resource.get("crc32c", None)
+        self.md5_hash = resource.get("md5Hash", None)
+        self.metadata = resource.get("metadata", None)
+        self.updated = _parse_timestamp(resource.get("updated", None))
+        self.time_created = _parse_timestamp(resource.get("timeCreated", None))
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
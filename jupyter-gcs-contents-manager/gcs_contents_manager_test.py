@@ -12,13 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import base64
+import concurrent.futures
+import google.auth
+import google.auth.credentials
 import json
+import logging
+import nbformat
+import os
+import prometheus_client
 import pytest
+import threading
+import time
+import traitlets.config
 import uuid
 
 from jupyter_server.utils import url_path_join
+from tornado.web import HTTPError
+from traitlets import TraitError
 
-from gcs_contents_manager import GCSBasedFileManager
+import gcs_contents_manager
+from gcs_contents_manager import async_client, files, utils
+from gcs_contents_manager import (
+    AsyncGCSBasedFileManager,
+    CombinedContentsManager,
+    ContentCache,
+    GCSBasedFileManager,
+    GCSContentsManager,
+    InstrumentedExecutor,
+)
+
+
+def set_read_chunk_size(monkeypatch, size):
+    """Make files be read (and compressed) in chunks of `size` bytes."""
+    for module in [utils, files, async_client]:
+        monkeypatch.setattr(module, "_READ_CHUNK_SIZE", size)
 
 
 @pytest.fixture
@@ -119,6 +148,47 @@ async def test_list_top_level(jp_fetch):
     assert "Local Disk" in child_names
 
 
+async def test_listing_handler(jp_fetch):
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        await jp_fetch(
+            "api",
+            "contents",
+            "GCS",
+            name,
+            method="PUT",
+            body=json.dumps({"type": "file", "format": "text", "content": name}),
+        )
+
+    response = await jp_fetch(
+        "api", "gcs", "listing", "GCS", params={"page_size": "2"}, method="GET"
+    )
+    page = json.loads(response.body.decode())
+    assert [child["path"] for child in page["content"]] == ["GCS/a.txt", "GCS/b.txt"]
+    response = await jp_fetch(
+        "api",
+        "gcs",
+        "listing",
+        "GCS",
+        params={"page_size": "2", "page_token": page["next_page_token"]},
+        method="GET",
+    )
+    page = json.loads(response.body.decode())
+    assert [child["path"] for child in page["content"]] == ["GCS/c.txt"]
+    assert page["next_page_token"] is None
+
+    response = await jp_fetch(
+        "api",
+        "gcs",
+        "listing",
+        "GCS",
+        params={"page_size": "1", "format": "ndjson"},
+        method="GET",
+    )
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    lines = response.body.decode().splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["a.txt", "b.txt", "c.txt"]
+
+
 @pytest.mark.parametrize("top_level_path", ["GCS", "Local Disk"])
 async def test_file_handlers(jp_fetch, top_level_path):
     response = await jp_fetch(
@@ -452,3 +522,1251 @@ async def test_file_handlers(jp_fetch, top_level_path):
     assert "untitled" in remaining_files
     assert "untitled.txt" in remaining_files
     assert "Untitled Folder" not in remaining_files
+
+
+def test_metadata_cache_write_through(gcs_file_manager):
+    path = "cached-dir/cached-file.txt"
+    assert not gcs_file_manager.file_exists(path)
+    assert not gcs_file_manager.dir_exists("cached-dir")
+
+    # Writes must be visible immediately, even though the negative
+    # lookups above were cached.
+    gcs_file_manager.create_file("contents", "text/plain", path, None)
+    assert gcs_file_manager.file_exists(path)
+    assert gcs_file_manager.dir_exists("cached-dir")
+
+    gcs_file_manager.delete_file("cached-dir")
+    assert not gcs_file_manager.file_exists(path)
+    assert not gcs_file_manager.dir_exists("cached-dir")
+
+
+def test_list_dir_immediate_children(gcs_file_manager):
+    # Neither of the nested directories have place-holder blobs, so they
+    # only exist implicitly.
+    gcs_file_manager.create_file("", "text/plain", "parent/child/nested.txt", None)
+    gcs_file_manager.create_file("", "text/plain", "parent/top-level.txt", None)
+    gcs_file_manager.create_file("", "text/plain", "parent-sibling.txt", None)
+
+    listed = gcs_file_manager.list_dir("parent", True)
+    children = {child["name"]: child["type"] for child in listed["content"]}
+    assert children == {"child": "directory", "top-level.txt": "file"}
+
+
+def test_classify_with_many_siblings(gcs_file_manager):
+    # Siblings whose names extend the directory name sort between the
+    # directory name and its contents.
+    for i in range(10):
+        gcs_file_manager.create_file("", "text/plain", f"probe-{i}.txt", None)
+    gcs_file_manager.create_file("", "text/plain", "probe/nested.txt", None)
+
+    assert gcs_file_manager.dir_exists("probe")
+    assert not gcs_file_manager.file_exists("probe")
+    assert gcs_file_manager.file_exists("probe-1.txt")
+    assert not gcs_file_manager.dir_exists("probe-1.txt")
+    assert gcs_file_manager.get_file("probe", None, False, False)["type"] == "directory"
+    assert gcs_file_manager.get_file("missing", None, False, False) is None
+
+
+def test_chunked_upload_beyond_compose_limit(gcs_file_manager):
+    # A single compose call accepts at most 32 sources.
+    chunks = list(range(1, 40)) + [-1]
+    for chunk in chunks:
+        gcs_file_manager.create_file(
+            f"chunk#{chunk},", "text/plain", "many-chunks.txt", chunk
+        )
+
+    uploaded = gcs_file_manager.get_file("many-chunks.txt", "file", True, False)
+    assert uploaded["content"] == "".join(f"chunk#{chunk}," for chunk in chunks)
+    # The chunk and intermediate blobs are deleted in the background.
+    gcs_file_manager._cleanup_executor.shutdown(wait=True)
+    chunks_dir = gcs_file_manager._chunks_dir("many-chunks.txt")
+    assert list(gcs_file_manager.bucket.list_blobs(prefix=chunks_dir + "/")) == []
+
+
+def test_resumable_chunked_upload(gcs_project, gcs_bucket_name, gcs_notebook_path):
+    file_manager = GCSBasedFileManager(
+        gcs_project,
+        gcs_bucket_name,
+        gcs_notebook_path,
+        chunked_upload_mode="resumable",
+    )
+    chunks = [1, 2, 3, -1]
+    for chunk in chunks:
+        file_manager.create_file(
+            f"chunk#{chunk},", "text/plain", "resumable-upload.txt", chunk
+        )
+
+    uploaded = file_manager.get_file("resumable-upload.txt", "file", True, False)
+    assert uploaded["content"] == "".join(f"chunk#{chunk}," for chunk in chunks)
+    # No intermediate chunk blobs should have been written.
+    listed = file_manager.list_dir("", True)
+    assert [child["name"] for child in listed["content"]] == ["resumable-upload.txt"]
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_notebook_serialization_round_trip(fast):
+    cell = nbformat.v4.new_code_cell(source="a = 1\nb = 2", execution_count=1)
+    cell.metadata["trusted"] = True
+    cell.outputs = [
+        nbformat.v4.new_output("stream", name="stdout", text="one\ntwo\n"),
+        nbformat.v4.new_output(
+            "display_data", data={"text/plain": "x\ny", "application/json": [1, 2]}
+        ),
+    ]
+    nb = json.loads(json.dumps(nbformat.v4.new_notebook(cells=[cell])))
+    nb["metadata"]["signature"] = "transient"
+
+    content = utils._write_notebook(nb, fast).encode()
+    if fast:
+        # Laid out as by nbformat, whether or not orjson is installed.
+        assert content.startswith(b'{\n "cells": [\n  {\n')
+        assert content.endswith(b'"nbformat_minor": 5\n}\n')
+    read_nb = utils._read_notebook(content, fast)
+    # Fast-path notebooks can be read by nbformat, and vice versa.
+    assert read_nb == utils._read_notebook(content, not fast)
+    # Notebooks are read as NotebookNodes (e.g. for signing them).
+    assert read_nb.nbformat == 4 and read_nb.cells[0].cell_type == "code"
+    assert read_nb["cells"][0]["source"] == "a = 1\nb = 2"
+    assert read_nb["cells"][0]["outputs"][0]["text"] == "one\ntwo\n"
+    assert read_nb["cells"][0]["outputs"][1]["data"]["text/plain"] == "x\ny"
+    assert read_nb["cells"][0]["outputs"][1]["data"]["application/json"] == [1, 2]
+    assert "trusted" not in read_nb["cells"][0]["metadata"]
+    assert "signature" not in read_nb["metadata"]
+    # The notebook being saved is left unmodified.
+    assert nb["metadata"]["signature"] == "transient"
+    assert nb["cells"][0]["metadata"]["trusted"]
+
+
+def test_ranged_reads(fake_gcs_file_manager, monkeypatch):
+    # Read in small ranges, so that multi-byte characters and base64 groups
+    # are split across ranges.
+    set_read_chunk_size(monkeypatch, 5)
+    file_manager = fake_gcs_file_manager
+    text = "h\u00e9llo w\u00f6rld \u2713 " * 4
+    file_manager.create_file(text, "text/plain", "text.txt", None)
+    binary = bytes(range(256))
+    file_manager.create_file(binary, "application/octet-stream", "binary.bin", None)
+
+    assert file_manager.get_file("text.txt", None, True, False)["content"] == text
+    binary_file = file_manager.get_file("binary.bin", None, True, False)
+    assert binary_file["format"] == "base64"
+    assert base64.b64decode(binary_file["content"]) == binary
+    assert file_manager.read_range("binary.bin", 10, 42) == binary[10:42]
+
+    file_manager.max_inline_content_size = 100
+    with pytest.raises(HTTPError) as e:
+        file_manager.get_file("binary.bin", None, True, False)
+    assert e.value.status_code == 413
+
+
+def test_small_files_are_cached(fake_gcs_file_manager):
+    file_manager = fake_gcs_file_manager
+    file_manager.create_file(b"\x00\x01", "application/octet-stream", "a.bin", None)
+    file_manager._content_cache.invalidate("notebooks/a.bin")
+
+    file_manager.get_file("a.bin", None, True, False)
+    generation, contents, _ = file_manager._content_cache.get("notebooks/a.bin")
+    assert contents == b"\x00\x01"
+    assert generation == file_manager._blob("a.bin").generation
+
+
+def test_content_cache_notebooks():
+    nb = nbformat.v4.new_notebook(
+        cells=[nbformat.v4.new_code_cell(f"x = {i}") for i in range(500)]
+    )
+    content = nbformat.writes(nb).encode()
+    cache = ContentCache(10 * len(content))
+    cache.put("nb.ipynb", 1, content)
+    cache.put_notebook("nb.ipynb", 1, nb)
+
+    # Every hit is an independent copy of the cached notebook.
+    first = cache.get_notebook("nb.ipynb", 1)
+    first.cells.clear()
+    assert cache.get_notebook("nb.ipynb", 1) == nb
+    assert cache.get_notebook("nb.ipynb", 2) is None
+
+
+def test_save_conflict(fake_gcs_file_manager, fake_gcs_endpoint):
+    file_manager = fake_gcs_file_manager
+    saved = file_manager.create_file("v1", "text/plain", "shared.txt", None)
+    # The saved model is built from the upload, without reading it back.
+    assert saved["last_modified"] is not None
+    other_writer = GCSBasedFileManager(
+        "test-project", "test-bucket", "notebooks", api_endpoint=fake_gcs_endpoint
+    )
+    other_writer.create_file("v2", "text/plain", "shared.txt", None)
+
+    with pytest.raises(HTTPError) as e:
+        file_manager.create_file("v3", "text/plain", "shared.txt", None)
+    assert e.value.status_code == 409
+    # Saving again overwrites the other writer's changes.
+    file_manager.create_file("v3", "text/plain", "shared.txt", None)
+    assert file_manager.get_file("shared.txt", None, True, False)["content"] == "v3"
+
+
+def test_unchanged_save_skips_upload(fake_gcs_file_manager, fake_gcs_endpoint):
+    file_manager = fake_gcs_file_manager
+    first = file_manager.create_file("same", "text/plain", "idle.txt", None)
+    second = file_manager.create_file("same", "text/plain", "idle.txt", None)
+    # No new generation was written, so the modification time is unchanged.
+    assert second["last_modified"] == first["last_modified"]
+
+    # A change made elsewhere is noticed even while the metadata is cached.
+    other_writer = GCSBasedFileManager(
+        "test-project", "test-bucket", "notebooks", api_endpoint=fake_gcs_endpoint
+    )
+    other_writer.create_file("other", "text/plain", "idle.txt", None)
+    with pytest.raises(HTTPError) as e:
+        file_manager.create_file("same", "text/plain", "idle.txt", None)
+    assert e.value.status_code == 409
+
+
+def test_read_with_stale_metadata(fake_gcs_file_manager, fake_gcs_endpoint):
+    file_manager = fake_gcs_file_manager
+    file_manager.create_file("v1", "text/plain", "g.txt", None)
+    file_manager._content_cache.invalidate("notebooks/g.txt")
+    assert file_manager.file_exists("g.txt")
+    other_writer = GCSBasedFileManager(
+        "test-project", "test-bucket", "notebooks", api_endpoint=fake_gcs_endpoint
+    )
+    other_writer.create_file("v2", "text/plain", "g.txt", None)
+
+    # The cached metadata is of the old generation, but the new one is read.
+    assert file_manager.get_file("g.txt", None, True, False)["content"] == "v2"
+    # Saving replaces the generation that was read, without a conflict.
+    file_manager.create_file("v3", "text/plain", "g.txt", None)
+
+    other_writer.delete_file("g.txt")
+    file_manager._content_cache.invalidate("notebooks/g.txt")
+    with pytest.raises(HTTPError) as e:
+        file_manager.get_file("g.txt", "file", True, False)
+    assert e.value.status_code == 404
+
+
+@pytest.fixture
+def async_gcs_file_manager(fake_gcs_endpoint):
+    pytest.importorskip("aiohttp")
+    return AsyncGCSBasedFileManager(
+        "test-project",
+        "test-bucket",
+        "notebooks",
+        api_endpoint=fake_gcs_endpoint,
+    )
+
+
+@pytest.fixture
+def fake_gcs_file_manager(fake_gcs_endpoint):
+    return GCSBasedFileManager(
+        "test-project",
+        "test-bucket",
+        "notebooks",
+        api_endpoint=fake_gcs_endpoint,
+    )
+
+
+async def test_async_file_manager(async_gcs_file_manager):
+    file_manager = async_gcs_file_manager
+    root = await file_manager.get_file("", None, True, False)
+    assert root["type"] == "directory"
+    assert root["content"] == []
+
+    await file_manager.mkdir("dir")
+    assert await file_manager.dir_exists("dir")
+    await file_manager.create_file("hello", "text/plain", "dir/hello.txt", None)
+    await file_manager.create_notebook({"cells": []}, "dir/nested/nb.ipynb")
+    assert await file_manager.file_exists("dir/hello.txt")
+    assert await file_manager.dir_exists("dir/nested")
+
+    listed = await file_manager.get_file("dir", None, True, False)
+    children = {child["name"]: child["type"] for child in listed["content"]}
+    assert children == {"hello.txt": "file", "nested": "directory"}
+
+    text_file = await file_manager.get_file("dir/hello.txt", None, True, True)
+    assert text_file["content"] == "hello"
+    assert text_file["hash_algorithm"] == "crc32c"
+    notebook = await file_manager.get_file("dir/nested/nb.ipynb", None, True, False)
+    assert notebook["type"] == "notebook"
+    assert notebook["content"]["cells"] == []
+
+    await file_manager.rename_file("dir", "renamed")
+    assert not await file_manager.dir_exists("dir")
+    renamed = await file_manager.get_file("renamed/hello.txt", None, True, False)
+    assert renamed["content"] == "hello"
+
+    await file_manager.delete_file("renamed")
+    assert not await file_manager.dir_exists("renamed")
+    root = await file_manager.get_file("", None, True, False)
+    assert root["content"] == []
+    await file_manager.close()
+
+
+async def test_async_chunked_upload(async_gcs_file_manager):
+    chunks = list(range(1, 40)) + [-1]
+    for chunk in chunks:
+        await async_gcs_file_manager.create_file(
+            f"chunk#{chunk},", "text/plain", "chunked.txt", chunk
+        )
+
+    uploaded = await async_gcs_file_manager.get_file("chunked.txt", None, True, False)
+    assert uploaded["content"] == "".join(f"chunk#{chunk}," for chunk in chunks)
+    await async_gcs_file_manager.close()
+
+
+async def test_async_ranged_reads(async_gcs_file_manager, monkeypatch):
+    # Read in small ranges, so that multi-byte characters and base64 groups
+    # are split across ranges.
+    set_read_chunk_size(monkeypatch, 5)
+    file_manager = async_gcs_file_manager
+    text = "h\u00e9llo w\u00f6rld \u2713 " * 4
+    await file_manager.create_file(text, "text/plain", "text.txt", None)
+    binary = bytes(range(256))
+    await file_manager.create_file(
+        binary, "application/octet-stream", "binary.bin", None
+    )
+
+    text_file = await file_manager.get_file("text.txt", None, True, False)
+    assert text_file["content"] == text
+    binary_file = await file_manager.get_file("binary.bin", None, True, False)
+    assert binary_file["format"] == "base64"
+    assert base64.b64decode(binary_file["content"]) == binary
+    assert await file_manager.read_range("binary.bin", 10, 42) == binary[10:42]
+
+    file_manager.max_inline_content_size = 100
+    with pytest.raises(HTTPError) as e:
+        await file_manager.get_file("binary.bin", None, True, False)
+    assert e.value.status_code == 413
+    await file_manager.close()
+
+
+async def test_async_content_cache(async_gcs_file_manager, fake_gcs_endpoint):
+    file_manager = async_gcs_file_manager
+    await file_manager.create_notebook({"cells": []}, "cached.ipynb")
+    first = await file_manager.get_file("cached.ipynb", None, True, False)
+    # Modifying a returned notebook must not modify the cached one.
+    first["content"]["cells"].append({"cell_type": "raw", "source": ""})
+    second = await file_manager.get_file("cached.ipynb", None, True, False)
+    assert second["content"]["cells"] == []
+
+    # A write from elsewhere changes the generation, so the cache is bypassed.
+    other_writer = AsyncGCSBasedFileManager(
+        "test-project",
+        "test-bucket",
+        "notebooks",
+        api_endpoint=fake_gcs_endpoint,
+    )
+    await other_writer.create_notebook(
+        nbformat.v4.new_notebook(cells=[nbformat.v4.new_raw_cell("new")]),
+        "cached.ipynb",
+    )
+    await other_writer.close()
+    file_manager._metadata_cache.invalidate(("blob", "notebooks/cached.ipynb"))
+    third = await file_manager.get_file("cached.ipynb", None, True, False)
+    assert third["content"]["cells"][0]["source"] == "new"
+    await file_manager.close()
+
+
+async def test_async_read_with_stale_metadata(
+    async_gcs_file_manager, fake_gcs_endpoint
+):
+    file_manager = async_gcs_file_manager
+    await file_manager.create_file("v1", "text/plain", "g.txt", None)
+    file_manager._content_cache.invalidate("notebooks/g.txt")
+    assert await file_manager.file_exists("g.txt")
+    other_writer = AsyncGCSBasedFileManager(
+        "test-project", "test-bucket", "notebooks", api_endpoint=fake_gcs_endpoint
+    )
+    await other_writer.create_file("v2", "text/plain", "g.txt", None)
+
+    # The cached metadata is of the old generation, but the new one is read.
+    read = await file_manager.get_file("g.txt", None, True, False)
+    assert read["content"] == "v2"
+    # An unchanged file is not transferred again.
+    read = await file_manager.get_file("g.txt", None, True, False)
+    assert read["content"] == "v2"
+    # Saving replaces the generation that was read, without a conflict.
+    await file_manager.create_file("v3", "text/plain", "g.txt", None)
+
+    await other_writer.delete_file("g.txt")
+    await other_writer.close()
+    file_manager._content_cache.invalidate("notebooks/g.txt")
+    with pytest.raises(HTTPError) as e:
+        await file_manager.get_file("g.txt", "file", True, False)
+    assert e.value.status_code == 404
+    await file_manager.close()
+
+
+async def test_async_save_conflict(async_gcs_file_manager, fake_gcs_endpoint):
+    file_manager = async_gcs_file_manager
+    await file_manager.create_file("v1", "text/plain", "shared.txt", None)
+    other_writer = AsyncGCSBasedFileManager(
+        "test-project", "test-bucket", "notebooks", api_endpoint=fake_gcs_endpoint
+    )
+    await other_writer.create_file("v2", "text/plain", "shared.txt", None)
+    await other_writer.close()
+
+    with pytest.raises(HTTPError) as e:
+        await file_manager.create_file("v3", "text/plain", "shared.txt", None)
+    assert e.value.status_code == 409
+    # Saving again overwrites the other writer's changes.
+    saved = await file_manager.create_file("v3", "text/plain", "shared.txt", None)
+    assert saved["last_modified"] is not None
+    read = await file_manager.get_file("shared.txt", None, True, False)
+    assert read["content"] == "v3"
+    await file_manager.close()
+
+
+async def test_async_unchanged_save_skips_upload(
+    async_gcs_file_manager, fake_gcs_endpoint
+):
+    file_manager = async_gcs_file_manager
+    first = await file_manager.create_file("same", "text/plain", "idle.txt", None)
+    second = await file_manager.create_file("same", "text/plain", "idle.txt", None)
+    # No new generation was written, so the modification time is unchanged.
+    assert second["last_modified"] == first["last_modified"]
+    third = await file_manager.create_file("changed", "text/plain", "idle.txt", None)
+    assert third["last_modified"] >= first["last_modified"]
+    read = await file_manager.get_file("idle.txt", None, True, False)
+    assert read["content"] == "changed"
+
+    # A change made elsewhere is noticed even while the metadata is cached.
+    other_writer = AsyncGCSBasedFileManager(
+        "test-project", "test-bucket", "notebooks", api_endpoint=fake_gcs_endpoint
+    )
+    await other_writer.create_file("other", "text/plain", "idle.txt", None)
+    await other_writer.close()
+    with pytest.raises(HTTPError) as e:
+        await file_manager.create_file("changed", "text/plain", "idle.txt", None)
+    assert e.value.status_code == 409
+    await file_manager.close()
+
+
+async def test_async_gzip_uploads(async_gcs_file_manager, monkeypatch):
+    set_read_chunk_size(monkeypatch, 5)
+    file_manager = async_gcs_file_manager
+    # Make every read go to GCS.
+    file_manager._content_cache.max_bytes = 0
+    text = "a line that compresses well\n" * 100
+    await file_manager.create_file(text, "text/plain", "legacy.txt", None)
+
+    file_manager.gzip_uploads = True
+    await file_manager.create_file(text, "text/plain", "compressed.txt", None)
+    compressed = await file_manager._object("compressed.txt")
+    assert compressed.content_encoding == "gzip"
+    assert compressed.size < len(text)
+
+    # Both compressed and uncompressed objects are read transparently.
+    for path in ["legacy.txt", "compressed.txt"]:
+        model = await file_manager.get_file(path, None, True, False)
+        assert model["content"] == text
+    assert await file_manager.read_range("compressed.txt", 3, 30) == (
+        text.encode()[3:30]
+    )
+
+    # The hash and the size cap cover the decoded contents.
+    model = await file_manager.get_file("compressed.txt", None, False, True)
+    assert model["hash"] == utils._crc32c(text.encode())
+    # A blob compressed elsewhere has no record of its decoded contents.
+    await file_manager.client.upload(
+        "notebooks/external.txt",
+        utils._gzip(text.encode()),
+        "text/plain",
+        content_encoding="gzip",
+    )
+    file_manager.max_inline_content_size = len(text) - 1
+    for path in ["compressed.txt", "external.txt"]:
+        with pytest.raises(HTTPError) as e:
+            await file_manager.get_file(path, None, True, False)
+        assert e.value.status_code == 413
+    file_manager.max_inline_content_size = len(text)
+    model = await file_manager.get_file("external.txt", None, True, False)
+    assert model["content"] == text
+    await file_manager.close()
+
+
+def test_gzip_uploads(fake_gcs_file_manager, monkeypatch):
+    set_read_chunk_size(monkeypatch, 5)
+    file_manager = fake_gcs_file_manager
+    # Make every read go to GCS.
+    file_manager._content_cache.max_bytes = 0
+    text = "a line that compresses well\n" * 100
+    file_manager.create_file(text, "text/plain", "legacy.txt", None)
+
+    file_manager.gzip_uploads = True
+    file_manager.create_file(text, "text/plain", "compressed.txt", None)
+    compressed = file_manager._blob("compressed.txt")
+    assert compressed.content_encoding == "gzip"
+    assert compressed.size < len(text)
+    # A blob compressed elsewhere has no record of its decoded contents.
+    external = file_manager.bucket.blob("notebooks/external.txt")
+    external.content_encoding = "gzip"
+    external.upload_from_string(utils._gzip(text.encode()), content_type="text/plain")
+
+    for path in ["legacy.txt", "compressed.txt", "external.txt"]:
+        model = file_manager.get_file(path, None, True, True)
+        assert model["content"] == text
+        if path != "external.txt":
+            assert model["hash"] == utils._crc32c(text.encode())
+    assert file_manager.read_range("compressed.txt", 3, 30) == text.encode()[3:30]
+
+    # The size cap applies to the decoded contents, and is enforced while
+    # decompressing when their size is not known up front.
+    file_manager.max_inline_content_size = len(text) - 1
+    for path in ["compressed.txt", "external.txt"]:
+        with pytest.raises(HTTPError) as e:
+            file_manager.get_file(path, None, True, False)
+        assert e.value.status_code == 413
+
+
+def test_listing_cap(fake_gcs_file_manager):
+    file_manager = fake_gcs_file_manager
+    for i in range(4):
+        file_manager.create_file("", "text/plain", f"dir/file{i}.txt", None)
+    file_manager.mkdir("dir/subdir")
+
+    listed = file_manager.get_file("dir", None, True, False)
+    assert len(listed["content"]) == 5
+    assert "truncated" not in listed
+
+    file_manager.max_listing_entries = 3
+    listed = file_manager.get_file("dir", None, True, False)
+    assert listed["truncated"]
+    assert [child["path"] for child in listed["content"]] == [
+        "dir/file0.txt",
+        "dir/file1.txt",
+        "dir/file2.txt",
+    ]
+    compact = file_manager.get_file("dir", None, True, False, True)
+    assert [entry.name for entry in compact["content"]] == [
+        "file0.txt",
+        "file1.txt",
+        "file2.txt",
+    ]
+
+
+async def test_async_listing_cap(async_gcs_file_manager):
+    file_manager = async_gcs_file_manager
+    for i in range(4):
+        await file_manager.create_file("", "text/plain", f"dir/file{i}.txt", None)
+    await file_manager.mkdir("dir/subdir")
+
+    listed = await file_manager.get_file("dir", None, True, False)
+    assert len(listed["content"]) == 5
+    assert "truncated" not in listed
+
+    file_manager.max_listing_entries = 3
+    listed = await file_manager.get_file("dir", None, True, False)
+    assert listed["truncated"]
+    assert [child["path"] for child in listed["content"]] == [
+        "dir/file0.txt",
+        "dir/file1.txt",
+        "dir/file2.txt",
+    ]
+    compact = await file_manager.get_file("dir", None, True, False, True)
+    assert [entry.name for entry in compact["content"]] == [
+        "file0.txt",
+        "file1.txt",
+        "file2.txt",
+    ]
+    await file_manager.close()
+
+
+async def test_contents_manager_async_backend(fake_gcs_endpoint):
+    pytest.importorskip("aiohttp")
+    contents_manager = GCSContentsManager(
+        bucket_name="test-bucket",
+        storage_backend="asyncio",
+        storage_api_endpoint=fake_gcs_endpoint,
+    )
+    saved = await contents_manager.save(
+        {"type": "file", "format": "text", "content": "contents"}, "file.txt"
+    )
+    assert saved["name"] == "file.txt"
+    assert await contents_manager.file_exists("file.txt")
+    model = await contents_manager.get("file.txt")
+    assert model["content"] == "contents"
+    await contents_manager._file_manager.close()
+
+
+async def test_contents_manager_closed_on_server_shutdown(fake_gcs_endpoint):
+    pytest.importorskip("aiohttp")
+
+    class FakeServerApp(traitlets.config.Configurable):
+        async def cleanup_extensions(self):
+            pass
+
+    server_app = FakeServerApp()
+    contents_manager = GCSContentsManager(
+        parent=server_app,
+        bucket_name="test-bucket",
+        storage_backend="asyncio",
+        storage_api_endpoint=fake_gcs_endpoint,
+    )
+    await contents_manager.file_exists("file.txt")
+    session = contents_manager._file_manager.client._session
+    assert not session.closed
+    await server_app.cleanup_extensions()
+    assert session.closed
+
+
+async def test_async_client_retries(fake_gcs_endpoint, monkeypatch):
+    pytest.importorskip("aiohttp")
+    monkeypatch.setattr(async_client, "_INITIAL_RETRY_DELAY", 0)
+    client = async_client.AsyncGCSClient("test-bucket", api_endpoint=fake_gcs_endpoint)
+    send = client._send
+    failures = []
+
+    async def flaky_send(method, *args, **kwargs):
+        if len(failures) < 2:
+            failures.append(method)
+            raise async_client._RetryableResponse(503, b"unavailable")
+        return await send(method, *args, **kwargs)
+
+    client._send = flaky_send
+    await client.upload("retried.txt", b"contents", "text/plain", if_generation_match=0)
+    assert failures == ["POST", "POST"]
+    assert (await client.download("retried.txt"))[1] == b"contents"
+
+    # Writes without a generation precondition are not retried.
+    failures.clear()
+    with pytest.raises(HTTPError) as e:
+        await client.upload("retried.txt", b"changed", "text/plain")
+    assert e.value.status_code == 500
+    assert failures == ["POST"]
+    await client.close()
+
+
+async def test_combined_contents_manager_mounts(tmp_path, fake_gcs_endpoint):
+    pytest.importorskip("aiohttp")
+    gcs_mount = {
+        "type": "gcs",
+        "storage_backend": "asyncio",
+        "storage_api_endpoint": fake_gcs_endpoint,
+    }
+    mounts = {
+        "scratch": {"type": "local", "root_dir": str(tmp_path / "scratch")},
+        "team-a": dict(gcs_mount, bucket_name="team-a"),
+        "team-b": dict(gcs_mount, bucket_name="team-b", bucket_notebooks_path="nb"),
+    }
+    (tmp_path / "scratch").mkdir()
+    contents_manager = CombinedContentsManager(mounts=mounts)
+
+    root = await contents_manager.get("")
+    assert [child["name"] for child in root["content"]] == list(mounts)
+    for name in mounts:
+        await contents_manager.save(
+            {"type": "file", "format": "text", "content": name}, f"{name}/file.txt"
+        )
+    for name in mounts:
+        model = await contents_manager.get(f"{name}/file.txt")
+        assert model["content"] == name
+        assert model["path"] == f"{name}/file.txt"
+
+    # Listings of GCS directories are moved under the mount, without hidden files.
+    await contents_manager.save(
+        {"type": "file", "format": "text", "content": ""}, "team-a/.hidden"
+    )
+    listing = await contents_manager.get("team-a")
+    assert listing["path"] == "team-a"
+    assert [child["path"] for child in listing["content"]] == ["team-a/file.txt"]
+
+    # Every GCS mount has its own file manager and executors.
+    team_a = contents_manager._content_managers["team-a"]
+    team_b = contents_manager._content_managers["team-b"]
+    assert team_a._file_manager.bucket_name == "team-a"
+    assert team_b._file_manager.bucket_path_prefix == "nb"
+    assert team_a._executor is not team_b._executor
+    with pytest.raises(HTTPError):
+        await contents_manager.rename_file("team-a/file.txt", "team-b/file.txt")
+    for cm in [team_a, team_b]:
+        await cm._file_manager.close()
+
+    with pytest.raises(TraitError):
+        CombinedContentsManager(mounts={"bad": {"type": "gcs", "no_such": 1}})
+
+
+async def test_paginated_listing(tmp_path, fake_gcs_endpoint):
+    pytest.importorskip("aiohttp")
+    mounts = {
+        "team-a": {
+            "type": "gcs",
+            "bucket_name": "team-a",
+            "storage_backend": "asyncio",
+            "storage_api_endpoint": fake_gcs_endpoint,
+        },
+        "scratch": {"type": "local", "root_dir": str(tmp_path)},
+    }
+    contents_manager = CombinedContentsManager(mounts=mounts)
+    for name in ["a.txt", "b.ipynb", ".hidden", "c/d.txt", "e.txt"]:
+        await contents_manager.save(
+            {"type": "file", "format": "text", "content": ""}, f"team-a/dir/{name}"
+        )
+
+    paths = []
+    page_token = None
+    while True:
+        content, page_token = await contents_manager.list_page(
+            "team-a/dir", page_token, 2
+        )
+        assert len(content) <= 2
+        paths.extend(child["path"] for child in content)
+        if not page_token:
+            break
+    assert paths == [
+        "team-a/dir/a.txt",
+        "team-a/dir/b.ipynb",
+        "team-a/dir/c",
+        "team-a/dir/e.txt",
+    ]
+
+    with pytest.raises(HTTPError) as e:
+        await contents_manager.list_page("team-a/missing")
+    assert e.value.status_code == 404
+    with pytest.raises(HTTPError) as e:
+        await contents_manager.list_page("scratch")
+    assert e.value.status_code == 400
+    await contents_manager._content_managers["team-a"]._file_manager.close()
+
+
+async def test_combined_root_listing(tmp_path):
+    mounts = {}
+    for name in ["fast", "hung"]:
+        (tmp_path / name).mkdir()
+        mounts[name] = {"type": "local", "root_dir": str(tmp_path / name)}
+    contents_manager = CombinedContentsManager(mounts=mounts, mount_timeout=0.1)
+    hung = contents_manager._content_managers["hung"]
+    calls = []
+    original_get = hung.get
+
+    async def hung_get(*args, **kwargs):
+        calls.append(args)
+        await asyncio.sleep(60)
+
+    hung.get = hung_get
+    root = await asyncio.wait_for(contents_manager.get(""), 5)
+    # A mount that does not respond is listed anyway, and not cached.
+    assert [child["name"] for child in root["content"]] == ["fast", "hung"]
+    await contents_manager.get("")
+    assert len(calls) == 2
+
+    async def counting_get(*args, **kwargs):
+        calls.append(args)
+        return await original_get(*args, **kwargs)
+
+    hung.get = counting_get
+    for _ in range(3):
+        root = await contents_manager.get("")
+    assert [child["name"] for child in root["content"]] == ["fast", "hung"]
+    assert len(calls) == 3
+
+
+def test_shared_storage_client(monkeypatch, fake_gcs_endpoint):
+    monkeypatch.setattr(
+        google.auth,
+        "default",
+        lambda scopes=None: (google.auth.credentials.AnonymousCredentials(), None),
+    )
+    monkeypatch.setattr(files, "_storage_buckets", {})
+    file_managers = [
+        GCSBasedFileManager("test-project", "test-bucket", prefix, http_pool_size=8)
+        for prefix in ["a", "b"]
+    ]
+    other_bucket = GCSBasedFileManager(
+        "test-project", "other-bucket", "", http_pool_size=4
+    )
+    emulated = GCSBasedFileManager(
+        "test-project", "test-bucket", "", api_endpoint=fake_gcs_endpoint
+    )
+
+    # Handles are created without talking to GCS, and each bucket gets its
+    # own client whose connection pool is sized once.
+    assert file_managers[0].bucket is file_managers[1].bucket
+    assert other_bucket.bucket.client is not file_managers[0].bucket.client
+    adapter = file_managers[1].bucket.client._http.get_adapter("https://")
+    assert adapter._pool_maxsize == 8
+    assert other_bucket.bucket.client._http.get_adapter("https://")._pool_maxsize == 4
+
+    # Other endpoints are used without credentials.
+    assert emulated.bucket is not file_managers[0].bucket
+    assert emulated.bucket.client.api_endpoint == fake_gcs_endpoint
+    assert isinstance(
+        emulated.bucket.client._credentials,
+        google.auth.credentials.AnonymousCredentials,
+    )
+    assert emulated._bucket_metadata().name == "test-bucket"
+
+
+def test_instrumented_executor_metrics():
+    labels = {"pool": "test", "instance": uuid.uuid4().hex}
+    executor = InstrumentedExecutor("test", 1, labels["instance"])
+
+    def queue_depth():
+        return prometheus_client.REGISTRY.get_sample_value(
+            "gcs_contents_executor_queue_depth", labels
+        )
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    running = executor.submit(block)
+    started.wait()
+    queued = [executor.submit(lambda: None) for _ in range(3)]
+    assert queue_depth() == 3
+
+    # Operations that never run are no longer counted as queued.
+    queued[0].cancel()
+    assert queue_depth() == 2
+    executor.shutdown(wait=False, cancel_futures=True)
+    assert queue_depth() == 0
+    release.set()
+    running.result()
+    assert queue_depth() == 0
+    wait_count = prometheus_client.REGISTRY.get_sample_value(
+        "gcs_contents_executor_wait_seconds_count", labels
+    )
+    assert wait_count == 1
+
+
+def test_write_back_stager(tmp_path):
+    uploads = []
+
+    def upload(path, data, record):
+        uploads.append((path, data, record["content_type"]))
+
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    log = logging.getLogger("test")
+    stager = gcs_contents_manager.WriteBackStager(
+        str(tmp_path), 60, upload, executor, log
+    )
+    for version in [b"v1", b"v2", b"v3"]:
+        stager.stage("dir/file.txt", version, {"content_type": "text/plain"})
+    stager.stage("other.txt", b"other", {"content_type": "text/plain"})
+
+    # Reads see the latest staged version before anything is uploaded.
+    record, data = stager.get("dir/file.txt")
+    assert data == b"v3"
+    assert stager.record("dir/file.txt") == record
+    assert [r["path"] for r in stager.records_in("dir")] == ["dir/file.txt"]
+    assert uploads == []
+
+    # The repeated saves are coalesced into a single upload.
+    stager.flush("dir")
+    assert uploads == [("dir/file.txt", b"v3", "text/plain")]
+    assert stager.get("dir/file.txt") is None
+
+    # A new stager picks up (and immediately uploads) the saves left over
+    # by an earlier one.
+    recovered = gcs_contents_manager.WriteBackStager(
+        str(tmp_path), 60, upload, executor, log
+    )
+    recovered.flush("")
+    assert uploads[-1] == ("other.txt", b"other", "text/plain")
+    assert os.listdir(tmp_path) == []
+
+    # Flushing a save that is being discarded does not wait for it.
+    stager.stage("gone.txt", b"gone", {"content_type": "text/plain"})
+    stager._pending["gone.txt"].discarded = True
+    stager.flush("gone.txt")
+
+    stager.discard("")
+    executor.shutdown()
+
+
+def test_write_back_stager_concurrent_saves(tmp_path):
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    stager = gcs_contents_manager.WriteBackStager(
+        str(tmp_path), 60, lambda *args: None, executor, logging.getLogger("test")
+    )
+    write_durably = stager._write_durably
+    blocked = threading.Event()
+    release = threading.Event()
+
+    def slow_write(file_path, data):
+        if data == b"slow":
+            blocked.set()
+            release.wait(10)
+        write_durably(file_path, data)
+
+    stager._write_durably = slow_write
+    slow_save = threading.Thread(
+        target=stager.stage, args=("file.txt", b"slow", {"content_type": None})
+    )
+    slow_save.start()
+    blocked.wait(10)
+    # A later save is staged while the earlier one is still being written.
+    stager.stage("file.txt", b"fast", {"content_type": None})
+    assert slow_save.is_alive()
+    release.set()
+    slow_save.join()
+
+    # The earlier save does not replace the later one once it is written.
+    _, data = stager.get("file.txt")
+    assert data == b"fast"
+    assert len(os.listdir(tmp_path)) == 2
+    stager.discard("")
+    executor.shutdown()
+
+
+def test_metadata_index(tmp_path):
+    def gcs_object(name, generation=1):
+        return gcs_contents_manager.GCSObject(
+            {"name": name, "generation": generation, "updated": "2026-01-01T00:00:00Z"}
+        )
+
+    db_path = str(tmp_path / "index.db")
+    index = gcs_contents_manager.MetadataIndex(db_path, "bucket", "root/", 60)
+    MISSING = gcs_contents_manager.MetadataCache.MISSING
+    # Nothing is answered before the first refresh.
+    assert index.classify("root/a.txt") is MISSING
+
+    index.refresh(
+        [
+            [gcs_object("root/a.txt"), gcs_object("root/dir/b.txt")],
+            [gcs_object("root/dir/sub/c.txt"), gcs_object("root/e.txt")],
+        ]
+    )
+    assert index.classify("root/a.txt") == "file"
+    assert index.classify("root/dir") == "directory"
+    assert index.classify("root/missing") is None
+    objects, subdirs = index.list_dir("root", "root/")
+    assert [o.name for o in objects] == ["root/a.txt", "root/e.txt"]
+    assert subdirs == ["dir"]
+
+    # Local writes and deletes are reflected right away.
+    index.put(gcs_object("root/new.txt"))
+    index.remove("root/dir", recursive=True)
+    objects, subdirs = index.list_dir("root", "root/")
+    assert [o.name for o in objects] == ["root/a.txt", "root/e.txt", "root/new.txt"]
+    assert subdirs == []
+
+    # A stale page from before the delete does not bring the files back.
+    index.refresh([[gcs_object("root/a.txt"), gcs_object("root/dir/b.txt")]])
+    assert index.classify("root/dir") is None
+    assert index.classify("root/new.txt") is None
+
+    # Names touched by a write of unknown outcome are not answered for.
+    index.invalidate("root/a.txt")
+    assert index.classify("root/a.txt") is MISSING
+    assert index.list_dir("root", "root/") is MISSING
+    assert index.classify("root/dir/b.txt") is None
+    index.close()
+
+    # The index persists, but is not used once it is too old.
+    reopened = gcs_contents_manager.MetadataIndex(db_path, "bucket", "root/", 60)
+    assert reopened.classify("root/a.txt") == "file"
+    reopened.max_staleness = 0
+    assert reopened.classify("root/a.txt") is MISSING
+    reopened.close()
+
+
+def test_metadata_index_refresh_backoff(tmp_path, caplog):
+    def gcs_object(name):
+        return gcs_contents_manager.GCSObject({"name": name, "generation": 1})
+
+    now = [1000.0]
+    db_path = str(tmp_path / "index.db")
+    index = gcs_contents_manager.MetadataIndex(
+        db_path, "bucket", "root/", 60, clock=lambda: now[0]
+    )
+    # Indexes of other buckets can share the same database.
+    other = gcs_contents_manager.MetadataIndex(
+        db_path, "other-bucket", "root/", 60, clock=lambda: now[0]
+    )
+    assert index.refresh([[gcs_object("root/a.txt")]]) == 30
+    assert other.refresh([[gcs_object("root/b.txt")]]) == 30
+    assert index.classify("root/a.txt") == "file"
+    assert index.classify("root/b.txt") is None
+    assert other.classify("root/a.txt") is None
+    assert other.classify("root/b.txt") == "file"
+
+    def slow_pages():
+        now[0] += 90
+        yield [gcs_object("root/a.txt")]
+
+    # A refresh that takes longer than the maximum staleness is reported,
+    # and the next one is put off for twice as long as it took.
+    assert index.refresh(slow_pages()) == 180
+    assert "took 90 seconds" in caplog.text
+    assert index.classify("root/a.txt") is gcs_contents_manager.MetadataCache.MISSING
+    assert index.refresh([[gcs_object("root/a.txt")]]) == 30
+    assert index.classify("root/a.txt") == "file"
+    index.refresh_interval = 45
+    assert index.refresh([[gcs_object("root/a.txt")]]) == 45
+    index.close()
+    other.close()
+
+
+def test_metadata_index_closed_with_file_manager(tmp_path, fake_gcs_endpoint):
+    file_manager = GCSBasedFileManager(
+        "test-project",
+        "test-bucket",
+        "indexed",
+        api_endpoint=fake_gcs_endpoint,
+        metadata_index_path=str(tmp_path / "index.db"),
+        metadata_index_refresh_interval=3600,
+    )
+    file_manager.create_file("contents", "text/plain", "a.txt", None)
+    assert file_manager.file_exists("a.txt")
+    assert file_manager._index_refresher.is_alive()
+
+    # Closing wakes the refresher up rather than waiting out the interval.
+    file_manager.close()
+    assert not file_manager._index_refresher.is_alive()
+
+
+async def test_contents_manager_write_back(
+    tmp_path, gcs_project, gcs_bucket_name, gcs_notebook_path
+):
+    contents_manager = GCSContentsManager(
+        project=gcs_project,
+        bucket_name=gcs_bucket_name,
+        bucket_notebooks_path=gcs_notebook_path,
+        write_back_dir=str(tmp_path),
+        write_back_delay=60,
+    )
+    path = "staged.txt"
+    for version in ["v1", "v2"]:
+        await contents_manager.save(
+            {"type": "file", "format": "text", "content": version}, path
+        )
+    assert not contents_manager._file_manager.file_exists(path)
+    assert (await contents_manager.get(path))["content"] == "v2"
+    assert [c["name"] for c in (await contents_manager.get(""))["content"]] == [path]
+
+    # Creating a checkpoint uploads the staged save first.
+    await contents_manager.create_checkpoint(path)
+    contents, _ = contents_manager._file_manager.file_contents(path)
+    assert contents == b"v2"
+
+
+def test_delete_large_directory(gcs_file_manager):
+    # Enough objects to span multiple batch requests.
+    for i in range(150):
+        gcs_file_manager.create_file(
+            "", "text/plain", f"to-delete/{i % 3}/{i}.txt", None
+        )
+    gcs_file_manager.create_file("", "text/plain", "to-delete-sibling.txt", None)
+
+    gcs_file_manager.delete_file("to-delete")
+    assert not gcs_file_manager.dir_exists("to-delete")
+    # Paths that merely share a name prefix with the deleted directory are kept.
+    assert gcs_file_manager.file_exists("to-delete-sibling.txt")
+
+
+def test_chunk_cleanup_with_full_fanout_pool(fake_gcs_endpoint):
+    file_manager = GCSBasedFileManager(
+        "test-project",
+        "test-bucket",
+        "notebooks",
+        fanout_threads=1,
+        api_endpoint=fake_gcs_endpoint,
+    )
+    for name in ["first.txt", "second.txt"]:
+        for chunk in [1, 2, -1]:
+            file_manager.create_file(f"chunk#{chunk},", "text/plain", name, chunk)
+
+    # The cleanup of the chunks must not wait on the pool it is running on.
+    for _ in range(100):
+        chunks = list(file_manager.bucket.list_blobs(prefix="notebooks/.chunks/"))
+        if not chunks:
+            break
+        time.sleep(0.1)
+    assert chunks == []
+    uploaded = file_manager.get_file("second.txt", "file", True, False)
+    assert uploaded["content"] == "chunk#1,chunk#2,chunk#-1,"
+
+
+def test_inactive_upload_sessions_expire(fake_gcs_endpoint):
+    file_manager = GCSBasedFileManager(
+        "test-project",
+        "test-bucket",
+        "notebooks",
+        chunked_upload_mode="resumable",
+        upload_session_timeout=0.2,
+        api_endpoint=fake_gcs_endpoint,
+    )
+    file_manager.create_file("chunk#1,", "text/plain", "abandoned.txt", 1)
+    assert file_manager._upload_sessions
+
+    # Sessions are swept even if no further chunks arrive.
+    for _ in range(50):
+        if not file_manager._upload_sessions:
+            break
+        time.sleep(0.1)
+    assert not file_manager._upload_sessions
+    with pytest.raises(HTTPError) as error:
+        file_manager.create_file("chunk#-1,", "text/plain", "abandoned.txt", -1)
+    assert error.value.status_code == 400
+
+
+def test_delete_blobs_ignores_stale_blobs(fake_gcs_file_manager):
+    file_manager = fake_gcs_file_manager
+    for i in range(3):
+        file_manager.create_file(f"{i}", "text/plain", f"stale/{i}.txt", None)
+    blobs = list(file_manager.bucket.list_blobs(prefix="notebooks/stale/"))
+
+    # One blob is deleted and another overwritten after being listed.
+    file_manager.bucket.blob("notebooks/stale/0.txt").delete()
+    file_manager.bucket.blob("notebooks/stale/1.txt").upload_from_string("new")
+
+    file_manager._delete_blobs(blobs, if_unchanged=True)
+    remaining = [blob.name for blob in file_manager.bucket.list_blobs()]
+    assert remaining == ["notebooks/stale/1.txt"]
+
+
+def test_delete_blobs_bounds_batches_in_flight(fake_gcs_endpoint, monkeypatch):
+    monkeypatch.setattr(files, "_MAX_BATCH_SIZE", 2)
+    file_manager = GCSBasedFileManager(
+        "test-project",
+        "test-bucket",
+        "notebooks",
+        api_endpoint=fake_gcs_endpoint,
+        fanout_threads=2,
+    )
+    for i in range(12):
+        file_manager.create_file(f"{i}", "text/plain", f"many/{i}.txt", None)
+    submit = file_manager._fanout_executor.submit
+    submitted = []
+    peak_in_flight = [0]
+
+    def counting_submit(fn, *args):
+        in_flight = sum(not future.done() for future in submitted) + 1
+        peak_in_flight[0] = max(peak_in_flight[0], in_flight)
+        future = submit(fn, *args)
+        submitted.append(future)
+        return future
+
+    file_manager._fanout_executor.submit = counting_submit
+    file_manager._delete_blobs(file_manager.bucket.list_blobs(prefix="notebooks/many/"))
+    assert len(submitted) == 6
+    assert peak_in_flight[0] <= 2
+    assert list(file_manager.bucket.list_blobs(prefix="notebooks/many/")) == []
+
+
+def test_rename_with_separate_copy_pool(fake_gcs_endpoint):
+    file_manager = GCSBasedFileManager(
+        "test-project",
+        "test-bucket",
+        "notebooks",
+        fanout_threads=1,
+        copy_concurrency=4,
+        api_endpoint=fake_gcs_endpoint,
+    )
+    for i in range(120):
+        file_manager.create_file(f"{i}", "text/plain", f"old/{i}.txt", None)
+
+    file_manager.rename_file("old", "new")
+    assert not file_manager.dir_exists("old")
+    assert len(file_manager.list_dir("new", True)["content"]) == 120
+    assert file_manager._copy_executor._max_workers == 4
+
+
+def test_rename_large_directory(gcs_file_manager):
+    for i in range(60):
+        gcs_file_manager.create_file(
+            f"{i}", "text/plain", f"to-rename/{i % 3}/{i}.txt", None
+        )
+    gcs_file_manager.create_file("", "text/plain", "to-rename-sibling.txt", None)
+
+    gcs_file_manager.rename_file("to-rename", "renamed")
+    assert not gcs_file_manager.dir_exists("to-rename")
+    assert gcs_file_manager.file_exists("to-rename-sibling.txt")
+    for i in range(60):
+        contents, _ = gcs_file_manager.file_contents(f"renamed/{i % 3}/{i}.txt")
+        assert contents == f"{i}".encode()
+
+
+async def test_server_side_checkpoints(gcs_project, gcs_bucket_name, gcs_notebook_path):
+    contents_manager = GCSContentsManager(
+        project=gcs_project,
+        bucket_name=gcs_bucket_name,
+        bucket_notebooks_path=gcs_notebook_path,
+    )
+    path = "checkpointed.txt"
+    await contents_manager.save(
+        {"type": "file", "format": "text", "content": "original"}, path
+    )
+    checkpoint = await contents_manager.create_checkpoint(path)
+    await contents_manager.save(
+        {"type": "file", "format": "text", "content": "modified"}, path
+    )
+
+    await contents_manager.restore_checkpoint(checkpoint["id"], path)
+    restored = await contents_manager.get(path)
+    assert restored["content"] == "original"
+    await contents_manager.delete_checkpoint(checkpoint["id"], path)
+
+
+async def test_versioned_checkpoints(
+    gcs_bucket, gcs_project, gcs_bucket_name, gcs_notebook_path
+):
+    if not gcs_bucket.versioning_enabled:
+        pytest.skip("Object versioning is not enabled for the test bucket")
+    contents_manager = GCSContentsManager(
+        project=gcs_project,
+        bucket_name=gcs_bucket_name,
+        bucket_notebooks_path=gcs_notebook_path,
+        checkpoint_mode="versions",
+        checkpoint_retention=2,
+    )
+    path = "versioned.txt"
+    checkpoint_ids = []
+    for version in ["v1", "v2", "v3"]:
+        await contents_manager.save(
+            {"type": "file", "format": "text", "content": version}, path
+        )
+        checkpoint = await contents_manager.create_checkpoint(path)
+        checkpoint_ids.append(checkpoint["id"])
+
+    # Only the most recent checkpoints are retained.
+    checkpoints = await contents_manager.list_checkpoints(path)
+    assert [c["id"] for c in checkpoints] == checkpoint_ids[1:]
+
+    await contents_manager.restore_checkpoint(checkpoint_ids[1], path)
+    restored = await contents_manager.get(path)
+    assert restored["content"] == "v2"
+
+    await contents_manager.delete(path)
+    assert await contents_manager.list_checkpoints(path) == []
+
+
+async def test_pruned_checkpoint_versions_are_deleted(fake_gcs_endpoint):
+    contents_manager = GCSContentsManager(
+        bucket_name="test-bucket",
+        storage_api_endpoint=fake_gcs_endpoint,
+        checkpoint_mode="versions",
+        checkpoint_retention=2,
+    )
+    bucket = contents_manager._file_manager.bucket
+    bucket.versioning_enabled = True
+    bucket.patch()
+    path = "versioned.txt"
+
+    def stored_generations():
+        return sorted(
+            blob.generation
+            for blob in bucket.client.list_blobs(bucket, prefix=path, versions=True)
+        )
+
+    checkpoint_ids = []
+    for version in ["v1", "v2", "v3"]:
+        await contents_manager.save(
+            {"type": "file", "format": "text", "content": version}, path
+        )
+        checkpoint = await contents_manager.create_checkpoint(path)
+        checkpoint_ids.append(checkpoint["id"])
+    checkpoints = await contents_manager.list_checkpoints(path)
+    assert [c["id"] for c in checkpoints] == checkpoint_ids[1:]
+    assert stored_generations() == [int(i) for i in checkpoint_ids[1:]]
+
+    # The checkpoint of the live version is only deleted once it is noncurrent.
+    await contents_manager.delete_checkpoint(checkpoint_ids[2], path)
+    assert await contents_manager.list_checkpoints(path) == [checkpoints[0]]
+    await contents_manager.save(
+        {"type": "file", "format": "text", "content": "v4"}, path
+    )
+    checkpoint = await contents_manager.create_checkpoint(path)
+    assert stored_generations() == [int(checkpoint_ids[1]), int(checkpoint["id"])]
@@ -0,0 +1,90 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare the default and fast notebook serialization paths.
+
+Usage:
+
+    python notebook_io_benchmark.py [--cells N] [--repeat N]
+
+This measures only the CPU cost of converting notebooks to and from bytes,
+which is what `GCSContentsManager.fast_notebook_io` changes, and of
+reopening a notebook that is in the content cache; no GCS requests are
+made.
+"""
+
+import argparse
+import json
+import timeit
+
+import nbformat
+
+from gcs_contents_manager import ContentCache
+from gcs_contents_manager.utils import _read_notebook, _write_notebook, orjson
+
+
+def make_notebook(cell_count):
+    cells = []
+    for i in range(cell_count):
+        cell = nbformat.v4.new_code_cell(
+            source="\n".join(f"value_{i}_{j} = {j} * {i}" for j in range(10)),
+            execution_count=i,
+        )
+        cell.outputs = [
+            nbformat.v4.new_output(
+                "stream", name="stdout", text="".join(f"line {j}\n" for j in range(20))
+            ),
+            nbformat.v4.new_output(
+                "execute_result",
+                data={"text/plain": f"result {i}", "text/html": f"<b>{i}</b>"},
+                execution_count=i,
+            ),
+        ]
+        cells.append(cell)
+        cells.append(nbformat.v4.new_markdown_cell(f"## Section {i}\n\nSome text."))
+    return nbformat.v4.new_notebook(cells=cells)
+
+
+def measure(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cells", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    nb = make_notebook(args.cells)
+    # Notebooks arrive from the frontend as plain dicts.
+    nb_dict = json.loads(json.dumps(nb))
+    print(f"{args.cells * 2} cells, JSON codec: {'orjson' if orjson else 'json'}")
+    for fast in (False, True):
+        content = _write_notebook(nb_dict, fast)
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        write_ms = measure(lambda: _write_notebook(nb_dict, fast), args.repeat)
+        read_ms = measure(lambda: _read_notebook(content, fast), args.repeat)
+        cache = ContentCache(10 * len(content))
+        cache.put("nb", 1, content)
+        cache.put_notebook("nb", 1, _read_notebook(content, fast))
+        hit_ms = measure(lambda: cache.get_notebook("nb", 1), args.repeat)
+        label = "fast" if fast else "default"
+        print(
+            f"{label:>8}: write {write_ms:8.1f} ms, read {read_ms:8.1f} ms, "
+            f"cache hit {hit_ms:8.1f} ms, {len(content) / 1024:8.0f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -10,14 +10,20 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/GoogleCloudPlatform/jupyter-extensions",
-    py_modules=["gcs_contents_manager"],
+    packages=["gcs_contents_manager"],
     license="Apache License 2.0",
     python_requires=">=2.7",
     install_requires=[
         "google-cloud-storage",
+        "google-crc32c",
         "nbformat",
+        "prometheus_client",
         "jupyter_server",
         "traitlets",
         "tornado",
     ],
+    extras_require={
+        "asyncio": ["aiohttp"],
+        "fast": ["orjson"],
+    },
 )